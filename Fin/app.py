@@ -1,9 +1,12 @@
+import os
+import tempfile
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 import database as db
+from formatting import format_currency
 
 # Page config
 st.set_page_config(
@@ -12,43 +15,76 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize database
+# Initialize database (a no-op once the schema is current)
 db.init_db()
 
 # Session state for user
 if 'user_id' not in st.session_state:
     user = db.get_user_by_email('test@example.com')
+    if not user:
+        db.seed_sample_data('test@example.com')
+        user = db.get_user_by_email('test@example.com')
     if user:
         st.session_state.user_id = user['user_id']
         st.session_state.user_name = user['full_name']
 
+# Totals and charts are in the user's base currency
+base_currency = db.get_base_currency(st.session_state.user_id)
+
 # Sidebar navigation
 st.sidebar.title("💰 Expense Tracker")
 st.sidebar.write(f"Welcome, {st.session_state.user_name}!")
 
 page = st.sidebar.radio(
     "Navigation",
-    ["Dashboard", "Transactions", "Add Transaction", "Accounts", "Categories", "Analytics"]
+    ["Dashboard", "Transactions", "Add Transaction", "Import", "Accounts", "Categories", "Budgets", "Analytics"]
 )
 
-# Helper function to format currency
-def format_currency(amount):
-    return f"₹{amount:,.2f}"
+# Query instrumentation costs nothing until it is switched on here; the
+# numbers are shown at the bottom of the sidebar once the page has run.
+# These switch module settings for the whole server process, i.e. every
+# browser session, so they are only offered when it runs with FIN_DEBUG=1.
+DEBUG_TOOLS = os.environ.get('FIN_DEBUG') == '1'
+if DEBUG_TOOLS:
+    with st.sidebar.expander("🔧 Debug"):
+        st.caption("Applies to every session on this server")
+        instrument = st.toggle("Instrument queries", value=db.instrumentation_enabled())
+        slow_ms = st.number_input("Slow query threshold (ms)", min_value=1, value=int(db.SLOW_QUERY_MS), step=10)
+        snapshot_reads = st.toggle("Analytics from snapshot", value=db.SNAPSHOT_READS,
+                                   help="Charts and summaries read a periodically refreshed copy of the database")
+    if instrument:
+        db.enable_instrumentation(slow_ms=slow_ms)
+    elif db.instrumentation_enabled():
+        db.disable_instrumentation()
+    db.SNAPSHOT_READS = snapshot_reads
+
+# Shown under the title of the pages whose figures may come from the snapshot
+snapshot_note = None
+if db.SNAPSHOT_READS:
+    snapshot = db.snapshot_status()
+    if snapshot['in_use']:
+        snapshot_note = f"Figures as of a snapshot taken {snapshot['age']:.0f}s ago"
+    else:
+        snapshot_note = "Snapshot is being refreshed; figures are live"
 
 # Dashboard Page
 if page == "Dashboard":
     st.title("📊 Dashboard")
+    if snapshot_note:
+        st.caption(snapshot_note)
     
     # Get current month data
     today = date.today()
     first_day = date(today.year, today.month, 1)
+    last_day = (first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
     
     # Summary cards
     col1, col2, col3, col4 = st.columns(4)
     
     # Get accounts
-    accounts = db.get_accounts(st.session_state.user_id)
-    total_balance = sum(acc['balance'] for acc in accounts)
+    df_accounts = db.get_accounts_frame(st.session_state.user_id)
+    df_accounts['balance'] = db.convert_amounts(df_accounts['balance'], df_accounts['currency'], base_currency)
+    total_balance = df_accounts['balance'].sum()
     
     # Get monthly summary
     monthly_data = db.get_monthly_summary(st.session_state.user_id, today.year, today.month)
@@ -62,17 +98,18 @@ if page == "Dashboard":
             monthly_expense = row['total']
     
     with col1:
-        st.metric("Total Balance", format_currency(total_balance))
+        st.metric("Total Balance", format_currency(total_balance, currency=base_currency))
     
     with col2:
-        st.metric("Monthly Income", format_currency(monthly_income))
+        st.metric("Monthly Income", format_currency(monthly_income, currency=base_currency))
     
     with col3:
-        st.metric("Monthly Expenses", format_currency(monthly_expense))
+        st.metric("Monthly Expenses", format_currency(monthly_expense, currency=base_currency))
     
     with col4:
         net = monthly_income - monthly_expense
-        st.metric("Net This Month", format_currency(net), delta=format_currency(net))
+        st.metric("Net This Month", format_currency(net, currency=base_currency),
+                  delta=format_currency(net, currency=base_currency))
     
     st.divider()
     
@@ -81,14 +118,13 @@ if page == "Dashboard":
     
     with col1:
         st.subheader("Spending by Category")
-        spending_data = db.get_spending_by_category(
+        df = db.get_spending_by_category_frame(
             st.session_state.user_id,
             start_date=first_day,
-            end_date=today
+            end_date=last_day
         )
         
-        if spending_data:
-            df = pd.DataFrame(spending_data)
+        if len(df) > 0:
             fig = px.pie(df, values='total', names='name', title='Current Month')
             st.plotly_chart(fig, use_container_width=True)
         else:
@@ -96,22 +132,40 @@ if page == "Dashboard":
     
     with col2:
         st.subheader("Account Balances")
-        if accounts:
-            df_accounts = pd.DataFrame([dict(acc) for acc in accounts])
-            fig = px.bar(df_accounts, x='name', y='balance', title='All Accounts')
+        if len(df_accounts) > 0:
+            fig = px.bar(df_accounts, x='name', y='balance', title=f'All Accounts ({base_currency})')
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No accounts found")
     
+    # Twelve-month trend in a single query
+    st.subheader("Income vs Expenses")
+    trend_start = date(today.year - 1, today.month, 1) + timedelta(days=31)
+    df_trend = db.get_period_summaries_frame(
+        st.session_state.user_id,
+        start_date=trend_start.replace(day=1),
+        end_date=last_day,
+        granularity='month'
+    )
+    
+    if len(df_trend) > 0:
+        fig = go.Figure()
+        fig.add_bar(x=df_trend['period'], y=df_trend['income'], name='Income')
+        fig.add_bar(x=df_trend['period'], y=df_trend['expense'], name='Expenses')
+        fig.add_scatter(x=df_trend['period'], y=df_trend['net'], name='Net', mode='lines+markers')
+        fig.update_layout(barmode='group', title='Last 12 Months')
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info("No transactions in the last 12 months")
+    
     # Recent transactions
     st.subheader("Recent Transactions")
-    transactions = db.get_transactions(st.session_state.user_id, limit=10)
+    df_txn = db.get_transactions_frame(st.session_state.user_id, limit=10)
     
-    if transactions:
-        df_txn = pd.DataFrame([dict(t) for t in transactions])
-        df_txn['amount_display'] = df_txn.apply(
-            lambda x: f"-{format_currency(x['amount'])}" if x['txn_type'] == 'expense' 
-            else format_currency(x['amount']), axis=1
+    if len(df_txn) > 0:
+        df_txn['txn_date'] = df_txn['txn_date'].dt.date
+        df_txn['amount_display'] = format_currency(
+            df_txn['amount'], negative=df_txn['txn_type'] == 'expense', currency=df_txn['currency']
         )
         st.dataframe(
             df_txn[['txn_date', 'description', 'category_name', 'account_name', 'amount_display']],
@@ -126,48 +180,189 @@ elif page == "Transactions":
     st.title("📝 Transactions")
     
     # Filters
-    col1, col2, col3 = st.columns(3)
+    accounts = db.get_accounts(st.session_state.user_id)
+    account_options = {"All": None}
+    account_options.update({acc['name']: acc['account_id'] for acc in accounts})
+    categories = db.get_categories(st.session_state.user_id)
+    category_options = {"All": None}
+    category_options.update({f"{cat['name']} ({cat['kind']})": cat['category_id'] for cat in categories})
+    merchants = db.get_merchants(st.session_state.user_id)
+    merchant_options = {"All": None}
+    merchant_options.update({m['name']: m['merchant_id'] for m in merchants})
+    tag_options = {t['name']: t['tag_id'] for t in db.get_tags(st.session_state.user_id)}
+    
+    search = st.text_input("🔍 Search", placeholder="Description, notes or merchant")
+    
+    col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         txn_type_filter = st.selectbox("Type", ["All", "expense", "income", "transfer"])
+        account_filter = st.selectbox("Account", list(account_options.keys()))
+    with col2:
+        category_filter = st.selectbox("Category", list(category_options.keys()))
+        merchant_filter = st.selectbox("Merchant", list(merchant_options.keys()))
+    with col3:
+        start_filter = st.date_input("From", value=None)
+        end_filter = st.date_input("To", value=None)
+    with col4:
+        min_amount = st.number_input("Min amount", min_value=0.0, value=0.0, step=100.0)
+        max_amount = st.number_input("Max amount", min_value=0.0, value=0.0, step=100.0,
+                                     help="0 means no limit")
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        tag_filter = st.multiselect("Tags", list(tag_options.keys()))
+    with col2:
+        tag_match = st.radio("Match", ["Any tag", "All tags"], horizontal=True)
+    tag_ids = [tag_options[name] for name in tag_filter]
+    
+    filters = {
+        'txn_type': None if txn_type_filter == "All" else txn_type_filter,
+        'account_id': account_options[account_filter],
+        'category_id': category_options[category_filter],
+        'merchant_id': merchant_options[merchant_filter],
+        'start_date': start_filter,
+        'end_date': end_filter,
+        'min_amount': min_amount or None,
+        'max_amount': max_amount or None,
+        'tags_any': tag_ids if tag_match == "Any tag" else None,
+        'tags_all': tag_ids if tag_match == "All tags" else None,
+    }
+    
+    # Cursor for each page visited so far; start over when the search or filters change
+    if st.session_state.get('txn_filters') != (search, filters):
+        st.session_state.txn_filters = (search, filters)
+        st.session_state.txn_cursors = [None]
+    cursors = st.session_state.txn_cursors
     
-    # Get transactions
-    transactions = db.get_transactions(st.session_state.user_id, limit=100)
+    # Get transactions; best matches first when searching, otherwise newest first
+    transactions, next_cursor = db.search_transactions(
+        st.session_state.user_id, search, filters, cursor=cursors[-1]
+    )
+    if search and db.SEARCH_RANK_WINDOW:
+        st.caption(f"Matches are ranked by relevance {db.SEARCH_RANK_WINDOW} at a time, most recent first; "
+                   "Older → continues with earlier matches")
     
     if transactions:
         df = pd.DataFrame([dict(t) for t in transactions])
         
-        # Apply filters
-        if txn_type_filter != "All":
-            df = df[df['txn_type'] == txn_type_filter]
-        
         # Display
-        df['amount_display'] = df.apply(
-            lambda x: f"-{format_currency(x['amount'])}" if x['txn_type'] == 'expense' 
-            else format_currency(x['amount']), axis=1
+        df['amount_display'] = format_currency(df['amount'], negative=df['txn_type'] == 'expense',
+                                               currency=df['currency'])
+        page_tags = db.get_transaction_tags(st.session_state.user_id, df['transaction_id'].tolist())
+        
+        df['tags'] = [" ".join(f"#{name}" for name in page_tags.get(transaction_id, []))
+                      for transaction_id in df['transaction_id']]
+        df['delete'] = False
+        # Archived transactions are read-only; their ticks are ignored
+        horizon = db.archive_horizon()
+        df['archived'] = df['txn_date'].str[:10] < horizon.isoformat() if horizon else False
+        
+        # One grid for the page; tick rows and delete them in a single write.
+        # The key changes with the page so ticks never carry over to other rows.
+        grid_key = f"txn_grid_{hash((search, str(filters), str(cursors[-1]), st.session_state.get('txn_deletes')))}"
+        edited = st.data_editor(
+            df[['delete', 'archived', 'txn_date', 'description', 'tags', 'category_name', 'account_name',
+                'amount_display']],
+            column_config={
+                'delete': st.column_config.CheckboxColumn("🗑️", width="small"),
+                'archived': st.column_config.CheckboxColumn("🔒", width="small", help="Archived, read-only"),
+                'txn_date': "Date",
+                'description': "Description",
+                'tags': "Tags",
+                'category_name': "Category",
+                'account_name': "Account",
+                'amount_display': "Amount",
+            },
+            disabled=['archived', 'txn_date', 'description', 'tags', 'category_name', 'account_name',
+                      'amount_display'],
+            hide_index=True, use_container_width=True, key=grid_key,
         )
+        locked = int((edited['delete'] & df['archived']).sum())
+        if locked:
+            st.warning(f"{locked} ticked transactions are archived and cannot be deleted")
+        to_delete = df.loc[edited['delete'] & ~df['archived'], 'transaction_id'].tolist()
+        if st.button(f"Delete {len(to_delete)} selected", disabled=not to_delete):
+            deleted = db.delete_transactions(st.session_state.user_id, to_delete)
+            st.session_state.txn_deletes = st.session_state.get('txn_deletes', 0) + 1
+            st.success(f"Deleted {deleted} transactions")
+            st.rerun()
         
-        # Add delete button column
-        for idx, row in df.iterrows():
-            col1, col2, col3, col4, col5, col6 = st.columns([2, 2, 2, 2, 2, 1])
-            
+        # Bulk tagging for the rows on this page
+        with st.expander("🏷️ Tag transactions"):
+            labels = {
+                row['transaction_id']: f"{row['txn_date']} · {row['description'] or '-'} · {row['amount_display']}"
+                for _, row in df.iterrows()
+            }
+            selected = st.multiselect("Transactions", list(labels.keys()), default=list(labels.keys()),
+                                      format_func=labels.get)
+            chosen_tags = st.multiselect("Tags to add or remove", list(tag_options.keys()), key="bulk_tags")
+            col1, col2 = st.columns(2)
             with col1:
-                st.write(row['txn_date'])
+                if st.button("Add tags", disabled=not (selected and chosen_tags)):
+                    added = db.tag_transactions(st.session_state.user_id, selected,
+                                                [tag_options[name] for name in chosen_tags])
+                    st.success(f"Added {added} tags")
+                    st.rerun()
             with col2:
-                st.write(row['description'] or '-')
-            with col3:
-                st.write(row['category_name'] or '-')
-            with col4:
-                st.write(row['account_name'])
-            with col5:
-                st.write(row['amount_display'])
-            with col6:
-                if st.button("🗑️", key=f"del_{row['transaction_id']}"):
-                    if db.delete_transaction(row['transaction_id'], st.session_state.user_id):
-                        st.success("Deleted!")
-                        st.rerun()
+                if st.button("Remove tags", disabled=not (selected and chosen_tags)):
+                    removed = db.untag_transactions(st.session_state.user_id, selected,
+                                                    [tag_options[name] for name in chosen_tags])
+                    st.success(f"Removed {removed} tags")
+                    st.rerun()
     else:
         st.info("No transactions found")
+    
+    # Paging
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("← Newer", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {len(cursors)}")
+    with col3:
+        if st.button("Older →", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
+    
+    # The export is streamed from the database into a temporary file on disk
+    # rather than built up in memory; it uses the filters above, not the search.
+    # st.download_button still reads the finished file into memory to serve it.
+    def discard_export():
+        # Removes the last prepared export file, if any
+        export = st.session_state.pop('export', None)
+        if export and os.path.exists(export[0]):
+            os.remove(export[0])
+    
+    with st.expander("⬇️ Export"):
+        export_format = st.radio("Format", ["csv", "parquet"], horizontal=True,
+                                 format_func=lambda f: "CSV" if f == "csv" else "Parquet")
+        if st.session_state.get('export_key') != (filters, export_format):
+            discard_export()
+        if st.button("Prepare export"):
+            discard_export()
+            fd, export_path = tempfile.mkstemp(suffix=f".{export_format}")
+            os.close(fd)
+            try:
+                with st.spinner("Exporting..."):
+                    count = db.export_transactions(st.session_state.user_id, export_path, export_format,
+                                                   filters=filters)
+            except ImportError:
+                os.remove(export_path)
+                st.error("Parquet export needs pyarrow: pip install pyarrow")
+            else:
+                st.session_state.export = (export_path, count)
+                st.session_state.export_key = (filters, export_format)
+        if 'export' in st.session_state:
+            export_path, count = st.session_state.export
+            with open(export_path, 'rb') as export_file:
+                st.download_button(
+                    f"Download {count:,} transactions",
+                    data=export_file,
+                    file_name=f"transactions.{export_format}",
+                    mime="text/csv" if export_format == "csv" else "application/octet-stream",
+                )
 
 # Add Transaction Page
 elif page == "Add Transaction":
@@ -194,10 +389,12 @@ elif page == "Add Transaction":
             merchant_name = st.selectbox("Merchant", list(merchant_options.keys()))
         
         with col2:
-            amount = st.number_input("Amount (₹)", min_value=0.01, value=10.0, step=0.01)
+            amount = st.number_input("Amount", min_value=0.01, value=10.0, step=0.01,
+                                     help="In the account's currency")
             txn_date = st.date_input("Date", value=date.today())
             description = st.text_input("Description")
             notes = st.text_area("Notes")
+            allow_duplicate = st.checkbox("Add even if it is already recorded")
         
         submitted = st.form_submit_button("Add Transaction")
         
@@ -206,23 +403,157 @@ elif page == "Add Transaction":
             category_id = category_options[category_name]
             merchant_id = merchant_options[merchant_name]
             
-            txn_id = db.add_transaction(
+            duplicate_id = None if allow_duplicate else db.find_duplicate(
+                st.session_state.user_id, account_id, txn_type, amount, txn_date, description
+            )
+            if duplicate_id:
+                st.warning(f"The same transaction is already recorded (#{duplicate_id}); "
+                           "tick the box to add it again")
+            else:
+                txn_id = db.add_transaction(
+                    st.session_state.user_id,
+                    account_id,
+                    txn_type,
+                    amount,
+                    txn_date,
+                    category_id=category_id,
+                    merchant_id=merchant_id,
+                    description=description,
+                    notes=notes
+                )
+            
+                if txn_id:
+                    st.success("Transaction added successfully!")
+                    st.balloons()
+                else:
+                    st.error("Failed to add transaction")
+
+# Import Page
+elif page == "Import":
+    st.title("📥 Import Statement")
+    st.caption("CSV with date, description and amount (or debit/credit) columns, or an OFX/QFX export.")
+    
+    accounts = db.get_accounts(st.session_state.user_id)
+    account_options = {f"{acc['name']}": acc['account_id'] for acc in accounts}
+    account_currencies = {acc['name']: acc['currency'] for acc in accounts}
+    
+    with st.form("import_statement"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            uploaded = st.file_uploader("Statement file", type=["csv", "ofx", "qfx"])
+            account_name = st.selectbox("Account", list(account_options.keys()))
+        
+        with col2:
+            chunk_size = st.number_input("Rows per batch", min_value=100, value=db.IMPORT_CHUNK_SIZE, step=100)
+            dry_run = st.checkbox("Dry run (validate only, write nothing)")
+            categorize = st.checkbox("Categorize with my rules", value=True)
+            skip_duplicates = st.checkbox("Skip rows that are already recorded", value=True)
+            window_days = st.number_input("Flag same-amount rows within (days)", min_value=0,
+                                          value=db.DUPLICATE_WINDOW_DAYS, step=1)
+        
+        submitted = st.form_submit_button("Import")
+    
+    if submitted and uploaded:
+        status = st.empty()
+        
+        def show_progress(result):
+            status.write(f"Processed {result['imported']:,} rows in {result['batches']} batches...")
+        
+        try:
+            result = db.import_transactions(
                 st.session_state.user_id,
-                account_id,
-                txn_type,
-                amount,
-                txn_date,
-                category_id=category_id,
-                merchant_id=merchant_id,
-                description=description,
-                notes=notes
+                account_options[account_name],
+                db.read_statement(uploaded, uploaded.name),
+                chunk_size=int(chunk_size),
+                dry_run=dry_run,
+                progress=show_progress,
+                categorize=categorize,
+                skip_duplicates=skip_duplicates,
+                window_days=int(window_days)
             )
+        except ValueError as e:
+            st.error(f"Import failed: {e}")
+        else:
+            status.empty()
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Rows", f"{result['imported']:,}")
+            with col2:
+                st.metric("Income", format_currency(result['income'], currency=account_currencies[account_name]))
+            with col3:
+                st.metric("Expenses", format_currency(result['expense'], currency=account_currencies[account_name]))
+            with col4:
+                st.metric("Skipped", f"{result['skipped']:,}")
+            
+            if result['duplicates']:
+                st.info(f"{result['duplicates']:,} rows were already recorded and left out")
+            if result['possible_duplicates']:
+                st.warning(f"{result['possible_duplicates']:,} rows match an existing transaction's amount "
+                           f"within {int(window_days)} days:")
+                st.dataframe(
+                    pd.DataFrame(result['possible_duplicate_rows'], columns=['Line', 'Existing transaction']),
+                    use_container_width=True,
+                    hide_index=True
+                )
             
-            if txn_id:
-                st.success("Transaction added successfully!")
-                st.balloons()
+            if result['errors']:
+                st.warning("Some rows were skipped:")
+                st.dataframe(
+                    pd.DataFrame(result['errors'], columns=['Line', 'Problem']),
+                    use_container_width=True,
+                    hide_index=True
+                )
+            
+            if dry_run:
+                delta = format_currency(result['balance_delta'], currency=account_currencies[account_name])
+                st.info(f"Dry run: balance would change by {delta}")
             else:
-                st.error("Failed to add transaction")
+                st.success(f"Imported {result['imported']:,} transactions, "
+                           f"{result['categorized']:,} categorized by rules")
+    
+    # Copies already in the history, e.g. from overlapping imports before
+    # duplicates were skipped
+    st.divider()
+    st.subheader("Duplicates")
+    report_window = st.number_input("Also match the same amount within (days)", min_value=0, value=0, step=1,
+                                    key="duplicate_window")
+    if st.button("Find duplicates"):
+        st.session_state.duplicates = [dict(row) for row in db.get_duplicates(st.session_state.user_id,
+                                                                              int(report_window))]
+    if 'duplicates' in st.session_state:
+        duplicates = st.session_state.duplicates
+        if duplicates:
+            st.dataframe(pd.DataFrame(duplicates), use_container_width=True, hide_index=True)
+            # Archived copies are read-only and stay
+            horizon = db.archive_horizon()
+            exact = [row['transaction_id'] for row in duplicates if row['match'] == 'exact'
+                     and not (horizon and row['txn_date'][:10] < horizon.isoformat())]
+            archived = sum(row['match'] == 'exact' for row in duplicates) - len(exact)
+            if archived:
+                st.caption(f"{archived:,} exact copies are archived and cannot be deleted")
+            if exact and st.button(f"Delete {len(exact):,} exact copies"):
+                deleted = db.delete_transactions(st.session_state.user_id, exact)
+                del st.session_state.duplicates
+                st.success(f"Deleted {deleted:,} transactions")
+                st.rerun()
+        else:
+            st.success("No duplicates found")
+    
+    # Daily rates convert other currencies into each user's base currency
+    st.divider()
+    st.subheader("Exchange Rates")
+    st.caption("CSV with date, from, to and rate columns; rate is units of 'to' per unit of 'from'.")
+    with st.form("load_fx_rates"):
+        rates_file = st.file_uploader("Rates file", type=["csv"])
+        load_rates = st.form_submit_button("Load rates")
+    if load_rates and rates_file:
+        try:
+            count = db.load_fx_rates(rates_file)
+        except ValueError as e:
+            st.error(f"Loading rates failed: {e}")
+        else:
+            st.success(f"Loaded {count:,} rates")
 
 # Accounts Page
 elif page == "Accounts":
@@ -239,7 +570,8 @@ elif page == "Accounts":
                 st.write(f"Type: {acc['type']}")
             with col3:
                 balance_color = "green" if acc['balance'] >= 0 else "red"
-                st.markdown(f"<h3 style='color: {balance_color}'>{format_currency(acc['balance'])}</h3>", 
+                balance = format_currency(acc['balance'], currency=acc['currency'])
+                st.markdown(f"<h3 style='color: {balance_color}'>{balance}</h3>", 
                           unsafe_allow_html=True)
             with col4:
                 if st.button("🗑️", key=f"del_acc_{acc['account_id']}"):
@@ -249,6 +581,40 @@ elif page == "Accounts":
                     else:
                         st.error("Cannot delete account with transactions")
             st.divider()
+        
+        # Balance over time, from the monthly checkpoints plus recent activity
+        st.subheader("Balance History")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            account_names = {acc['name']: acc['account_id'] for acc in accounts}
+            account_currencies = {acc['name']: acc['currency'] for acc in accounts}
+            history_account = st.selectbox("Account", list(account_names.keys()))
+        with col2:
+            granularity = st.selectbox("Granularity", ["day", "week", "month", "year"], index=2)
+        with col3:
+            history_start = st.date_input("Since", value=date.today() - timedelta(days=365))
+        
+        history = db.get_balance_history_frame(
+            st.session_state.user_id, account_names[history_account], history_start, date.today(), granularity
+        )
+        if len(history) > 0:
+            fig = px.line(history, x='period', y='balance', line_shape='hv', markers=True,
+                          title=f"{history_account} balance")
+            fig.update_layout(xaxis_title='', yaxis_title=f"Balance ({account_currencies[history_account]})")
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No activity in this period")
+        
+        drifted = db.reconcile_balances(st.session_state.user_id)
+        if drifted:
+            st.warning("Some balances do not match their transaction history: " + ", ".join(
+                f"{row['name']} (off by {format_currency(row['drift'], currency=account_currencies[row['name']])})"
+                for row in drifted
+            ))
+            if st.button("Reset balances from history"):
+                db.reconcile_balances(st.session_state.user_id, fix=True)
+                st.rerun()
+        st.divider()
     
     st.subheader("Add New Account")
     with st.form("add_account"):
@@ -260,16 +626,31 @@ elif page == "Accounts":
                 ["checking", "savings", "credit_card", "cash", "investment", "other"])
         
         with col2:
-            balance = st.number_input("Initial Balance (₹)", value=0.0, step=0.01)
-            currency = st.text_input("Currency", value="INR", disabled=True)
+            balance = st.number_input("Initial Balance", value=0.0, step=0.01)
+            currency = st.text_input("Currency", value=base_currency, max_chars=3, help="ISO code, e.g. USD")
         
         submitted = st.form_submit_button("Add Account")
         
         if submitted and name:
-            acc_id = db.add_account(st.session_state.user_id, name, account_type, balance, currency)
-            if acc_id:
+            try:
+                acc_id = db.add_account(st.session_state.user_id, name, account_type, balance, currency)
+            except ValueError as e:
+                st.error(str(e))
+            else:
                 st.success("Account added!")
                 st.rerun()
+    
+    st.subheader("Base Currency")
+    currencies = sorted({base_currency, *(acc['currency'] for acc in accounts), *db.get_fx_currencies()})
+    new_base = st.selectbox("Totals, budgets and charts are shown in", currencies,
+                            index=currencies.index(base_currency))
+    missing = [acc['name'] for acc in accounts
+               if db.get_fx_rate(acc['currency'], new_base) is None and acc['currency'] != new_base]
+    if missing:
+        st.warning(f"No exchange rates into {new_base} for: {', '.join(missing)}; their amounts are not converted.")
+    if new_base != base_currency and st.button(f"Switch to {new_base}"):
+        db.set_base_currency(st.session_state.user_id, new_base)
+        st.rerun()
 
 # Categories Page
 elif page == "Categories":
@@ -326,10 +707,199 @@ elif page == "Categories":
             if cat_id:
                 st.success("Category added!")
                 st.rerun()
+    
+    st.divider()
+    st.subheader("Tags")
+    
+    for tag in db.get_tags(st.session_state.user_id):
+        col_a, col_b, col_c = st.columns([3, 1, 1])
+        with col_a:
+            st.write(f"• {tag['name']}")
+        with col_b:
+            st.caption(f"{tag['txn_count']} transactions")
+        with col_c:
+            if st.button("🗑️", key=f"del_tag_{tag['tag_id']}"):
+                db.delete_tag(tag['tag_id'], st.session_state.user_id)
+                st.success("Deleted!")
+                st.rerun()
+    
+    with st.form("add_tag"):
+        tag_name = st.text_input("Tag Name")
+        if st.form_submit_button("Add Tag") and tag_name:
+            db.add_tag(st.session_state.user_id, tag_name.strip())
+            st.success("Tag added!")
+            st.rerun()
+    
+    # Rules fill in the category and merchant of imported or uncategorized rows
+    st.divider()
+    st.subheader("Rules")
+    
+    for rule in db.get_rules(st.session_state.user_id):
+        col_a, col_b, col_c = st.columns([3, 2, 1])
+        with col_a:
+            condition = f"{rule['field']} {rule['match_type']} '{rule['pattern']}'" if rule['pattern'] else "any"
+            if rule['min_amount'] is not None or rule['max_amount'] is not None:
+                condition += f", amount {rule['min_amount'] or 0:g} – {rule['max_amount'] or '∞'}"
+            st.write(f"• {condition}")
+        with col_b:
+            st.caption(" · ".join(name for name in (rule['category_name'], rule['merchant_name']) if name))
+        with col_c:
+            if st.button("🗑️", key=f"del_rule_{rule['rule_id']}"):
+                db.delete_rule(rule['rule_id'], st.session_state.user_id)
+                st.rerun()
+    
+    with st.form("add_rule"):
+        categories = {f"{c['name']} ({c['kind']})": c['category_id'] for c in db.get_categories(st.session_state.user_id)}
+        merchants = {m['name']: m['merchant_id'] for m in db.get_merchants(st.session_state.user_id)}
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            pattern = st.text_input("Description contains")
+            match_type = st.selectbox("Match", db.RULE_MATCH_TYPES)
+        with col2:
+            min_amount = st.number_input("Min amount", min_value=0.0, value=0.0, step=100.0)
+            max_amount = st.number_input("Max amount (0 for no limit)", min_value=0.0, value=0.0, step=100.0)
+        with col3:
+            rule_category = st.selectbox("Category", ["(none)"] + list(categories))
+            rule_merchant = st.selectbox("Merchant", ["(none)"] + list(merchants))
+        if st.form_submit_button("Add Rule"):
+            try:
+                db.add_rule(
+                    st.session_state.user_id,
+                    pattern=pattern.strip() or None,
+                    category_id=categories.get(rule_category),
+                    merchant_id=merchants.get(rule_merchant),
+                    match_type=match_type,
+                    min_amount=min_amount or None,
+                    max_amount=max_amount or None,
+                )
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success("Rule added!")
+                st.rerun()
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Apply to uncategorized"):
+            result = db.apply_rules(st.session_state.user_id, 'uncategorized')
+            st.success(f"Updated {result['updated']:,} of {result['scanned']:,} transactions")
+    with col2:
+        if st.button("Re-apply to all"):
+            result = db.apply_rules(st.session_state.user_id, 'all')
+            st.success(f"Updated {result['updated']:,} of {result['scanned']:,} transactions")
+
+# Budgets Page
+elif page == "Budgets":
+    st.title("🎯 Budgets")
+    if snapshot_note:
+        st.caption(snapshot_note)
+    
+    current = db.get_budget_report(st.session_state.user_id, current_only=True)
+    totals = current[current['budget_item_id'].isna()]
+    
+    if len(totals) > 0:
+        for _, budget in totals.iterrows():
+            items = current[(current['budget_id'] == budget['budget_id']) & current['budget_item_id'].notna()]
+            
+            col1, col2, col3 = st.columns([3, 2, 1])
+            with col1:
+                st.markdown(f"**{budget['budget_name']}** · {budget['period']}")
+                st.caption(f"{budget['window_start']:%d %b %Y} – {budget['window_end']:%d %b %Y}")
+                st.progress(min(float(budget['utilization']), 1.0) if pd.notna(budget['utilization']) else 0.0)
+            with col2:
+                st.write(f"{format_currency(budget['actual'], currency=base_currency)} of {format_currency(budget['budgeted'], currency=base_currency)}")
+                if budget['overspent']:
+                    st.markdown(f"<span style='color: red'>Over by {format_currency(-budget['remaining'], currency=base_currency)}</span>",
+                                unsafe_allow_html=True)
+                else:
+                    st.markdown(f"<span style='color: green'>{format_currency(budget['remaining'], currency=base_currency)} left</span>",
+                                unsafe_allow_html=True)
+            with col3:
+                if st.button("🗑️", key=f"del_budget_{budget['budget_id']}"):
+                    if db.delete_budget(int(budget['budget_id']), st.session_state.user_id):
+                        st.success("Deleted!")
+                        st.rerun()
+            
+            if len(items) > 0:
+                with st.expander("Items"):
+                    df_items = pd.DataFrame({
+                        'Item': items['item_name'],
+                        'Spent': format_currency(items['actual'], currency=base_currency),
+                        'Budgeted': format_currency(items['budgeted'], currency=base_currency),
+                        'Used': (items['utilization'] * 100).round(0).astype('Int64').astype(str) + '%',
+                        'Over': items['overspent'].map({True: '⚠️', False: ''}),
+                    })
+                    st.dataframe(df_items, use_container_width=True, hide_index=True)
+        
+        # History of one budget across all of its windows
+        st.divider()
+        st.subheader("History")
+        names = dict(zip(totals['budget_name'], totals['budget_id']))
+        selected = st.selectbox("Budget", list(names.keys()))
+        report = db.get_budget_report(st.session_state.user_id)
+        history = report[(report['budget_id'] == names[selected]) & report['budget_item_id'].isna()]
+        
+        fig = go.Figure()
+        fig.add_trace(go.Bar(x=history['window_start'], y=history['actual'], name='Spent',
+                             marker_color=history['overspent'].map({True: 'red', False: 'steelblue'})))
+        fig.add_trace(go.Scatter(x=history['window_start'], y=history['budgeted'], name='Budgeted',
+                                 mode='lines', line=dict(color='black', dash='dash')))
+        fig.update_layout(title=f"{selected}: spent vs budgeted", xaxis_title='Period start', yaxis_title=f'Amount ({base_currency})')
+        st.plotly_chart(fig, use_container_width=True)
+        
+        overspent = int(history['overspent'].sum())
+        st.caption(f"Over budget in {overspent} of {len(history)} periods")
+    else:
+        st.info("No active budgets yet")
+    
+    st.divider()
+    st.subheader("Add New Budget")
+    
+    expense_cats = db.get_categories(st.session_state.user_id, kind='expense')
+    
+    with st.form("add_budget"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            name = st.text_input("Budget Name")
+            period = st.selectbox("Period", ["monthly", "weekly", "daily", "quarterly", "yearly", "custom"])
+            amount = st.number_input(f"Amount ({base_currency})", min_value=0.0, step=500.0)
+        
+        with col2:
+            start_date = st.date_input("Start Date", value=date.today().replace(day=1))
+            end_date = st.date_input("End Date", value=None, help="Optional; required for custom periods")
+        
+        st.caption("Per-category limits (leave at 0 to track all expenses)")
+        limits = st.data_editor(
+            pd.DataFrame({
+                'Category': [cat['name'] for cat in expense_cats],
+                f"Limit ({base_currency})": [0.0] * len(expense_cats),
+            }),
+            disabled=['Category'], hide_index=True, use_container_width=True
+        )
+        
+        submitted = st.form_submit_button("Add Budget")
+        
+        if submitted:
+            if not name or amount <= 0:
+                st.error("Please enter a name and an amount")
+            elif period == 'custom' and end_date is None:
+                st.error("Custom budgets need an end date")
+            else:
+                items = [
+                    {'category_id': cat['category_id'], 'amount': limit}
+                    for cat, limit in zip(expense_cats, limits[f"Limit ({base_currency})"])
+                    if limit > 0
+                ]
+                db.add_budget(st.session_state.user_id, name, amount, period, start_date, end_date, items)
+                st.success("Budget added!")
+                st.rerun()
 
 # Analytics Page
 elif page == "Analytics":
     st.title("📈 Analytics")
+    if snapshot_note:
+        st.caption(snapshot_note)
     
     # Date range selector
     col1, col2 = st.columns(2)
@@ -338,86 +908,111 @@ elif page == "Analytics":
     with col2:
         end_date = st.date_input("End Date", value=date.today())
     
-    # Get all transactions in date range
-    all_txns = db.get_transactions(st.session_state.user_id, limit=1000)
+    # Aggregated in SQL, so cost depends on the number of groups, not rows
+    totals = {row['txn_type']: row['total'] for row in db.get_totals_by_type(
+        st.session_state.user_id, start_date, end_date
+    )}
     
-    if all_txns:
-        df_all = pd.DataFrame([dict(t) for t in all_txns])
-        df_all['txn_date'] = pd.to_datetime(df_all['txn_date'])
+    if totals:
+        # Summary metrics
+        col1, col2, col3 = st.columns(3)
+        
+        total_income = totals.get('income', 0)
+        total_expense = totals.get('expense', 0)
+        net = total_income - total_expense
+        
+        with col1:
+            st.metric("Total Income", format_currency(total_income, currency=base_currency))
+        with col2:
+            st.metric("Total Expenses", format_currency(total_expense, currency=base_currency))
+        with col3:
+            st.metric("Net", format_currency(net, currency=base_currency), delta=format_currency(net, currency=base_currency))
+        
+        st.divider()
         
-        # Filter by date range
-        mask = (df_all['txn_date'].dt.date >= start_date) & (df_all['txn_date'].dt.date <= end_date)
-        df_filtered = df_all[mask]
+        # Spending by category
+        st.subheader("Spending by Category")
+        category_spending = db.get_spending_by_category_frame(st.session_state.user_id, start_date, end_date)
+        category_spending.columns = ['Category', 'Amount']
         
-        if len(df_filtered) > 0:
-            # Summary metrics
-            col1, col2, col3 = st.columns(3)
+        if len(category_spending) > 0:
             
-            total_income = df_filtered[df_filtered['txn_type'] == 'income']['amount'].sum()
-            total_expense = df_filtered[df_filtered['txn_type'] == 'expense']['amount'].sum()
-            net = total_income - total_expense
+            col1, col2 = st.columns(2)
             
             with col1:
-                st.metric("Total Income", format_currency(total_income))
-            with col2:
-                st.metric("Total Expenses", format_currency(total_expense))
-            with col3:
-                st.metric("Net", format_currency(net), delta=format_currency(net))
-            
-            st.divider()
-            
-            # Spending by category
-            st.subheader("Spending by Category")
-            expense_df = df_filtered[df_filtered['txn_type'] == 'expense'].copy()
-            
-            if len(expense_df) > 0:
-                # Group by category
-                category_spending = expense_df.groupby('category_name')['amount'].sum().reset_index()
-                category_spending = category_spending.sort_values('amount', ascending=False)
-                category_spending.columns = ['Category', 'Amount']
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    fig = px.pie(category_spending, values='Amount', names='Category', 
-                               title='Expense Distribution')
-                    st.plotly_chart(fig, use_container_width=True)
-                
-                with col2:
-                    fig = px.bar(category_spending, x='Category', y='Amount', 
-                               title='Expenses by Category')
-                    fig.update_xaxis(tickangle=-45)
-                    st.plotly_chart(fig, use_container_width=True)
-                
-                # Show table
-                category_spending['Amount'] = category_spending['Amount'].apply(format_currency)
-                st.dataframe(category_spending, use_container_width=True, hide_index=True)
-            else:
-                st.info("No expense transactions in selected date range")
-            
-            st.divider()
+                fig = px.pie(category_spending, values='Amount', names='Category', 
+                           title='Expense Distribution')
+                st.plotly_chart(fig, use_container_width=True)
             
-            # Spending over time
-            st.subheader("Spending Trend")
-            daily_spending = expense_df.groupby(expense_df['txn_date'].dt.date)['amount'].sum().reset_index()
-            daily_spending.columns = ['Date', 'Amount']
+            with col2:
+                fig = px.bar(category_spending, x='Category', y='Amount', 
+                           title='Expenses by Category')
+                fig.update_xaxes(tickangle=-45)
+                st.plotly_chart(fig, use_container_width=True)
             
-            fig = px.line(daily_spending, x='Date', y='Amount', title='Daily Spending')
+            # Show table
+            category_spending['Amount'] = format_currency(category_spending['Amount'], currency=base_currency)
+            st.dataframe(category_spending, use_container_width=True, hide_index=True)
+        else:
+            st.info("No expense transactions in selected date range")
+        
+        st.divider()
+        
+        # Spending over time
+        st.subheader("Spending Trend")
+        daily_spending = db.get_daily_spending_frame(st.session_state.user_id, start_date, end_date)
+        daily_spending.columns = ['Date', 'Amount']
+        
+        fig = px.line(daily_spending, x='Date', y='Amount', title='Daily Spending')
+        st.plotly_chart(fig, use_container_width=True)
+        
+        # Spending by tag
+        tag_spending = db.get_spending_by_tag_frame(st.session_state.user_id, start_date, end_date)
+        if len(tag_spending) > 0:
+            st.subheader("Spending by Tag")
+            tag_spending = tag_spending[['name', 'total', 'txn_count']]
+            tag_spending.columns = ['Tag', 'Amount', 'Transactions']
+            fig = px.bar(tag_spending, x='Tag', y='Amount', title='Expenses by Tag')
+            st.plotly_chart(fig, use_container_width=True)
+        
+        # Top merchants
+        st.subheader("Top Merchants")
+        merchant_spending = db.get_top_merchants_frame(st.session_state.user_id, start_date, end_date, limit=10)
+        merchant_spending.columns = ['Merchant', 'Amount']
+        
+        if len(merchant_spending) > 0:
+            fig = px.bar(merchant_spending, x='Merchant', y='Amount', title='Top 10 Merchants')
+            fig.update_xaxes(tickangle=-45)
             st.plotly_chart(fig, use_container_width=True)
-            
-            # Top merchants
-            st.subheader("Top Merchants")
-            merchant_spending = expense_df[expense_df['merchant_name'].notna()].groupby('merchant_name')['amount'].sum().reset_index()
-            merchant_spending = merchant_spending.sort_values('amount', ascending=False).head(10)
-            merchant_spending.columns = ['Merchant', 'Amount']
-            
-            if len(merchant_spending) > 0:
-                fig = px.bar(merchant_spending, x='Merchant', y='Amount', title='Top 10 Merchants')
-                fig.update_xaxis(tickangle=-45)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No merchant data available")
         else:
-            st.info("No transactions found in selected date range")
+            st.info("No merchant data available")
     else:
-        st.info("No transactions available. Add some transactions to see analytics!")
+        st.info("No transactions found in selected date range")
+
+# Query instrumentation panel, rendered last so it includes this run's calls
+if DEBUG_TOOLS and db.instrumentation_enabled():
+    stats = db.instrumentation_stats()
+    with st.sidebar.expander("📈 Query stats", expanded=True):
+        if stats['functions']:
+            df_calls = pd.DataFrame(stats['functions'])[
+                ['function', 'calls', 'mean_ms', 'p95_ms', 'max_ms', 'queries', 'sql_ms']
+            ]
+            st.dataframe(df_calls.round(2), use_container_width=True, hide_index=True)
+        else:
+            st.caption("No calls recorded yet")
+
+        for scan in stats['scans']:
+            st.warning(f"Full scan of transactions in {scan['function']} ({scan['count']}x): "
+                       + "; ".join(scan['scans']))
+
+        if stats['slow_queries']:
+            st.write(f"**Slow queries** (over {stats['slow_ms']:g} ms)")
+            for entry in reversed(stats['slow_queries'][-10:]):
+                st.caption(f"{entry['at']} · {entry['function']} · {entry['ms']:.1f} ms")
+                st.code(entry['sql'].strip(), language='sql')
+                if entry['plan']:
+                    st.code("\n".join(entry['plan']), language=None)
+
+        if st.button("Reset stats"):
+            db.reset_instrumentation()
+            st.rerun()
@@ -0,0 +1,112 @@
+"""Time recent-range reads before and after archiving old transactions.
+
+Works on a copy of a synthetic database: the reads the dashboard and the
+Transactions page make for the last months are timed, everything older than
+--months is moved to the archive file and the main file is vacuumed, then the
+same reads are timed again, along with one that reaches back into the archive.
+
+    python benchmarks/archive.py --transactions 2000000 --years 6
+    python benchmarks/archive.py --db /tmp/synth.db --months 12
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def reads(user_id, end):
+    month_start = end.replace(day=1)
+    quarter = end - timedelta(days=90)
+    yield "spending by category, this month", lambda: db.get_spending_by_category(user_id, month_start, end)
+    yield "daily summaries, 90 days", lambda: db.get_period_summaries(user_id, quarter, end, 'day')
+    yield "daily spending, 90 days", lambda: db.get_daily_spending(user_id, quarter, end)
+    yield "transactions, first page", lambda: db.query_transactions(user_id)
+
+    def deep_page():
+        cursor = None
+        for _ in range(20):
+            _, cursor = db.query_transactions(user_id, cursor=cursor)
+    yield "transactions, 20 pages", deep_page
+    yield "daily summaries, 3 years (archive)", lambda: db.get_period_summaries(
+        user_id, end.replace(year=end.year - 3), end, 'day'
+    )
+
+
+def time_reads(user_id, end, repeat):
+    results = {}
+    for name, read in reads(user_id, end):
+        best = None
+        for _ in range(repeat):
+            # Fresh connections each time, so their page caches start empty
+            db.close_pools()
+            started = time.perf_counter()
+            read()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="existing synthetic database to copy (default: generate a fresh one)")
+    parser.add_argument('--transactions', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--years', type=int, default=6)
+    parser.add_argument('--months', type=int, default=db.ARCHIVE_AFTER_MONTHS,
+                        help="months kept in the main file (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'archive.db')
+    if args.db:
+        shutil.copy(args.db, path)
+    else:
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synth.py'),
+                        '--db', path, '--users', str(args.users), '--transactions', str(args.transactions),
+                        '--years', str(args.years)], check=True)
+        print()
+    db.DB_NAME = path
+    db.CACHE_ENABLED = False
+    db.init_db()
+
+    with db.get_db(readonly=True) as conn:
+        user_id, last = conn.execute("""
+            SELECT user_id, MAX(txn_date) FROM transactions
+            GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()
+    end = date.fromisoformat(last[:10])
+
+    before = time_reads(user_id, end, args.repeat)
+    size_before = os.path.getsize(path)
+
+    started = time.perf_counter()
+    moved = db.archive_transactions(db._months_before(end, args.months))
+    archived_in = time.perf_counter() - started
+    # Hand the freed pages back so the file size shows the hot set
+    db.close_pools()
+    conn = sqlite3.connect(path)
+    conn.execute("VACUUM")
+    conn.close()
+    after = time_reads(user_id, end, args.repeat)
+
+    print(f"archived {moved:,} transactions before {db.archive_horizon()} in {archived_in:.1f}s")
+    print(f"main file {size_before / 2**20:,.1f} MiB -> {os.path.getsize(path) / 2**20:,.1f} MiB, "
+          f"archive {os.path.getsize(db.archive_path()) / 2**20:,.1f} MiB")
+    print(f"{'read':<38}{'before ms':>12}{'after ms':>12}{'ratio':>8}")
+    for name in before:
+        print(f"{name:<38}{before[name]:>12.2f}{after[name]:>12.2f}{after[name] / before[name]:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Time the budget engine for many budgets over years of history.
+
+    python benchmarks/budget_report.py --budgets 50 --years 5 --rows 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+PERIODS = ('daily', 'weekly', 'monthly', 'quarterly', 'yearly', 'custom')
+
+
+def populate(user_id, rows, start, days):
+    rng = random.Random(11)
+    with db.get_db() as conn:
+        accounts = [r[0] for r in conn.execute("SELECT account_id FROM accounts WHERE user_id = ?", (user_id,))]
+        categories = [r[0] for r in conn.execute(
+            "SELECT category_id FROM categories WHERE user_id = ? AND kind = 'expense'", (user_id,)
+        )]
+        conn.executemany("""
+            INSERT INTO transactions (user_id, account_id, category_id, txn_type, amount, txn_date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            (user_id, rng.choice(accounts), rng.choice(categories + [None]),
+             rng.choice(('expense', 'expense', 'expense', 'income')), rng.randrange(100, 500000),
+             (start + timedelta(days=rng.randrange(days))).isoformat())
+            for _ in range(rows)
+        ))
+    return categories
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budgets', type=int, default=50)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    db.DB_NAME = os.path.join(tempfile.mkdtemp(), 'budgets.db')
+    db.seed_sample_data()
+    user_id = db.get_user_by_email('test@example.com')['user_id']
+    today = date.today()
+    start = today - timedelta(days=args.years * 365)
+    categories = populate(user_id, args.rows, start, args.years * 365)
+
+    rng = random.Random(12)
+    for i in range(args.budgets):
+        period = PERIODS[i % len(PERIODS)]
+        items = None
+        if i % 2:
+            items = [{'category_id': c, 'amount': rng.randrange(1000, 20000)} for c in rng.sample(categories, 3)]
+        db.add_budget(user_id, f"Budget {i}", rng.randrange(5000, 100000), period, start,
+                      today if period == 'custom' else None, items)
+
+    db.clear_cache()
+    started = time.perf_counter()
+    report = db.get_budget_report(user_id)
+    elapsed = time.perf_counter() - started
+
+    windows = int(report['budget_item_id'].isna().sum())
+    print(f"{args.budgets} budgets, {args.years} years, {args.rows:,} transactions")
+    print(f"{windows:,} budget windows, {len(report):,} report rows in {elapsed:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
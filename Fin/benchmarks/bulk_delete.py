@@ -0,0 +1,78 @@
+"""Time deleting many transactions one call at a time vs one delete_transactions() call.
+
+Works on a copy of a synthetic database. --rows of the busiest user's
+transactions, spread over all their accounts, are deleted with
+delete_transaction() in a loop (one commit each) and, on a fresh copy, with
+a single delete_transactions() call. Balances and rollups are checked after
+each run.
+
+    python benchmarks/bulk_delete.py --transactions 1000000 --rows 1000 10000
+    python benchmarks/bulk_delete.py --db /tmp/synth.db
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def run(source, rows, bulk):
+    path = os.path.join(tempfile.mkdtemp(), 'bulk_delete.db')
+    shutil.copy(source, path)
+    db.DB_NAME = path
+    db.init_db()
+    with db.get_db(readonly=True) as conn:
+        user_id = conn.execute("""
+            SELECT user_id FROM transactions GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()[0]
+        ids = [row[0] for row in conn.execute("SELECT transaction_id FROM transactions WHERE user_id = ?",
+                                              (user_id,))]
+    chosen = random.Random(rows).sample(ids, min(rows, len(ids)))
+
+    started = time.perf_counter()
+    if bulk:
+        deleted = db.delete_transactions(user_id, chosen)
+    else:
+        deleted = sum(db.delete_transaction(transaction_id, user_id) for transaction_id in chosen)
+    elapsed = time.perf_counter() - started
+    problems = len(db.check_rollups(user_id)) + len(db.reconcile_balances(user_id))
+    db.close_pools()
+    shutil.rmtree(os.path.dirname(path))
+    return elapsed, deleted, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="existing synthetic database to copy (default: generate a fresh one)")
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    source = args.db
+    if not source:
+        source = os.path.join(tempfile.mkdtemp(), 'synth.db')
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synth.py'),
+                        '--db', source, '--users', str(args.users), '--transactions', str(args.transactions),
+                        '--years', str(args.years)], check=True)
+        print()
+
+    print(f"{'rows':>8}{'one by one':>14}{'bulk':>10}{'speedup':>10}{'problems':>10}")
+    for rows in args.rows:
+        single_s, single_n, single_problems = run(source, rows, bulk=False)
+        bulk_s, bulk_n, bulk_problems = run(source, rows, bulk=True)
+        assert single_n == bulk_n, (single_n, bulk_n)
+        print(f"{bulk_n:>8,}{single_s:>13.2f}s{bulk_s:>9.2f}s{single_s / bulk_s:>9.0f}x"
+              f"{single_problems + bulk_problems:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Compare the row-at-a-time DataFrame path against the columnar fetch path.
+
+The old path is what every page in app.py did:
+pd.DataFrame([dict(t) for t in rows]).
+
+    python benchmarks/columnar_fetch.py --rows 500000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def populate(user_id, rows):
+    rng = random.Random(7)
+    start = date.today() - timedelta(days=3 * 365)
+    with db.get_db() as conn:
+        accounts = [r[0] for r in conn.execute("SELECT account_id FROM accounts WHERE user_id = ?", (user_id,))]
+        categories = [r[0] for r in conn.execute("SELECT category_id FROM categories WHERE user_id = ?", (user_id,))]
+        merchants = [r[0] for r in conn.execute("SELECT merchant_id FROM merchants WHERE user_id = ?", (user_id,))]
+        conn.executemany("""
+            INSERT INTO transactions
+            (user_id, account_id, category_id, merchant_id, txn_type, amount, currency, txn_date, description)
+            VALUES (?, ?, ?, ?, ?, ?, 'INR', ?, ?)
+        """, (
+            (user_id, rng.choice(accounts), rng.choice(categories), rng.choice(merchants + [None]),
+             rng.choice(('expense', 'expense', 'income')), rng.randrange(100, 500000),
+             (start + timedelta(days=rng.randrange(3 * 365))).isoformat(), f"purchase {i}")
+            for i in range(rows)
+        ))
+
+
+def measure(label, fn):
+    # Time without tracemalloc, whose hooks would dominate the result
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    frame = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = frame.memory_usage(deep=True).sum()
+    print(f"{label:<22}{elapsed:>9.2f}s{peak / 2**20:>12.1f} MiB{size / 2**20:>12.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    args = parser.parse_args()
+
+    db.DB_NAME = os.path.join(tempfile.mkdtemp(), 'columnar.db')
+    db.seed_sample_data()
+    user_id = db.get_user_by_email('test@example.com')['user_id']
+    populate(user_id, args.rows)
+
+    def row_path():
+        query, params = db._transactions_query(user_id)
+        with db.get_db(readonly=True) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return pd.DataFrame([dict(t) for t in rows])
+
+    print(f"{args.rows:,} transactions")
+    print(f"{'path':<22}{'time':>10}{'peak alloc':>16}{'frame size':>16}")
+    measure("rows -> dicts", row_path)
+    measure("columnar", lambda: db.get_transactions_frame(user_id))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Time duplicate checks for a large import against a long history.
+
+Works on a copy of a synthetic database. A statement of --rows rows is built
+for the busiest account, --overlap of them copies of transactions already
+stored, and checked as a dry run (exact matches only, then with a window of
+--window days) before being imported for real. The duplicate report is
+timed last.
+
+    python benchmarks/duplicates.py --transactions 3000000 --rows 100000
+    python benchmarks/duplicates.py --db /tmp/synth.db --overlap 0.5
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def statement(user_id, account_id, rows, overlap, seed=1):
+    rng = random.Random(seed)
+    with db.get_db(readonly=True) as conn:
+        stored = conn.execute("""
+            SELECT txn_date, description, txn_type, amount FROM transactions
+            WHERE account_id = ? ORDER BY txn_date DESC LIMIT ?
+        """, (account_id, int(rows * overlap))).fetchall()
+    lines = []
+    for txn_date, description, txn_type, amount in stored:
+        lines.append({'txn_date': txn_date[:10], 'description': description, 'txn_type': txn_type,
+                      'amount': f"{amount / 100:.2f}"})
+    start = date.today() - timedelta(days=365)
+    while len(lines) < rows:
+        day = start + timedelta(days=rng.randrange(365))
+        lines.append({'txn_date': day.isoformat(), 'description': f"Statement row {len(lines)}",
+                      'txn_type': 'expense', 'amount': f"{rng.uniform(10, 5000):.2f}"})
+    rng.shuffle(lines)
+    for line, row in enumerate(lines, start=2):
+        row['line'] = line
+    return lines, len(stored)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="existing synthetic database to copy (default: generate a fresh one)")
+    parser.add_argument('--transactions', type=int, default=3000000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=100000, help="statement rows (default: %(default)s)")
+    parser.add_argument('--overlap', type=float, default=0.3,
+                        help="share of the statement already stored (default: %(default)s)")
+    parser.add_argument('--window', type=int, default=db.DUPLICATE_WINDOW_DAYS)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'duplicates.db')
+    if args.db:
+        shutil.copy(args.db, path)
+    else:
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synth.py'),
+                        '--db', path, '--users', str(args.users), '--transactions', str(args.transactions),
+                        '--years', str(args.years)], check=True)
+        print()
+    db.DB_NAME = path
+    started = time.perf_counter()
+    db.init_db()
+    migrated_s = time.perf_counter() - started
+
+    with db.get_db(readonly=True) as conn:
+        total = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        user_id, account_id = conn.execute("""
+            SELECT user_id, account_id FROM transactions GROUP BY account_id ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()
+    started = time.perf_counter()
+    db._ensure_fingerprints(user_id)
+    filled_s = time.perf_counter() - started
+    lines, overlapping = statement(user_id, account_id, args.rows, args.overlap)
+
+    print(f"{total:,} transactions stored, statement of {len(lines):,} rows ({overlapping:,} already stored)")
+    print(f"init_db {migrated_s:.2f}s, fingerprints filled in {filled_s:.2f}s")
+    runs = (
+        ("dry run, exact", dict(dry_run=True)),
+        (f"dry run, exact + {args.window} days", dict(dry_run=True, window_days=args.window)),
+        ("dry run, no check", dict(dry_run=True, skip_duplicates=False)),
+        ("import, exact", dict()),
+    )
+    for name, options in runs:
+        started = time.perf_counter()
+        result = db.import_transactions(user_id, account_id, iter(lines), categorize=False, **options)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<28}{elapsed:>8.2f}s  {result['imported']:>8,} new  {result['duplicates']:>8,} duplicates"
+              f"  {result['possible_duplicates']:>8,} possible")
+
+    for window in (0, args.window):
+        started = time.perf_counter()
+        report = db.get_duplicates(user_id, window)
+        print(f"get_duplicates(window_days={window}){time.perf_counter() - started:>8.2f}s  {len(report):,} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Time a streaming export of a user's full history and check its memory use.
+
+Peak RSS is read before and after the export. Besides the rows in flight it
+counts SQLite's page cache and the database pages read through mmap, both
+capped by PRAGMAS, so it levels off instead of growing with the row count.
+
+    python benchmarks/export.py --transactions 5000000
+    python benchmarks/export.py --db /tmp/synth.db --format parquet
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="existing synthetic database (default: generate a fresh one)")
+    parser.add_argument('--transactions', type=int, default=5000000,
+                        help="rows to generate for a single user when --db is not given")
+    parser.add_argument('--format', choices=db.EXPORT_FORMATS, default='csv')
+    parser.add_argument('--chunk-size', type=int, default=db.EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    if not args.db:
+        # In a child process, so generating does not count towards peak RSS
+        args.db = os.path.join(tmp, 'export.db')
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synth.py'),
+                        '--db', args.db, '--users', '1', '--transactions', str(args.transactions)], check=True)
+        print()
+    db.DB_NAME = args.db
+    db.init_db()
+
+    with db.get_db(readonly=True) as conn:
+        user_id = conn.execute(
+            "SELECT user_id FROM transactions GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"
+        ).fetchone()[0]
+
+    path = os.path.join(tmp, f'export.{args.format}')
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    count = db.export_transactions(user_id, path, args.format, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"exported {count:,} rows to {os.path.getsize(path) / 2**20:,.1f} MiB of {args.format}")
+    print(f"{elapsed:.2f}s, {count / elapsed:,.0f} rows/s")
+    print(f"peak RSS grew by {(rss_after - rss_before) / 1024:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Time currency formatting for a transactions column, row by row vs vectorized.
+
+The row path is what app.py did: df.apply(..., axis=1) with an f-string.
+
+    python benchmarks/format_currency.py --rows 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from formatting import format_currency
+
+
+def row_path(df):
+    return df.apply(
+        lambda x: f"-₹{x['amount']:,.2f}" if x['txn_type'] == 'expense'
+        else f"₹{x['amount']:,.2f}", axis=1
+    )
+
+
+def vectorized(df):
+    return format_currency(df['amount'], negative=df['txn_type'] == 'expense')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({
+        'amount': rng.integers(100, 10_000_000, args.rows) / 100,
+        'txn_type': pd.Categorical(rng.choice(['expense', 'income'], args.rows)),
+    })
+
+    print(f"{args.rows:,} rows")
+    results = {}
+    for label, fn in (("apply(axis=1)", row_path), ("vectorized", vectorized)):
+        started = time.perf_counter()
+        results[label] = fn(df)
+        print(f"{label:<16}{time.perf_counter() - started:>9.3f}s")
+    assert list(results["apply(axis=1)"]) == list(results["vectorized"])
+
+
+if __name__ == '__main__':
+    main()
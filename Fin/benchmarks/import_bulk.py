@@ -0,0 +1,62 @@
+"""Time a streaming CSV import of a large synthetic bank statement.
+
+    python benchmarks/import_bulk.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def write_statement(path, rows):
+    rng = random.Random(42)
+    start = date.today() - timedelta(days=3 * 365)
+    with open(path, 'w') as f:
+        f.write("Date,Narration,Debit,Credit,Merchant\n")
+        for i in range(rows):
+            day = start + timedelta(days=i * 3 * 365 // rows)
+            if rng.random() < 0.05:
+                f.write(f"{day.isoformat()},Salary credit {i},,{rng.uniform(20000, 90000):.2f},\n")
+            else:
+                f.write(f"{day.isoformat()},Card purchase {i},{rng.uniform(10, 5000):.2f},,Shop {i % 200}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=db.IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    db.DB_NAME = os.path.join(tmp, 'import.db')
+    db.seed_sample_data()
+    user_id = db.get_user_by_email('test@example.com')['user_id']
+    account_id = db.get_accounts(user_id)[0]['account_id']
+
+    path = os.path.join(tmp, 'statement.csv')
+    write_statement(path, args.rows)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        result = db.import_transactions(
+            user_id, account_id, db.read_csv_statement(f), chunk_size=args.chunk_size
+        )
+    elapsed = time.perf_counter() - started
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"imported {result['imported']:,} rows in {result['batches']:,} batches")
+    print(f"{elapsed:.2f}s, {result['imported'] / elapsed:,.0f} rows/s")
+    print(f"peak RSS grew by {(rss_after - rss_before) / 1024:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Time month-end statements for every user at increasing worker counts.
+
+Runs reports.generate_reports once per worker count, doubling up to the
+number of cores, and prints the speedup over a single worker.
+
+    python benchmarks/month_end.py --users 500 --transactions 1000000
+    python benchmarks/month_end.py --db /tmp/synth.db --workers 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reports
+import synth
+
+
+def worker_counts(cores):
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="existing synthetic database (default: generate a fresh one)")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--month', default=synth.END_DATE.strftime('%Y-%m'))
+    parser.add_argument('--workers', type=int, nargs='+', default=worker_counts(os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    if not args.db:
+        args.db = os.path.join(tmp, 'month_end.db')
+        print(f"generating {args.transactions:,} transactions for {args.users} users...")
+        synth.generate(args.db, args.users, args.transactions)
+
+    print(f"{os.cpu_count()} cores, statements for {args.month}")
+    print(f"{'workers':>8}{'seconds':>10}{'users/s':>10}{'speedup':>10}")
+    baseline = None
+    for workers in args.workers:
+        timing = reports.generate_reports(args.db, args.month, os.path.join(tmp, f'reports-{workers}'), workers)
+        baseline = baseline or timing['seconds']
+        print(f"{timing['workers']:>8}{timing['seconds']:>10.2f}{timing['users'] / timing['seconds']:>10.0f}"
+              f"{baseline / timing['seconds']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Stress test for the pooled get_db against the old connect-per-call path.
+
+Runs a mix of dashboard reads and add_transaction writes from many threads
+against a scratch copy of the schema and prints throughput for both modes.
+
+    python benchmarks/pool_stress.py --threads 16 --seconds 5
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+@contextmanager
+def connect_per_call(readonly=False):
+    # The original get_db: a fresh connection for every call
+    conn = sqlite3.connect(db.DB_NAME)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def journal_mode():
+    conn = sqlite3.connect(db.DB_NAME)
+    try:
+        return conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def worker(user_id, account_id, deadline, write_every, counts, errors):
+    today = date.today()
+    n = 0
+    while time.perf_counter() < deadline:
+        try:
+            if write_every and n % write_every == 0:
+                db.add_transaction(user_id, account_id, 'expense', 1.0, today, description='stress')
+                counts['writes'] += 1
+            else:
+                db.get_accounts(user_id)
+                db.get_monthly_summary(user_id, today.year, today.month)
+                db.get_spending_by_category(user_id)
+                db.get_transactions(user_id, limit=10)
+                counts['reads'] += 1
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+        n += 1
+
+
+def run(mode, threads, seconds, write_every):
+    tmp = tempfile.mkdtemp()
+    db.DB_NAME = os.path.join(tmp, 'stress.db')
+    # Migrations always run through the pool, which switches the file to
+    # WAL; the legacy run puts it back on the default rollback journal
+    db.seed_sample_data()
+    db.close_pools()
+    expected = 'wal'
+    if mode == 'connect-per-call':
+        conn = sqlite3.connect(db.DB_NAME)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        expected = 'delete'
+        db.get_db = connect_per_call
+    mode_before = journal_mode()
+    assert mode_before == expected, mode_before
+    user_id = db.get_user_by_email('test@example.com')['user_id']
+    account_id = db.get_accounts(user_id)[0]['account_id']
+
+    per_thread = [{'reads': 0, 'writes': 0} for _ in range(threads)]
+    errors = []
+    deadline = time.perf_counter() + seconds
+    pool = [
+        threading.Thread(target=worker, args=(user_id, account_id, deadline, write_every, c, errors))
+        for c in per_thread
+    ]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+    mode_after = journal_mode()
+    assert mode_after == expected, mode_after
+    db.get_db = pooled_get_db
+    db.close_pools()
+    reads = sum(c['reads'] for c in per_thread)
+    writes = sum(c['writes'] for c in per_thread)
+    return reads / seconds, writes / seconds, len(errors)
+
+
+pooled_get_db = db.get_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--write-every', type=int, default=10,
+                        help='every Nth operation per thread is a write (0 = read only)')
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads, {args.seconds:g}s, 1 write per {args.write_every} ops")
+    print(f"{'mode':<18}{'dashboards/s':>14}{'writes/s':>12}{'lock errors':>14}")
+    for mode in ('connect-per-call', 'pooled'):
+        reads, writes, errors = run(mode, args.threads, args.seconds, args.write_every)
+        print(f"{mode:<18}{reads:>14.1f}{writes:>12.1f}{errors:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Check that the hot analytics queries are answered from indexes.
+
+Runs EXPLAIN QUERY PLAN for each query against a scratch database and exits
+non-zero if any of them falls back to a full scan of transactions. The
+queries are checked again after archiving the months before this one, when
+they also read the archive file.
+
+    python benchmarks/query_plans.py
+"""
+import os
+import sys
+import tempfile
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def plans(user_id):
+    today = date.today()
+    for granularity in ('day', 'week', 'month', 'year'):
+        yield f"get_period_summaries[{granularity}]", db._period_summary_query(
+            user_id, date(today.year - 2, 3, 15), today, granularity
+        )
+    yield "get_daily_spending", db._daily_spending_query(user_id, date(today.year - 1, 1, 1), today)
+    for granularity in ('day', 'month'):
+        yield f"get_balance_history[{granularity}]", db._balance_history_query(
+            user_id, 1, date(today.year - 1, 3, 15), today, granularity
+        )
+    yield "query_transactions", db._transactions_query(user_id, limit=101)
+    for name in ('tags_any', 'tags_all'):
+        yield f"query_transactions[{name}]", db._transactions_query(user_id, {name: [1, 2, 3]}, limit=101)
+    yield "get_spending_by_tag", db._spending_by_tag_query(user_id, date(today.year - 1, 1, 1), today)
+    yield "search_transactions", db._search_query(
+        user_id, 'amazon', {'start_date': date(today.year - 1, 1, 1)}, limit=db.TRANSACTION_PAGE_SIZE
+    )
+
+
+def main():
+    db.DB_NAME = os.path.join(tempfile.mkdtemp(), 'plans.db')
+    db.seed_sample_data()
+    user_id = db.get_user_by_email('test@example.com')['user_id']
+
+    failures = 0
+    for suffix in ('', ' (archive)'):
+        if suffix:
+            db.archive_transactions(date.today())
+        with db.get_db(readonly=True) as conn:
+            for name, (query, params) in plans(user_id):
+                details = [row['detail'] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+                scans = [d for d in details if d.startswith('SCAN ') and d.split()[1] in ('transactions', 't')]
+                print(f"{'FAIL' if scans else 'ok':<6}{name}{suffix}")
+                for detail in details:
+                    print(f"        {detail}")
+                failures += bool(scans)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Compare write latency and WAL growth under analytics load, live vs snapshot.
+
+Works on a copy of a synthetic database. Reader threads run the Analytics
+page's queries over the whole history in a loop (uncached) while one writer
+calls add_transaction, once with the reads on the live file and once with
+them on a snapshot (SNAPSHOT_READS). Long live reads keep WAL checkpoints
+from finishing, so the -wal file size is reported too.
+
+    python benchmarks/snapshot.py --transactions 1000000 --readers 4
+    python benchmarks/snapshot.py --db /tmp/synth.db --seconds 20
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def reader(user_id, start, end, deadline, counts):
+    while time.perf_counter() < deadline:
+        db.get_totals_by_type(user_id, start, end)
+        db.get_period_summaries(user_id, start, end, 'day')
+        db.get_daily_spending(user_id, start, end)
+        db.get_top_merchants(user_id, start, end)
+        counts['reads'] += 1
+
+
+def writer(user_id, account_id, deadline, latencies):
+    today = date.today()
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        db.add_transaction(user_id, account_id, 'expense', 1.0, today, description='snapshot benchmark')
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.005)
+
+
+def run(source, snapshot_reads, readers, seconds):
+    path = os.path.join(tempfile.mkdtemp(), 'snapshot.db')
+    shutil.copy(source, path)
+    db.DB_NAME = path
+    db.init_db()
+    with db.get_db(readonly=True) as conn:
+        user_id, first, last = conn.execute("""
+            SELECT user_id, MIN(txn_date), MAX(txn_date) FROM transactions
+            GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()
+    account_id = db.get_accounts(user_id)[0]['account_id']
+    start, end = date.fromisoformat(first[:10]), date.fromisoformat(last[:10])
+
+    db.SNAPSHOT_READS = snapshot_reads
+    if snapshot_reads:
+        while not db.snapshot_status()['in_use']:
+            time.sleep(0.05)
+
+    counts = [{'reads': 0} for _ in range(readers)]
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=reader, args=(user_id, start, end, deadline, c)) for c in counts]
+    threads.append(threading.Thread(target=writer, args=(user_id, account_id, deadline, latencies)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    wal = os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0
+    status = db.snapshot_status()
+    db.SNAPSHOT_READS = False
+    db.close_snapshots()
+    db.close_pools()
+    latencies.sort()
+    return {
+        'reads/s': sum(c['reads'] for c in counts) / seconds,
+        'writes': len(latencies),
+        'p50 ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        'wal MiB': wal / 2**20,
+        'refreshes': status.get('refreshes', 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="existing synthetic database to copy (default: generate a fresh one)")
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--refresh', type=float, default=2.0,
+                        help="seconds between snapshot refreshes (default: %(default)s)")
+    args = parser.parse_args()
+
+    source = args.db
+    if not source:
+        source = os.path.join(tempfile.mkdtemp(), 'synth.db')
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synth.py'),
+                        '--db', source, '--users', str(args.users), '--transactions', str(args.transactions),
+                        '--years', str(args.years)], check=True)
+        print()
+    db.CACHE_ENABLED = False
+    db.SNAPSHOT_REFRESH = args.refresh
+
+    print(f"{args.readers} readers, 1 writer, {args.seconds:g}s per run, refresh every {args.refresh:g}s")
+    print(f"{'reads from':<12}{'reads/s':>10}{'writes':>10}{'p50 ms':>10}{'p99 ms':>10}{'wal MiB':>10}{'refreshes':>11}")
+    for mode, snapshot_reads in (('live', False), ('snapshot', True)):
+        result = run(source, snapshot_reads, args.readers, args.seconds)
+        print(f"{mode:<12}{result['reads/s']:>10.1f}{result['writes']:>10}{result['p50 ms']:>10.2f}"
+              f"{result['p99 ms']:>10.2f}{result['wal MiB']:>10.1f}{result['refreshes']:>11}")
+
+
+if __name__ == '__main__':
+    main()
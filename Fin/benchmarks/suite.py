@@ -0,0 +1,232 @@
+"""Time the public database.py API against a synthetic workload.
+
+Every read is timed three ways:
+  cold    pools closed and read cache cleared before each call (the OS page
+          cache stays warm, so this measures connection setup plus SQLite's
+          own cache misses)
+  warm    read cache disabled, connections and SQLite cache warm
+  cached  read cache enabled and primed
+Writes (add_transaction, delete_transaction) are timed as throughput.
+
+Results are written as JSON; pass a previous run to --compare to flag
+regressions.
+
+    python benchmarks/suite.py --transactions 200000 --output results.json
+    python benchmarks/suite.py --db /tmp/synth.db --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+import synth
+
+
+def busiest_user():
+    with db.get_db(readonly=True) as conn:
+        row = conn.execute("""
+            SELECT user_id, COUNT(*) AS n, MAX(txn_date) AS last FROM transactions
+            GROUP BY user_id ORDER BY n DESC LIMIT 1
+        """).fetchone()
+        account_id = conn.execute(
+            "SELECT account_id FROM accounts WHERE user_id = ? ORDER BY account_id LIMIT 1", (row['user_id'],)
+        ).fetchone()[0]
+    return row['user_id'], row['n'], date.fromisoformat(row['last'][:10]), account_id
+
+
+def read_cases(user_id, count, today, account_id):
+    month_start = today.replace(day=1)
+    year_ago = today - timedelta(days=365)
+    cases = []
+    for offset in (0, 10000, 100000):
+        if offset < count:
+            cases.append((f"get_transactions[offset={offset}]",
+                          lambda o=offset: db.get_transactions(user_id, limit=100, offset=o)))
+
+    deep = db.get_transactions(user_id, limit=1, offset=min(100000, count - 1))[0]
+    deep_cursor = db.encode_cursor(deep)
+    cases += [
+        ("query_transactions[first]", lambda: db.query_transactions(user_id)),
+        ("query_transactions[deep]", lambda: db.query_transactions(user_id, cursor=deep_cursor)),
+        ("query_transactions[filtered]", lambda: db.query_transactions(
+            user_id, {'txn_type': 'income', 'start_date': year_ago})),
+        ("search_transactions", lambda: db.search_transactions(user_id, 'amazon')),
+        ("get_accounts", lambda: db.get_accounts(user_id)),
+        ("get_categories", lambda: db.get_categories(user_id)),
+        ("get_merchants", lambda: db.get_merchants(user_id)),
+        ("get_spending_by_category[month]", lambda: db.get_spending_by_category(user_id, month_start, today)),
+        ("get_spending_by_category[all]", lambda: db.get_spending_by_category(user_id)),
+        ("get_monthly_summary", lambda: db.get_monthly_summary(user_id, today.year, today.month)),
+        ("get_period_summaries[day]", lambda: db.get_period_summaries(user_id, year_ago, today, 'day')),
+        ("get_period_summaries[month]", lambda: db.get_period_summaries(user_id, None, today, 'month')),
+        ("get_totals_by_type", lambda: db.get_totals_by_type(user_id, year_ago, today)),
+        ("get_daily_spending", lambda: db.get_daily_spending(user_id, today - timedelta(days=30), today)),
+        ("get_top_merchants", lambda: db.get_top_merchants(user_id, year_ago, today)),
+        ("get_balance_history[day]", lambda: db.get_balance_history(user_id, account_id, year_ago, today)),
+        ("get_budget_report", lambda: db.get_budget_report(user_id, as_of=today)),
+        ("get_transactions_frame[10k]", lambda: db.get_transactions_frame(user_id, limit=10000)),
+        ("get_period_summaries_frame", lambda: db.get_period_summaries_frame(user_id, None, today, 'month')),
+    ]
+    return cases
+
+
+def summarize(name, mode, samples, **extra):
+    samples = sorted(samples)
+    result = {
+        'name': name,
+        'mode': mode,
+        'runs': len(samples),
+        'min_ms': samples[0] * 1000,
+        'median_ms': statistics.median(samples) * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+    }
+    result.update(extra)
+    return result
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def run_reads(cases, repeat):
+    results = []
+    for name, fn in cases:
+        samples = []
+        for _ in range(repeat):
+            db.close_pools()
+            db.clear_cache()
+            samples.append(timed(fn))
+        results.append(summarize(name, 'cold', samples))
+
+        db.CACHE_ENABLED = False
+        fn()
+        results.append(summarize(name, 'warm', [timed(fn) for _ in range(repeat)]))
+
+        db.CACHE_ENABLED = True
+        fn()
+        results.append(summarize(name, 'cached', [timed(fn) for _ in range(repeat)]))
+        print(f"{name:<36}" + "".join(f"{r['median_ms']:>10.2f}" for r in results[-3:]))
+    return results
+
+
+def run_writes(user_id, account_id, today, count):
+    added = []
+    samples = []
+    for i in range(count):
+        started = time.perf_counter()
+        added.append(db.add_transaction(user_id, account_id, 'expense', 100 + i % 500, today,
+                                        description=f"benchmark {i}"))
+        samples.append(time.perf_counter() - started)
+    total = sum(samples)
+    add = summarize('add_transaction', 'write', samples, ops_per_s=count / total)
+
+    samples = [timed(lambda t=transaction_id: db.delete_transaction(t, user_id)) for transaction_id in added]
+    total = sum(samples)
+    delete = summarize('delete_transaction', 'write', samples, ops_per_s=count / total)
+    for result in (add, delete):
+        print(f"{result['name']:<36}{result['median_ms']:>10.2f}{result['ops_per_s']:>10.0f}/s")
+    return [add, delete]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline_path, threshold, min_ms):
+    with open(baseline_path) as f:
+        earlier = json.load(f)
+    if earlier['meta'].get('workload') != report['meta']['workload']:
+        print("\nwarning: baseline was run against a different workload")
+    baseline = {(r['name'], r['mode']): r for r in earlier['results']}
+
+    regressions = 0
+    print(f"\n{'benchmark':<36}{'mode':<8}{'before':>10}{'after':>10}{'ratio':>8}")
+    for result in report['results']:
+        before = baseline.get((result['name'], result['mode']))
+        if before is None:
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        flag = ''
+        # Sub-millisecond timings jitter by more than the threshold
+        if ratio > threshold and result['median_ms'] - before['median_ms'] >= min_ms:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{result['name']:<36}{result['mode']:<8}{before['median_ms']:>10.2f}"
+              f"{result['median_ms']:>10.2f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help="existing synthetic database (default: generate a fresh one)")
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--writes', type=int, default=500)
+    parser.add_argument('--output', help="write JSON results to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="median slowdown that counts as a regression (default: %(default)s)")
+    parser.add_argument('--min-ms', type=float, default=1.0,
+                        help="ignore slowdowns smaller than this many ms (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.db:
+        db.DB_NAME = args.db
+        db.init_db()
+        workload = {'db': args.db}
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'suite.db')
+        print(f"generating {args.transactions:,} transactions for {args.users} users...")
+        workload = synth.generate(path, args.users, args.transactions, args.years, args.seed)
+
+    user_id, count, today, account_id = busiest_user()
+    print(f"user {user_id}: {count:,} transactions up to {today}\n")
+    print(f"{'benchmark':<36}{'cold':>10}{'warm':>10}{'cached':>10}  (median ms)")
+    results = run_reads(read_cases(user_id, count, today, account_id), args.repeat)
+    results += run_writes(user_id, account_id, today, args.writes)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'user_transactions': count,
+            'workload': workload,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold, args.min_ms)
+        print(f"\n{regressions} regressions over {args.threshold:g}x")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""Generate a deterministic synthetic workload for benchmarking.
+
+Creates users with a realistic spread of accounts, categories, merchants,
+tags and budgets, and millions of transactions over several years. The same
+arguments always produce the same database.
+
+    python benchmarks/synth.py --db /tmp/synth.db --users 10 --transactions 1000000 --years 3
+"""
+import argparse
+import bisect
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+END_DATE = date(2025, 12, 31)
+CHUNK_SIZE = 50000
+
+# name: (share of expense transactions, median amount in rupees, spread)
+EXPENSE_CATEGORIES = {
+    'Groceries': (24, 1200, 0.7),
+    'Dining': (16, 650, 0.6),
+    'Transportation': (14, 250, 0.8),
+    'Shopping': (11, 1800, 1.0),
+    'Utilities': (5, 1800, 0.5),
+    'Entertainment': (7, 700, 0.7),
+    'Healthcare': (4, 1100, 0.9),
+    'Education': (2, 4500, 0.8),
+    'Travel': (3, 7500, 0.9),
+    'Subscriptions': (6, 350, 0.4),
+    'Rent': (0, 0, 0),
+}
+INCOME_CATEGORIES = ('Salary', 'Freelance', 'Interest')
+
+MERCHANTS = {
+    'Groceries': ['BigBasket', 'DMart', 'Reliance Fresh', 'More', "Nature's Basket", 'Local Kirana'],
+    'Dining': ['Swiggy', 'Zomato', 'Cafe Coffee Day', 'Starbucks', "Haldiram's", 'Udupi Hotel'],
+    'Transportation': ['Uber', 'Ola', 'Rapido', 'Indian Oil', 'HP Petrol', 'Metro Card'],
+    'Shopping': ['Amazon', 'Flipkart', 'Myntra', 'Croma', 'Decathlon', 'IKEA'],
+    'Utilities': ['BESCOM', 'Airtel', 'Jio', 'ACT Fibernet', 'Water Board'],
+    'Entertainment': ['BookMyShow', 'PVR', 'Steam', 'Spotify'],
+    'Healthcare': ['Apollo Pharmacy', 'MedPlus', 'Practo', 'Manipal Hospital'],
+    'Education': ['Coursera', 'Udemy', 'Crossword', 'School Fees'],
+    'Travel': ['IRCTC', 'IndiGo', 'MakeMyTrip', 'OYO'],
+    'Subscriptions': ['Netflix', 'Prime Video', 'Hotstar', 'YouTube Premium', 'iCloud'],
+}
+
+ACCOUNT_TYPES = [
+    # name, type, chance the user has it, share of card/cash spending
+    ('Salary Account', 'checking', 1.0, 4),
+    ('Savings', 'savings', 0.7, 0),
+    ('Credit Card', 'credit_card', 0.6, 5),
+    ('Cash', 'cash', 0.4, 1),
+]
+
+TAGS = ('trip', 'work', 'gift', 'reimbursable', 'family')
+
+
+class Picker:
+    # Weighted choice with precomputed cumulative weights
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.cumulative = list(itertools.accumulate(weights))
+
+    def __call__(self, rng):
+        return self.items[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+def zipf_picker(items, s=1.1):
+    return Picker(items, [1 / (rank + 1) ** s for rank in range(len(items))])
+
+
+def split_total(rng, total, parts):
+    # Lognormal activity per user, so a few users dominate
+    weights = [rng.lognormvariate(0, 0.8) for _ in range(parts)]
+    scale = total / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    counts[0] += total - sum(counts)
+    return counts
+
+
+def create_user(conn, rng, index, password_hash):
+    user_id = conn.execute(
+        "INSERT INTO users (email, full_name, password_hash) VALUES (?, ?, ?)",
+        (f"user{index}@example.com", f"Synthetic User {index}", password_hash)
+    ).lastrowid
+
+    conn.executemany(
+        "INSERT INTO categories (user_id, name, kind) VALUES (?, ?, ?)",
+        [(user_id, name, 'expense') for name in EXPENSE_CATEGORIES]
+        + [(user_id, name, 'income') for name in INCOME_CATEGORIES]
+    )
+    categories = {
+        (row[1], row[2]): row[0] for row in conn.execute(
+            "SELECT category_id, name, kind FROM categories WHERE user_id = ?", (user_id,)
+        )
+    }
+
+    merchant_names = sorted({name for names in MERCHANTS.values() for name in names} | {f'Employer {index}'})
+    conn.executemany("INSERT INTO merchants (user_id, name) VALUES (?, ?)", [(user_id, n) for n in merchant_names])
+    merchants = dict(conn.execute("SELECT name, merchant_id FROM merchants WHERE user_id = ?", (user_id,)).fetchall())
+
+    accounts = []
+    for name, account_type, chance, spend_share in ACCOUNT_TYPES:
+        if rng.random() < chance:
+            opening = db.to_paise(round(rng.uniform(5000, 200000), 2)) if account_type != 'credit_card' else 0
+            account_id = conn.execute(
+                "INSERT INTO accounts (user_id, name, type, balance, opening_balance, currency) VALUES (?, ?, ?, ?, ?, 'INR')",
+                (user_id, name, account_type, opening, opening)
+            ).lastrowid
+            accounts.append((account_id, account_type, spend_share))
+
+    conn.executemany("INSERT INTO tags (user_id, name) VALUES (?, ?)", [(user_id, t) for t in TAGS])
+    tags = [row[0] for row in conn.execute("SELECT tag_id FROM tags WHERE user_id = ? ORDER BY tag_id", (user_id,))]
+    return user_id, categories, merchants, accounts, tags
+
+
+def user_transactions(rng, user_id, categories, merchants, accounts, count, start, days, index):
+    salary_account = accounts[0][0]
+    spend_account = Picker([a[0] for a in accounts if a[2]], [a[2] for a in accounts if a[2]])
+    expense_names = [name for name, spec in EXPENSE_CATEGORIES.items() if spec[0]]
+    pick_category = Picker(expense_names, [EXPENSE_CATEGORIES[n][0] for n in expense_names])
+    pick_merchant = {name: zipf_picker(MERCHANTS[name]) for name in expense_names}
+    salary = rng.randrange(40000, 250000)
+    rent = int(salary * rng.uniform(0.2, 0.35))
+
+    # Weekends are busier
+    day_picker = Picker(range(days), [1.4 if (start + timedelta(days=d)).weekday() >= 5 else 1.0 for d in range(days)])
+
+    rows = []
+    # Fixed monthly income and rent
+    month = date(start.year, start.month, 1)
+    while month <= start + timedelta(days=days - 1):
+        if month >= start:
+            rows.append((user_id, salary_account, categories['Salary', 'income'], merchants[f'Employer {index}'],
+                         'income', db.to_paise(salary), month.isoformat(), 'Salary credit'))
+            rows.append((user_id, salary_account, categories['Rent', 'expense'], None,
+                         'expense', db.to_paise(rent), (month + timedelta(days=4)).isoformat(), 'Monthly rent'))
+        month = (month + timedelta(days=32)).replace(day=1)
+
+    for i in range(max(count - len(rows), 0)):
+        day = (start + timedelta(days=day_picker(rng))).isoformat()
+        roll = rng.random()
+        if roll < 0.02:
+            rows.append((user_id, salary_account, categories['Freelance', 'income'], None, 'income',
+                         db.to_paise(round(rng.uniform(2000, 40000), 2)), day, f'Freelance invoice {i}'))
+        elif roll < 0.025:
+            rows.append((user_id, accounts[-1][0], None, None, 'transfer',
+                         db.to_paise(round(rng.uniform(1000, 20000), 2)), day, 'Transfer'))
+        else:
+            category = pick_category(rng)
+            _, median, spread = EXPENSE_CATEGORIES[category]
+            amount = max(round(median * math.exp(rng.gauss(0, spread)), 2), 1.0)
+            merchant = pick_merchant[category](rng)
+            rows.append((user_id, spend_account(rng), categories[category, 'expense'], merchants[merchant],
+                         'expense', db.to_paise(amount), day, f'{merchant} {category.lower()} #{i}'))
+    rows.sort(key=lambda row: row[6])
+    return rows
+
+
+def generate(path, users=10, transactions=1000000, years=3, seed=1, end=END_DATE, progress=None):
+    db.DB_NAME = path
+    db.init_db()
+    rng = random.Random(seed)
+    days = years * 365
+    start = end - timedelta(days=days - 1)
+    # One hash for everyone; bcrypt per user would dominate small runs
+    password_hash = '$2b$12$' + 'x' * 53
+
+    written = 0
+    for index, count in enumerate(split_total(rng, transactions, users)):
+        with db.get_db() as conn:
+            user_id, categories, merchants, accounts, tags = create_user(conn, rng, index, password_hash)
+            rows = user_transactions(rng, user_id, categories, merchants, accounts, count, start, days, index)
+            for chunk in db.iter_chunks(rows, CHUNK_SIZE):
+                conn.executemany("""
+                    INSERT INTO transactions
+                    (user_id, account_id, category_id, merchant_id, txn_type, amount, currency, txn_date, description)
+                    VALUES (?, ?, ?, ?, ?, ?, 'INR', ?, ?)
+                """, chunk)
+                written += len(chunk)
+                if progress:
+                    progress(written, transactions)
+
+            # About 3% of transactions carry a tag
+            conn.execute("""
+                INSERT INTO transaction_tags (transaction_id, tag_id)
+                SELECT transaction_id, ? + abs(transaction_id * 7919) % ?
+                FROM transactions WHERE user_id = ? AND abs(transaction_id * 104729) % 100 < 3
+            """, (tags[0], len(tags), user_id))
+
+            for name in ('Groceries', 'Dining', 'Shopping'):
+                limit = db.to_paise(EXPENSE_CATEGORIES[name][1] * 20)
+                budget_id = conn.execute("""
+                    INSERT INTO budgets (user_id, name, period, start_date, amount, currency)
+                    VALUES (?, ?, 'monthly', ?, ?, 'INR')
+                """, (user_id, name, start.isoformat(), limit)).lastrowid
+                conn.execute(
+                    "INSERT INTO budget_items (budget_id, category_id, amount) VALUES (?, ?, ?)",
+                    (budget_id, categories[name, 'expense'], limit)
+                )
+
+    # Balances follow from the opening balances and the generated history
+    db.reconcile_balances(fix=True)
+    return {'users': users, 'transactions': transactions, 'years': years, 'seed': seed,
+            'start': start.isoformat(), 'end': end.isoformat()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help="database file to create")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--end', type=date.fromisoformat, default=END_DATE,
+                        help="last day of generated history (default: %(default)s)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+
+    started = time.perf_counter()
+
+    def progress(done, total):
+        print(f"\r{done:,}/{total:,} transactions", end='', flush=True)
+
+    generate(args.db, args.users, args.transactions, args.years, args.seed, args.end, progress)
+    elapsed = time.perf_counter() - started
+    print(f"\n{args.db}: {args.transactions:,} transactions for {args.users} users in {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Compare add_transaction throughput with and without the group-commit queue.
+
+Each run starts N writer threads against a fresh scratch database, every
+thread calling add_transaction in a loop for a fixed time, once committing
+each insert on its own and once through the write queue (WRITE_BEHIND).
+
+    python benchmarks/write_queue.py --writers 1 8 64 --seconds 5
+    python benchmarks/write_queue.py --window 0.002       # wait for fuller batches
+    python benchmarks/write_queue.py --synchronous FULL   # fsync every commit
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+
+def writer(user_id, account_ids, deadline, counts, errors):
+    today = date.today()
+    n = 0
+    while time.perf_counter() < deadline:
+        try:
+            db.add_transaction(user_id, account_ids[n % len(account_ids)], 'expense', 1.0, today,
+                               description='write queue benchmark')
+            counts['writes'] += 1
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+        n += 1
+
+
+def run(write_behind, writers, seconds):
+    db.DB_NAME = os.path.join(tempfile.mkdtemp(), 'writes.db')
+    db.seed_sample_data()
+    user_id = db.get_user_by_email('test@example.com')['user_id']
+    account_ids = [row['account_id'] for row in db.get_accounts(user_id)]
+    db.WRITE_BEHIND = write_behind
+
+    per_thread = [{'writes': 0} for _ in range(writers)]
+    errors = []
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=writer, args=(user_id, account_ids, deadline, c, errors))
+        for c in per_thread
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    batch = None
+    if write_behind:
+        write_queue = db.get_write_queue()
+        batch = write_queue.requests / max(write_queue.batches, 1)
+        db.close_write_queues()
+    db.WRITE_BEHIND = False
+    db.close_pools()
+    return sum(c['writes'] for c in per_thread) / seconds, len(errors), batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--window', type=float, default=db.WRITE_QUEUE_WINDOW,
+                        help="seconds the queue waits to fill a batch (default: %(default)s)")
+    parser.add_argument('--synchronous', default=db.PRAGMAS['synchronous'],
+                        help="PRAGMA synchronous for the run (default: %(default)s)")
+    args = parser.parse_args()
+
+    db.WRITE_QUEUE_WINDOW = args.window
+    db.configure_pool(synchronous=args.synchronous)
+
+    print(f"{args.seconds:g}s per run, synchronous={args.synchronous}, window={args.window * 1000:g}ms")
+    print(f"{'writers':>8}{'mode':>10}{'writes/s':>12}{'lock errors':>14}{'avg batch':>12}")
+    for writers in args.writers:
+        for mode, write_behind in (('direct', False), ('queued', True)):
+            rate, errors, batch = run(write_behind, writers, args.seconds)
+            print(f"{writers:>8}{mode:>10}{rate:>12.0f}{errors:>14}"
+                  f"{'' if batch is None else f'{batch:.1f}':>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,693 @@
+import atexit
+import base64
+import bisect
+import csv
+import functools
+import hashlib
+import inspect
+import io
+import json
+import logging
+import os
+import queue
+import re
+import shutil
 import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from contextlib import contextmanager
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from urllib.parse import quote
 import bcrypt
 
 DB_NAME = "budgeting.db"
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+# Connection pool settings. Pragmas are applied once when a pooled connection
+# is opened; call configure_pool() to change them at runtime.
+POOL_SIZE = 8
+BUSY_TIMEOUT = 5.0
+PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+class ConnectionPool:
+    """Reusable SQLite connections for one database file.
+
+    The file is switched to WAL so readers never wait on the writer. Reads are
+    served from a stack of idle query_only connections; writes go through a
+    single connection behind a lock, since SQLite only allows one writer.
+    Databases registered with attach() are attached to every connection.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, pragmas=None, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._readers = queue.LifoQueue(maxsize=size)
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self.attachments = {}
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        if not readonly:
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def attach(self, name, path):
+        # Takes effect as each connection is next checked out
+        self.attachments[name] = path
+
+    def _attach(self, conn):
+        # ATTACH is refused inside a transaction, so this runs on checkout
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        for name, path in self.attachments.items():
+            if name not in attached:
+                conn.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+
+    def _writer_conn(self):
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+
+    @contextmanager
+    def reader(self):
+        # A thread that is inside a write must see its own uncommitted rows
+        if self.in_write():
+            yield self._local.writer
+            return
+
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect(readonly=True)
+        try:
+            if self.attachments:
+                self._attach(conn)
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._readers.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def writer(self, foreign_keys=True):
+        # Nested writes on the same thread join the outer transaction
+        if self.in_write():
+            yield self._local.writer
+            return
+
+        with self._write_lock:
+            conn = self._writer_conn()
+            if self.attachments:
+                self._attach(conn)
+            if not foreign_keys:
+                # Only takes effect outside a transaction
+                conn.execute("PRAGMA foreign_keys = OFF")
+            conn.execute("BEGIN IMMEDIATE")
+            self._local.writer = conn
+            self._local.after_commit = callbacks = []
+            try:
+                yield conn
+                if conn.in_transaction:
+                    conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._local.writer = None
+                self._local.after_commit = None
+                if not foreign_keys:
+                    conn.execute("PRAGMA foreign_keys = ON")
+        for callback in callbacks:
+            callback()
+
+    def in_write(self):
+        return getattr(self._local, 'writer', None) is not None
+
+    def after_commit(self, callback):
+        # Run callback once this thread's write transaction commits, or right
+        # away when there is none; it is dropped if the transaction rolls back
+        pending = getattr(self._local, 'after_commit', None)
+        if pending is None:
+            callback()
+        else:
+            pending.append(callback)
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(path=None):
+    path = path or DB_NAME
+    pool = _pools.get(path)
+    # Connections must not be shared with a forked child process
+    if pool is None or pool.pid != os.getpid():
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None or pool.pid != os.getpid():
+                pool = ConnectionPool(path, size=POOL_SIZE, timeout=BUSY_TIMEOUT)
+                if os.path.exists(archive_path(path)):
+                    pool.attach('archive', archive_path(path))
+                _pools[path] = pool
+    return pool
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+        _pools.clear()
+
+def configure_pool(size=None, timeout=None, **pragmas):
+    global POOL_SIZE, BUSY_TIMEOUT
+    if size is not None:
+        POOL_SIZE = size
+    if timeout is not None:
+        BUSY_TIMEOUT = timeout
+    PRAGMAS.update(pragmas)
+    # Existing connections keep their old settings, so start over
+    close_pools()
 
 @contextmanager
-def get_db():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+def get_db(readonly=False):
+    pool = get_pool()
+    with (pool.reader() if readonly else pool.writer()) as conn:
+        if _instrumenting:
+            with instrumentation.tracing(conn):
+                yield conn
+        else:
+            yield conn
+
+# Read cache
+#
+# Cached reads are keyed by user and tagged with that user's write
+# generation. Every write bumps the generation once it commits, retiring all
+# of the user's entries at once, and the least recently used entries are
+# evicted beyond CACHE_SIZE. The cache lives in this process only; call
+# clear_cache() after writing to the file from elsewhere.
+CACHE_SIZE = 512
+CACHE_ENABLED = True
+
+class ReadCache:
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self, user_id):
+        # clear() moves every user on by bumping the epoch
+        return self._epoch, self._generations.get(user_id, 0)
+
+    def get(self, key, user_id):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == self.generation(user_id):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, user_id, generation, value):
+        with self._lock:
+            # A write committed while this value was being read
+            if generation != self.generation(user_id):
+                return
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+read_cache = ReadCache()
+
+def _detach(value):
+    # Hand out copies so callers cannot mutate what is cached
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return {name: array.copy() for name, array in value.items()}
+    return value.copy()
+
+def cached(fn):
+    # For read functions whose first argument is user_id
+    @functools.wraps(fn)
+    def wrapper(user_id, *args, **kwargs):
+        # Inside a write this thread sees uncommitted rows, which must not
+        # be cached in case the transaction rolls back
+        if not CACHE_ENABLED or get_pool().in_write():
+            return fn(user_id, *args, **kwargs)
+
+        key = (DB_NAME, fn.__name__, user_id, args, tuple(sorted(kwargs.items())))
+        if getattr(fn, 'reads_snapshot', False):
+            snapshot = _fresh_snapshot()
+            key += (snapshot.generation if snapshot else None,)
+        hit, value = read_cache.get(key, user_id)
+        if not hit:
+            generation = read_cache.generation(user_id)
+            value = fn(user_id, *args, **kwargs)
+            read_cache.put(key, user_id, generation, value)
+        return _detach(value)
+    return wrapper
+
+def _invalidate(user_id):
+    get_pool().after_commit(lambda: read_cache.invalidate(user_id))
+
+def cache_stats():
+    return read_cache.stats()
+
+def clear_cache():
+    read_cache.clear()
+    fx_cache.clear()
+    _archive_horizons.clear()
+    expire_snapshot()
+
+# Instrumentation
+#
+# Off by default and free while off: enable_instrumentation() swaps every
+# public function in this module for a timing wrapper, and
+# disable_instrumentation() puts the originals back. While on, get_db()
+# traces each statement with set_trace_callback and charges it to the
+# innermost public call on the thread. A statement's time runs until the next
+# statement starts or the connection is released, so it includes fetching its
+# rows. Statements over slow_ms go to the slow-query log with their EXPLAIN
+# QUERY PLAN, and every new statement shape on transactions is explained once
+# so full scans are flagged even when they are fast.
+SLOW_QUERY_MS = 50.0
+SLOW_QUERY_LOG_SIZE = 100
+# Statements traced per connection checkout; bulk imports run far more
+TRACE_LIMIT = 1000
+# Latency histogram upper bounds in milliseconds, plus one overflow bucket
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_NOT_INSTRUMENTED = {
+    'get_pool', 'close_pools', 'configure_pool', 'get_db', 'cached', 'migration',
+    'get_write_queue', 'close_write_queues', 'cache_stats', 'clear_cache',
+    'get_snapshot', 'close_snapshots', 'expire_snapshot', 'reads_snapshot', 'analytics_db', 'snapshot_status',
+    'enable_instrumentation', 'disable_instrumentation', 'instrumentation_enabled', 'instrumentation_stats', 'reset_instrumentation',
+    'to_paise', 'encode_cursor', 'decode_cursor', 'schema_version', 'latest_version',
+}
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_TRANSACTIONS_ALIAS = re.compile(r"\btransactions\s+(?:AS\s+)?([A-Za-z_]\w*)", re.IGNORECASE)
+_NOT_ALIASES = {'where', 'join', 'left', 'inner', 'cross', 'on', 'group', 'order', 'limit',
+                'set', 'values', 'using', 'union', 'except', 'intersect', 'window', 'natural'}
+
+_log = logging.getLogger(__name__)
+
+class Instrumentation:
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._functions = {}
+            self._plans = {}
+            self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _function(self, name):
+        # Caller holds the lock
+        stats = self._functions.get(name)
+        if stats is None:
+            stats = self._functions[name] = {
+                'calls': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                'queries': 0, 'sql': 0.0, 'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            }
+        return stats
+
+    def call(self, name, fn, args, kwargs):
+        stack = self._stack()
+        stack.append(name)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            stack.pop()
+            with self._lock:
+                stats = self._function(name)
+                stats['calls'] += 1
+                stats['errors'] += failed
+                stats['total'] += elapsed
+                stats['max'] = max(stats['max'], elapsed)
+                stats['histogram'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed)] += 1
+
+    @contextmanager
+    def tracing(self, conn):
+        # A nested get_db() on a connection that is already traced (a read
+        # inside a write) leaves the outer trace in charge
+        if getattr(self._local, 'conn', None) is conn:
+            yield
+            return
+
+        statements = []
+        def trace(sql):
+            if len(statements) < TRACE_LIMIT:
+                statements.append((time.perf_counter(), sql))
+            elif len(statements) == TRACE_LIMIT:
+                # Marks where tracing stopped so the last statement's time ends there
+                statements.append((time.perf_counter(), None))
+
+        stack = self._stack()
+        owner = stack[-1] if stack else None
+        self._local.conn = conn
+        conn.set_trace_callback(trace)
+        try:
+            yield
+        finally:
+            conn.set_trace_callback(None)
+            self._local.conn = None
+            self._record(conn, owner, statements, time.perf_counter())
+
+    def _record(self, conn, owner, statements, ended):
+        # Trigger bodies are traced as "-- TRIGGER name" and count towards
+        # the statement that fired them
+        timed = []
+        for i, (started, sql) in enumerate(statements):
+            if sql is None or sql.startswith('--'):
+                continue
+            following = next((t for t, s in statements[i + 1:] if s is None or not s.startswith('--')), ended)
+            timed.append((sql, (following - started) * 1000))
+
+        with self._lock:
+            stats = self._function(owner or '(direct)')
+            stats['queries'] += len(timed)
+            stats['sql'] += sum(ms for _, ms in timed)
+
+        for sql, ms in timed:
+            slow = ms >= self.slow_ms
+            plan = self._explain(conn, owner, sql, force=slow)
+            if slow:
+                entry = {
+                    'at': datetime.now().isoformat(timespec='seconds'),
+                    'function': owner,
+                    'ms': ms,
+                    'sql': sql,
+                    'plan': plan['plan'] if plan else None,
+                    'scans': plan['scans'] if plan else [],
+                }
+                with self._lock:
+                    self.slow_queries.append(entry)
+                _log.warning("slow query in %s (%.1f ms): %s", owner, ms, ' '.join(sql.split()))
+
+    def _explain(self, conn, owner, sql, force):
+        statement = sql.lstrip()
+        if not statement.upper().startswith(_EXPLAINABLE):
+            return None
+        on_transactions = re.search(r'\btransactions\b', statement, re.IGNORECASE) is not None
+        shape = _SQL_LITERAL.sub('?', statement)
+        with self._lock:
+            plan = self._plans.get(shape)
+            if plan is not None:
+                plan['count'] += 1
+                return plan
+        if not (force or on_transactions):
+            return None
+
+        try:
+            details = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statement)]
+        except sqlite3.Error:
+            return None
+        tables = {'transactions'} | {
+            alias for alias in _TRANSACTIONS_ALIAS.findall(statement) if alias.lower() not in _NOT_ALIASES
+        }
+        scans = [d for d in details if d.startswith('SCAN ') and d.split()[1] in tables]
+        plan = {'function': owner, 'sql': statement, 'plan': details, 'scans': scans, 'count': 1}
+        with self._lock:
+            self._plans.setdefault(shape, plan)
+        if scans:
+            _log.warning("full scan of transactions in %s: %s", owner, '; '.join(scans))
+        return plan
+
+    def stats(self):
+        with self._lock:
+            functions = []
+            for name, stats in self._functions.items():
+                functions.append({
+                    'function': name,
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'total_ms': stats['total'],
+                    'mean_ms': stats['total'] / stats['calls'] if stats['calls'] else None,
+                    'p50_ms': self._percentile(stats, 0.5),
+                    'p95_ms': self._percentile(stats, 0.95),
+                    'max_ms': stats['max'],
+                    'queries': stats['queries'],
+                    'sql_ms': stats['sql'],
+                    'histogram': dict(zip(
+                        [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"],
+                        stats['histogram']
+                    )),
+                })
+            functions.sort(key=lambda f: f['total_ms'], reverse=True)
+            return {
+                'enabled': _instrumenting,
+                'slow_ms': self.slow_ms,
+                'functions': functions,
+                'slow_queries': list(self.slow_queries),
+                'scans': [dict(plan) for plan in self._plans.values() if plan['scans']],
+            }
+
+    @staticmethod
+    def _percentile(stats, q):
+        # Upper bound of the histogram bucket holding the q-th call
+        if not stats['calls']:
+            return None
+        target = q * stats['calls']
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, stats['histogram']):
+            seen += count
+            if seen >= target:
+                return float(min(bound, stats['max']))
+        return stats['max']
+
+instrumentation = Instrumentation()
+_instrumenting = False
+_uninstrumented = {}
+
+def _instrumented(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return instrumentation.call(name, fn, args, kwargs)
+    return wrapper
+
+def enable_instrumentation(slow_ms=None):
+    global _instrumenting
+    if slow_ms is not None:
+        instrumentation.slow_ms = slow_ms
+    if _instrumenting:
+        return
+    module = globals()
+    for name, fn in list(module.items()):
+        if (name.startswith('_') or name in _NOT_INSTRUMENTED or not inspect.isfunction(fn)
+                or fn.__module__ != __name__ or inspect.isgeneratorfunction(fn)):
+            continue
+        _uninstrumented[name] = fn
+        module[name] = _instrumented(name, fn)
+    _instrumenting = True
+
+def disable_instrumentation():
+    global _instrumenting
+    globals().update(_uninstrumented)
+    _uninstrumented.clear()
+    _instrumenting = False
+
+def instrumentation_enabled():
+    return _instrumenting
+
+def instrumentation_stats():
+    return instrumentation.stats()
+
+def reset_instrumentation():
+    instrumentation.reset()
+
+# Money
+#
+# Amounts and balances are stored as integer paise so that sums are exact.
+# The functions in this module take and return rupees: inputs go through
+# to_paise(), and queries divide the exact integer totals by 100 only when
+# returning them.
+def to_paise(amount):
     try:
-        yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+        paise = Decimal(str(amount).replace(',', '').strip()) * 100
+    except InvalidOperation:
+        raise ValueError(f"invalid amount {amount!r}") from None
+    # SQLite stores 64-bit integers; inf, NaN and anything larger cannot be kept
+    if not paise.is_finite() or abs(paise) >= 2**63:
+        raise ValueError(f"invalid amount {amount!r}")
+    return int(paise.to_integral_value(rounding=ROUND_HALF_UP))
+
+_ACCOUNT_COLUMNS = """
+    account_id, user_id, name, type, balance / 100.0 AS balance, currency, is_active, created_at,
+    opening_balance / 100.0 AS opening_balance
+"""
+
+_TRANSACTION_COLUMNS = """
+    t.transaction_id, t.user_id, t.account_id, t.category_id, t.merchant_id, t.txn_type,
+    t.amount / 100.0 AS amount, t.currency, t.txn_date, t.description, t.notes,
+    t.is_recurring, t.created_at, t.updated_at
+"""
+
+# Schema migrations
+#
+# Each migration runs once, in order, inside a single write transaction, and
+# PRAGMA user_version records the last one applied. Append new migrations;
+# never edit or renumber one that has shipped.
+MIGRATIONS = []
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+def migration(version):
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+def _run_script(conn, script):
+    # executescript() commits first, which would break the migration's
+    # transaction, so feed the statements through one at a time
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+@migration(1)
+def _initial_schema(conn):
+    with open(SCHEMA_PATH, 'r') as f:
+        _run_script(conn, f.read())
 
 def init_db():
+    # Fast path: Streamlit calls this on every rerun
+    if DB_NAME in _migrated:
+        return latest_version()
+
+    with _migrate_lock:
+        with get_db(readonly=True) as conn:
+            version = schema_version(conn)
+
+        if version < latest_version():
+            # Foreign keys are off so migrations can rebuild tables; the
+            # result is checked before committing instead
+            with get_pool().writer(foreign_keys=False) as conn:
+                # Another process may have migrated while we waited for the lock
+                version = schema_version(conn)
+                for number, apply in MIGRATIONS:
+                    if number > version:
+                        apply(conn)
+                        conn.execute(f"PRAGMA user_version = {int(number)}")
+                        version = number
+                if 'archive' in {row[1] for row in conn.execute("PRAGMA database_list")}:
+                    # Columns added to transactions belong in the archive too
+                    _sync_archive_schema(conn)
+                problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+                if problems:
+                    raise sqlite3.IntegrityError(f"migration broke {len(problems)} foreign key references")
+
+        _migrated.add(DB_NAME)
+        return version
+
+def seed_sample_data(email='test@example.com'):
+    init_db()
     with get_db() as conn:
-        with open('schema.sql', 'r') as f:
-            conn.executescript(f.read())
-        
         # Check if test user exists
-        cursor = conn.execute("SELECT user_id FROM users WHERE email = ?", ('test@example.com',))
+        cursor = conn.execute("SELECT user_id FROM users WHERE email = ?", (email,))
         if not cursor.fetchone():
             # Insert sample data
             password_hash = bcrypt.hashpw('password'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
             cursor = conn.execute(
                 "INSERT INTO users (email, full_name, password_hash) VALUES (?, ?, ?)",
-                ('test@example.com', 'Test User', password_hash)
+                (email, 'Test User', password_hash)
             )
             user_id = cursor.lastrowid
             
@@ -50,11 +706,11 @@ def init_db():
             ]
             conn.executemany("INSERT INTO categories (user_id, name, kind) VALUES (?, ?, ?)", categories)
             
-            # Insert sample accounts
+            # Insert sample accounts (amounts in paise)
             accounts = [
-                (user_id, 'Main Checking', 'checking', 5000.00, 'INR'),
-                (user_id, 'Savings Account', 'savings', 15000.00, 'INR'),
-                (user_id, 'Credit Card', 'credit_card', -1200.00, 'INR')
+                (user_id, 'Main Checking', 'checking', 500000, 'INR'),
+                (user_id, 'Savings Account', 'savings', 1500000, 'INR'),
+                (user_id, 'Credit Card', 'credit_card', -120000, 'INR')
             ]
             conn.executemany(
                 "INSERT INTO accounts (user_id, name, type, balance, currency) VALUES (?, ?, ?, ?, ?)",
@@ -76,59 +732,68 @@ def init_db():
             ]
             conn.executemany("INSERT INTO merchants (user_id, name) VALUES (?, ?)", merchants)
             
-            # Insert sample transactions
+            # Insert sample transactions (amounts in paise)
             from datetime import datetime, timedelta
             today = datetime.now().date()
             
             transactions = [
-                (user_id, 1, 1, 5, 'expense', 150.50, 'INR', today - timedelta(days=2), 'Weekly grocery shopping'),
-                (user_id, 1, 7, 7, 'expense', 45.75, 'INR', today - timedelta(days=5), 'Dinner with friends'),
-                (user_id, 1, 2, 10, 'income', 3500.00, 'INR', today - timedelta(days=10), 'Monthly salary'),
-                (user_id, 1, 4, 4, 'expense', 120.00, 'INR', today - timedelta(days=15), 'Electric bill'),
-                (user_id, 1, 5, 3, 'expense', 15.99, 'INR', today - timedelta(days=20), 'Netflix subscription'),
-                (user_id, 1, 6, 6, 'expense', 35.25, 'INR', today - timedelta(days=22), 'Gas fill-up'),
-                (user_id, 1, 8, 2, 'expense', 89.99, 'INR', today - timedelta(days=25), 'Amazon purchase'),
-                (user_id, 1, 9, 8, 'expense', 28.50, 'INR', today - timedelta(days=28), 'Prescription refill'),
-                (user_id, 1, 3, None, 'expense', 1200.00, 'INR', today - timedelta(days=30), 'Monthly rent'),
+                (user_id, 1, 1, 5, 'expense', 15050, 'INR', today - timedelta(days=2), 'Weekly grocery shopping'),
+                (user_id, 1, 7, 7, 'expense', 4575, 'INR', today - timedelta(days=5), 'Dinner with friends'),
+                (user_id, 1, 2, 10, 'income', 350000, 'INR', today - timedelta(days=10), 'Monthly salary'),
+                (user_id, 1, 4, 4, 'expense', 12000, 'INR', today - timedelta(days=15), 'Electric bill'),
+                (user_id, 1, 5, 3, 'expense', 1599, 'INR', today - timedelta(days=20), 'Netflix subscription'),
+                (user_id, 1, 6, 6, 'expense', 3525, 'INR', today - timedelta(days=22), 'Gas fill-up'),
+                (user_id, 1, 8, 2, 'expense', 8999, 'INR', today - timedelta(days=25), 'Amazon purchase'),
+                (user_id, 1, 9, 8, 'expense', 2850, 'INR', today - timedelta(days=28), 'Prescription refill'),
+                (user_id, 1, 3, None, 'expense', 120000, 'INR', today - timedelta(days=30), 'Monthly rent'),
             ]
             
             conn.executemany("""
                 INSERT INTO transactions 
-                (user_id, account_id, category_id, merchant_id, txn_type, amount, currency, txn_date, description)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, transactions)
+                (user_id, account_id, category_id, merchant_id, txn_type, amount, currency, txn_date, description,
+                 fingerprint)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [row + (_fingerprint(row[1], row[4], row[5], row[7], row[8]),) for row in transactions])
+            # The sample balances already include these transactions
+            _settle_opening_balances(conn, user_id)
 
 # User operations
 def get_user_by_email(email):
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.execute("SELECT * FROM users WHERE email = ?", (email,))
         return cursor.fetchone()
 
+def get_users():
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute("SELECT user_id, email, full_name, base_currency FROM users ORDER BY user_id")
+        return cursor.fetchall()
+
 # Account operations
+def _accounts_query(user_id):
+    return f"SELECT {_ACCOUNT_COLUMNS} FROM accounts WHERE user_id = ? ORDER BY name", (user_id,)
+
+@cached
 def get_accounts(user_id):
-    with get_db() as conn:
-        cursor = conn.execute(
-            "SELECT * FROM accounts WHERE user_id = ? ORDER BY name",
-            (user_id,)
-        )
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute(*_accounts_query(user_id))
         return cursor.fetchall()
 
 def add_account(user_id, name, account_type, balance, currency='INR'):
     with get_db() as conn:
         cursor = conn.execute(
-            "INSERT INTO accounts (user_id, name, type, balance, currency) VALUES (?, ?, ?, ?, ?)",
-            (user_id, name, account_type, balance, currency)
+            "INSERT INTO accounts (user_id, name, type, balance, opening_balance, currency) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, name, account_type, to_paise(balance), to_paise(balance), _currency_code(currency))
         )
+        _invalidate(user_id)
         return cursor.lastrowid
 
 def delete_account(account_id, user_id):
     with get_db() as conn:
         # Check if account has transactions
-        cursor = conn.execute(
-            "SELECT COUNT(*) as count FROM transactions WHERE account_id = ?",
-            (account_id,)
+        query, params = _with_archive(
+            "SELECT COUNT(*) as count FROM transactions WHERE account_id = ?", [account_id], None
         )
-        count = cursor.fetchone()['count']
+        count = sum(row['count'] for row in conn.execute(query, params))
         
         if count > 0:
             return False
@@ -138,11 +803,13 @@ def delete_account(account_id, user_id):
             "DELETE FROM accounts WHERE account_id = ? AND user_id = ?",
             (account_id, user_id)
         )
+        _invalidate(user_id)
         return True
 
 # Category operations
+@cached
 def get_categories(user_id, kind=None):
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         if kind:
             cursor = conn.execute(
                 "SELECT * FROM categories WHERE user_id = ? AND kind = ? ORDER BY name",
@@ -161,16 +828,16 @@ def add_category(user_id, name, kind='expense'):
             "INSERT INTO categories (user_id, name, kind) VALUES (?, ?, ?)",
             (user_id, name, kind)
         )
+        _invalidate(user_id)
         return cursor.lastrowid
 
 def delete_category(category_id, user_id):
     with get_db() as conn:
         # Check if category has transactions
-        cursor = conn.execute(
-            "SELECT COUNT(*) as count FROM transactions WHERE category_id = ?",
-            (category_id,)
+        query, params = _with_archive(
+            "SELECT COUNT(*) as count FROM transactions WHERE category_id = ?", [category_id], None
         )
-        count = cursor.fetchone()['count']
+        count = sum(row['count'] for row in conn.execute(query, params))
         
         if count > 0:
             return False
@@ -180,11 +847,13 @@ def delete_category(category_id, user_id):
             "DELETE FROM categories WHERE category_id = ? AND user_id = ?",
             (category_id, user_id)
         )
+        _invalidate(user_id)
         return True
 
 # Merchant operations
+@cached
 def get_merchants(user_id):
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.execute(
             "SELECT * FROM merchants WHERE user_id = ? ORDER BY name",
             (user_id,)
@@ -197,97 +866,3369 @@ def add_merchant(user_id, name):
             "INSERT INTO merchants (user_id, name) VALUES (?, ?)",
             (user_id, name)
         )
+        _invalidate(user_id)
         return cursor.lastrowid
 
-# Transaction operations
-def get_transactions(user_id, limit=100, offset=0):
+# Tag operations
+#
+# transaction_tags is keyed by (transaction_id, tag_id); migration 7 adds the
+# reverse (tag_id, transaction_id) index, so a tag's transactions are one
+# index range already in transaction_id order. Bulk calls take lists of ids
+# and pass them as a single JSON parameter, so any number of ids costs one
+# statement. Only ids that belong to the user are touched.
+@migration(7)
+def _add_tag_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transaction_tags_tag ON transaction_tags(tag_id, transaction_id)")
+
+@cached
+def get_tags(user_id):
+    count = "(SELECT COUNT(*) FROM transaction_tags x WHERE x.tag_id = g.tag_id)"
+    if _reads_archive(None):
+        count += " + " + _archive_sql(count)
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute(f"""
+            SELECT g.tag_id, g.name, g.created_at, {count} AS txn_count
+            FROM tags g
+            WHERE g.user_id = ?
+            ORDER BY g.name
+        """, (user_id,))
+        return cursor.fetchall()
+
+def add_tag(user_id, name):
+    with get_db() as conn:
+        cursor = conn.execute(
+            "INSERT INTO tags (user_id, name) VALUES (?, ?)",
+            (user_id, name)
+        )
+        _invalidate(user_id)
+        return cursor.lastrowid
+
+def rename_tag(tag_id, user_id, name):
+    with get_db() as conn:
+        cursor = conn.execute(
+            "UPDATE tags SET name = ? WHERE tag_id = ? AND user_id = ?",
+            (name, tag_id, user_id)
+        )
+        _invalidate(user_id)
+        return cursor.rowcount > 0
+
+def delete_tag(tag_id, user_id):
+    # Untags its transactions and drops budget items that use it
+    with get_db() as conn:
+        cursor = conn.execute(
+            "DELETE FROM tags WHERE tag_id = ? AND user_id = ?",
+            (tag_id, user_id)
+        )
+        _invalidate(user_id)
+        return cursor.rowcount > 0
+
+def _id_list(ids):
+    return json.dumps(sorted({int(i) for i in ids}))
+
+def tag_transactions(user_id, transaction_ids, tag_ids):
+    # Adds every tag to every transaction; returns the number of new links
     with get_db() as conn:
         cursor = conn.execute("""
-            SELECT t.*, a.name as account_name, c.name as category_name, m.name as merchant_name
-            FROM transactions t
-            LEFT JOIN accounts a ON t.account_id = a.account_id
-            LEFT JOIN categories c ON t.category_id = c.category_id
-            LEFT JOIN merchants m ON t.merchant_id = m.merchant_id
-            WHERE t.user_id = ?
+            INSERT OR IGNORE INTO transaction_tags (transaction_id, tag_id)
+            SELECT t.transaction_id, g.tag_id
+            FROM transactions t, tags g
+            WHERE t.transaction_id IN (SELECT value FROM json_each(?)) AND t.user_id = ?
+              AND g.tag_id IN (SELECT value FROM json_each(?)) AND g.user_id = ?
+        """, (_id_list(transaction_ids), user_id, _id_list(tag_ids), user_id))
+        _invalidate(user_id)
+        return cursor.rowcount
+
+def untag_transactions(user_id, transaction_ids, tag_ids):
+    # Removes the tags from the transactions; returns the number of links removed
+    with get_db() as conn:
+        cursor = conn.execute("""
+            DELETE FROM transaction_tags
+            WHERE transaction_id IN (
+                    SELECT transaction_id FROM transactions
+                    WHERE transaction_id IN (SELECT value FROM json_each(?)) AND user_id = ?
+                  )
+              AND tag_id IN (SELECT value FROM json_each(?))
+        """, (_id_list(transaction_ids), user_id, _id_list(tag_ids)))
+        _invalidate(user_id)
+        return cursor.rowcount
+
+def get_transaction_tags(user_id, transaction_ids):
+    # {transaction_id: [tag names]} for the given transactions, e.g. one page
+    query, params = _with_archive("""
+        SELECT x.transaction_id, g.name
+        FROM transaction_tags x
+        JOIN tags g ON g.tag_id = x.tag_id
+        WHERE x.transaction_id IN (SELECT value FROM json_each(?)) AND g.user_id = ?
+    """, [_id_list(transaction_ids), user_id], None)
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute(query + " ORDER BY x.transaction_id, g.name", params)
+        tags = {}
+        for transaction_id, name in cursor:
+            tags.setdefault(transaction_id, []).append(name)
+        return tags
+
+# Transaction operations
+def get_transactions(user_id, limit=100, offset=0):
+    query, params = _with_archive(f"""
+        SELECT {_TRANSACTION_COLUMNS}, a.name as account_name, c.name as category_name, m.name as merchant_name
+        FROM transactions t
+        LEFT JOIN accounts a ON t.account_id = a.account_id
+        LEFT JOIN categories c ON t.category_id = c.category_id
+        LEFT JOIN merchants m ON t.merchant_id = m.merchant_id
+        WHERE t.user_id = ?
+    """, [user_id], None)
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute(f"""
+            {query}
             ORDER BY t.txn_date DESC, t.created_at DESC
             LIMIT ? OFFSET ?
-        """, (user_id, limit, offset))
+        """, params + [limit, offset])
         return cursor.fetchall()
 
+def _balance_delta(txn_type, amount):
+    # Change a transaction makes to its account's balance; transfers move nothing
+    if txn_type == 'income':
+        return amount
+    if txn_type == 'expense':
+        return -amount
+    return 0
+
+def _insert_transaction(conn, user_id, account_id, txn_type, amount, txn_date,
+                        category_id, merchant_id, description, notes):
+    # Amounts are in the account's currency
+    cursor = conn.execute("""
+        INSERT INTO transactions 
+        (user_id, account_id, category_id, merchant_id, txn_type, amount, currency, txn_date, description, notes,
+         fingerprint)
+        VALUES (?, ?, ?, ?, ?, ?, (SELECT currency FROM accounts WHERE account_id = ?), ?, ?, ?, ?)
+    """, (user_id, account_id, category_id, merchant_id, txn_type, amount, account_id, txn_date, description, notes,
+          _fingerprint(account_id, txn_type, amount, txn_date, description)))
+    return cursor.lastrowid, account_id, _balance_delta(txn_type, amount)
+
+def _remove_transaction(conn, transaction_id, user_id):
+    # Get transaction details to reverse balance
+    txn = conn.execute(
+        "SELECT account_id, txn_type, amount FROM transactions WHERE transaction_id = ? AND user_id = ?",
+        (transaction_id, user_id)
+    ).fetchone()
+    if not txn:
+        return False, None, 0
+    conn.execute("DELETE FROM transactions WHERE transaction_id = ? AND user_id = ?",
+                 (transaction_id, user_id))
+    return True, txn['account_id'], -_balance_delta(txn['txn_type'], txn['amount'])
+
+def _remove_transactions(conn, user_id, ids):
+    # ids as from _id_list. Corrects the balances itself, one UPDATE per
+    # account, so the write queue has no delta left to apply.
+    nets = conn.execute(f"""
+        SELECT account_id, SUM({_NET_AMOUNT}) FROM transactions
+        WHERE transaction_id IN (SELECT value FROM json_each(?)) AND user_id = ?
+        GROUP BY account_id
+    """, (ids, user_id)).fetchall()
+    cursor = conn.execute("""
+        DELETE FROM transactions WHERE transaction_id IN (SELECT value FROM json_each(?)) AND user_id = ?
+    """, (ids, user_id))
+    conn.executemany("UPDATE accounts SET balance = balance - ? WHERE account_id = ?",
+                     [(net, account_id) for account_id, net in nets if net])
+    return cursor.rowcount, None, 0
+
 def add_transaction(user_id, account_id, txn_type, amount, txn_date, 
                    category_id=None, merchant_id=None, description=None, notes=None):
+    args = (user_id, account_id, txn_type, to_paise(amount), txn_date, category_id, merchant_id, description, notes)
+    # A write already in progress on this thread holds the writer the queue needs
+    if WRITE_BEHIND and not get_pool().in_write():
+        return get_write_queue().submit(_insert_transaction, user_id, args).result()
     with get_db() as conn:
-        cursor = conn.execute("""
-            INSERT INTO transactions 
-            (user_id, account_id, category_id, merchant_id, txn_type, amount, txn_date, description, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, account_id, category_id, merchant_id, txn_type, amount, txn_date, description, notes))
-        
+        transaction_id, _, delta = _insert_transaction(conn, *args)
         # Update account balance
-        if txn_type == 'expense':
-            conn.execute("UPDATE accounts SET balance = balance - ? WHERE account_id = ?", (amount, account_id))
-        elif txn_type == 'income':
-            conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_id = ?", (amount, account_id))
-        
-        return cursor.lastrowid
+        if delta:
+            conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_id = ?", (delta, account_id))
+        _invalidate(user_id)
+        return transaction_id
 
 def delete_transaction(transaction_id, user_id):
+    if WRITE_BEHIND and not get_pool().in_write():
+        return get_write_queue().submit(_remove_transaction, user_id, (transaction_id, user_id)).result()
+    with get_db() as conn:
+        deleted, account_id, delta = _remove_transaction(conn, transaction_id, user_id)
+        if deleted:
+            # Reverse the balance change
+            conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_id = ?", (delta, account_id))
+            _invalidate(user_id)
+        return deleted
+
+def delete_transactions(user_id, transaction_ids):
+    # Deletes any number of the user's transactions in one write, with one
+    # balance correction per account; returns the number deleted. Archived
+    # transactions are read-only and are left out of the count, as are ids
+    # that are not the user's.
+    ids = _id_list(transaction_ids)
+    if WRITE_BEHIND and not get_pool().in_write():
+        return get_write_queue().submit(_remove_transactions, user_id, (user_id, ids)).result()
+    with get_db() as conn:
+        deleted, _, _ = _remove_transactions(conn, user_id, ids)
+        if deleted:
+            _invalidate(user_id)
+        return deleted
+
+def submit_add_transaction(user_id, account_id, txn_type, amount, txn_date,
+                           category_id=None, merchant_id=None, description=None, notes=None):
+    # Queues the insert and returns a Future for its transaction_id
+    args = (user_id, account_id, txn_type, to_paise(amount), txn_date, category_id, merchant_id, description, notes)
+    return get_write_queue().submit(_insert_transaction, user_id, args)
+
+def submit_delete_transaction(transaction_id, user_id):
+    # Queues the delete and returns a Future for whether a row was deleted
+    return get_write_queue().submit(_remove_transaction, user_id, (transaction_id, user_id))
+
+# Write queue
+#
+# Optional write-behind path for many concurrent writers. One thread per
+# database file takes requests off a queue, gathers whatever else is waiting
+# (up to WRITE_QUEUE_BATCH requests) and applies them in a single
+# transaction: each request inside its own savepoint, so a bad one fails
+# alone, then one balance UPDATE per account for the whole batch. Each
+# caller's Future resolves once the batch commits. With WRITE_BEHIND on,
+# add_transaction(), delete_transaction() and delete_transactions() go
+# through the queue and wait for their result.
+#
+# Requests that arrive while a batch commits make up the next one, so busy
+# periods batch themselves. WRITE_QUEUE_WINDOW makes the thread wait that
+# many seconds for more requests before committing; it gives bigger batches
+# at the cost of latency, which a lone writer pays on every call.
+WRITE_BEHIND = False
+WRITE_QUEUE_WINDOW = 0.0
+WRITE_QUEUE_BATCH = 1000
+
+class WriteQueue:
+    def __init__(self, path, window=WRITE_QUEUE_WINDOW, batch=WRITE_QUEUE_BATCH):
+        self.path = path
+        self.window = window
+        self.batch = batch
+        self.pid = os.getpid()
+        self.batches = 0
+        self.requests = 0
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"write-queue:{path}", daemon=True)
+        self._thread.start()
+
+    def submit(self, operation, user_id, args):
+        future = Future()
+        self._requests.put((future, operation, user_id, args))
+        return future
+
+    def close(self):
+        # Commits whatever is already queued, then stops the thread
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch:
+                try:
+                    request = self._requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._commit(batch)
+                    return
+                batch.append(request)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        outcomes = []
+        deltas = {}
+        users = set()
+        try:
+            with get_pool(self.path).writer() as conn:
+                for future, operation, user_id, args in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT write_queue")
+                    try:
+                        result, account_id, delta = operation(conn, *args)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_queue")
+                        conn.execute("RELEASE write_queue")
+                        outcomes.append((future, None, e))
+                        continue
+                    conn.execute("RELEASE write_queue")
+                    if delta:
+                        deltas[account_id] = deltas.get(account_id, 0) + delta
+                    if result:
+                        users.add(user_id)
+                    outcomes.append((future, result, None))
+
+                for account_id, delta in deltas.items():
+                    if delta:
+                        conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_id = ?",
+                                     (delta, account_id))
+        except Exception as e:
+            # Includes a writer that could not be opened, before any request
+            # started; every caller still waiting gets the error
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for user_id in users:
+            read_cache.invalidate(user_id)
+        self.batches += 1
+        self.requests += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+_write_queues = {}
+
+def get_write_queue(path=None):
+    path = path or DB_NAME
+    write_queue = _write_queues.get(path)
+    if write_queue is None or write_queue.pid != os.getpid():
+        with _pools_lock:
+            write_queue = _write_queues.get(path)
+            if write_queue is None or write_queue.pid != os.getpid():
+                write_queue = WriteQueue(path, WRITE_QUEUE_WINDOW, WRITE_QUEUE_BATCH)
+                _write_queues[path] = write_queue
+    return write_queue
+
+def close_write_queues():
+    with _pools_lock:
+        write_queues = [q for q in _write_queues.values() if q.pid == os.getpid()]
+        _write_queues.clear()
+    for write_queue in write_queues:
+        write_queue.close()
+
+atexit.register(close_write_queues)
+
+# Analytics snapshot
+#
+# Optional: with SNAPSHOT_READS on, the analytics reads (summaries, charts,
+# budget reports) run against a read-only copy of the database rather than
+# the live file, so heavy reports never share it with interactive writes. A
+# background thread per file refreshes the copy every SNAPSHOT_REFRESH
+# seconds through the backup API, SNAPSHOT_STEP_PAGES pages per step. The
+# source connection holds one read transaction for the whole copy, so
+# writes carry on meanwhile without restarting it, and the copy is as of the
+# moment it began. Each refresh builds a new copy and swaps it in; reads
+# already running finish on the old one.
+#
+# A copy older than SNAPSHOT_MAX_AGE seconds is not used: those reads go to
+# the live file until the next refresh lands, so results are never staler
+# than that. Cached results are keyed by the copy they were read from.
+# Changes that must not be mixed with older data (clear_cache(), a new base
+# currency) retire the copy and ask for a new one. Each copy is a new file
+# named after SNAPSHOT_PATH (or in a temporary directory) with its
+# generation, e.g. snapshot.3.db, and each thread reads it through its own
+# query_only connection, reopened when a new copy lands, so analytics reads
+# run in parallel as they do on the pooled readers. Nothing overwrites a file
+# a reader has open; older copies are removed once they can be (on Windows,
+# after their last reader has moved on). The archive is attached read-only. Settings are read when a file's snapshot
+# starts; call close_snapshots() to apply new ones.
+SNAPSHOT_READS = False
+SNAPSHOT_MAX_AGE = 300.0
+SNAPSHOT_REFRESH = 60.0
+SNAPSHOT_STEP_PAGES = 1024
+SNAPSHOT_PATH = None
+
+def _read_only_uri(path):
+    return f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+class Snapshot:
+    def __init__(self, path, target=None, refresh=SNAPSHOT_REFRESH, step_pages=SNAPSHOT_STEP_PAGES):
+        self.path = path
+        self._scratch = None if target else tempfile.mkdtemp(prefix='snapshot-')
+        self.target = target or os.path.join(self._scratch, 'snapshot.db')
+        self._file = None
+        self._stale = []
+        self.refresh_interval = refresh
+        self.step_pages = step_pages
+        self.pid = os.getpid()
+        self.generation = 0
+        self.taken_at = None
+        self.refreshes = 0
+        self.failures = 0
+        self.last_refresh_seconds = None
+        self._epoch = 0
+        # Held while a new copy is swapped in and while a thread opens one,
+        # never during a read
+        self._swap_lock = threading.Lock()
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"snapshot:{path}", daemon=True)
+        self._thread.start()
+
+    def age(self):
+        # Seconds since the current copy was taken, or None without a usable one
+        return None if self.taken_at is None else time.time() - self.taken_at
+
+    def fresh(self, max_age):
+        age = self.age()
+        return age is not None and age <= max_age
+
+    def expire(self):
+        # Stop serving the current copy (and one being taken now) and refresh
+        self._epoch += 1
+        self.taken_at = None
+        self._wake.set()
+
+    def _open(self):
+        conn = sqlite3.connect(_read_only_uri(self._file), uri=True, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        if os.path.exists(archive_path(self.path)):
+            conn.execute("ATTACH DATABASE ? AS archive", (_read_only_uri(archive_path(self.path)),))
+        return conn
+
+    @contextmanager
+    def reader(self):
+        # This thread's connection to the current copy; a thread still on an
+        # older one moves over on its next read
+        local = self._local
+        if getattr(local, 'generation', None) != self.generation:
+            if getattr(local, 'conn', None) is not None:
+                local.conn.close()
+            with self._swap_lock:
+                local.conn, local.generation = self._open(), self.generation
+        yield local.conn
+
+    def refresh(self):
+        epoch = self._epoch
+        started = time.time()
+        root, ext = os.path.splitext(self.target)
+        path = f"{root}.{self.generation + 1}{ext}"
+        staging = f"{path}.tmp"
+        source = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            # One read transaction for the whole copy: writes by other
+            # connections neither restart the backup nor change what it sees
+            source.execute("BEGIN")
+            source.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+            copy = sqlite3.connect(staging, isolation_level=None)
+            source.backup(copy, pages=self.step_pages)
+            # The copy inherits WAL from the source; a plain file is one file
+            copy.execute("PRAGMA journal_mode = DELETE")
+            copy.close()
+        finally:
+            source.close()
+
+        self.last_refresh_seconds = time.time() - started
+        with self._swap_lock:
+            if epoch != self._epoch:
+                # Expired while copying; the next round takes a new one
+                os.remove(staging)
+                return False
+            os.replace(staging, path)
+            if self._file:
+                self._stale.append(self._file)
+            self._file = path
+            self.generation += 1
+            self.taken_at = started
+            self.refreshes += 1
+        self._remove_stale()
+        return True
+
+    def _remove_stale(self):
+        # Windows will not remove a file a reader still has open; try again
+        # after the next refresh
+        for path in list(self._stale):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            self._stale.remove(path)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                self.failures += 1
+                _log.exception("snapshot of %s failed", self.path)
+            self._wake.wait(self.refresh_interval)
+
+    def close(self):
+        # Threads' connections are closed as they are collected
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self.taken_at = None
+        if self._file:
+            self._stale.append(self._file)
+        self._remove_stale()
+        if self._scratch:
+            shutil.rmtree(self._scratch, ignore_errors=True)
+
+_snapshots = {}
+
+def get_snapshot(path=None):
+    path = path or DB_NAME
+    snapshot = _snapshots.get(path)
+    if snapshot is None or snapshot.pid != os.getpid():
+        with _pools_lock:
+            snapshot = _snapshots.get(path)
+            if snapshot is None or snapshot.pid != os.getpid():
+                snapshot = Snapshot(path, SNAPSHOT_PATH, SNAPSHOT_REFRESH, SNAPSHOT_STEP_PAGES)
+                _snapshots[path] = snapshot
+    return snapshot
+
+def close_snapshots():
+    with _pools_lock:
+        snapshots = [s for s in _snapshots.values() if s.pid == os.getpid()]
+        _snapshots.clear()
+    for snapshot in snapshots:
+        snapshot.close()
+
+def expire_snapshot(path=None):
+    snapshot = _snapshots.get(path or DB_NAME)
+    if snapshot is not None and snapshot.pid == os.getpid():
+        snapshot.expire()
+
+def _fresh_snapshot():
+    # A thread inside a write must see its own rows
+    if not SNAPSHOT_READS or get_pool().in_write():
+        return None
+    snapshot = get_snapshot()
+    return snapshot if snapshot.fresh(SNAPSHOT_MAX_AGE) else None
+
+def reads_snapshot(fn):
+    # Marks a read that goes through analytics_db(), so that @cached keys its
+    # results by the copy they came from
+    fn.reads_snapshot = True
+    return fn
+
+@contextmanager
+def analytics_db():
+    # The snapshot when it is on and fresh enough, otherwise a live reader
+    snapshot = _fresh_snapshot()
+    if snapshot is None:
+        with get_db(readonly=True) as conn:
+            yield conn
+        return
+    with snapshot.reader() as conn:
+        if _instrumenting:
+            with instrumentation.tracing(conn):
+                yield conn
+        else:
+            yield conn
+
+def snapshot_status():
+    # What the analytics reads are served from, for display
+    if not SNAPSHOT_READS:
+        return {'enabled': False, 'in_use': False, 'age': None, 'max_age': SNAPSHOT_MAX_AGE}
+    snapshot = get_snapshot()
+    return {
+        'enabled': True,
+        'in_use': snapshot.fresh(SNAPSHOT_MAX_AGE),
+        'age': snapshot.age(),
+        'max_age': SNAPSHOT_MAX_AGE,
+        'generation': snapshot.generation,
+        'refreshes': snapshot.refreshes,
+        'failures': snapshot.failures,
+        'last_refresh_seconds': snapshot.last_refresh_seconds,
+    }
+
+# Keyset pagination
+#
+# Listings are ordered newest first by (txn_date, created_at, transaction_id)
+# and resume after the last row of the previous page, so every page costs the
+# same no matter how deep it is. Each filterable column has an index that ends
+# in (txn_date, created_at); transaction_id is the rowid, which SQLite appends
+# to every index.
+TRANSACTION_PAGE_SIZE = 100
+
+@migration(3)
+def _add_keyset_indexes(conn):
+    _run_script(conn, """
+        DROP INDEX IF EXISTS idx_transactions_user_date;
+        CREATE INDEX idx_transactions_user_date ON transactions(user_id, txn_date, created_at);
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_type ON transactions(user_id, txn_type, txn_date, created_at);
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_account ON transactions(user_id, account_id, txn_date, created_at);
+        DROP INDEX IF EXISTS idx_transactions_category;
+        CREATE INDEX idx_transactions_category ON transactions(user_id, category_id, txn_date, created_at);
+        DROP INDEX IF EXISTS idx_transactions_merchant;
+        CREATE INDEX idx_transactions_merchant ON transactions(user_id, merchant_id, txn_date, created_at);
+    """)
+
+def _pack_cursor(values):
+    payload = json.dumps(values)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def _unpack_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("invalid cursor")
+    return values
+
+def encode_cursor(row):
+    return _pack_cursor([row['txn_date'], row['created_at'], row['transaction_id']])
+
+def decode_cursor(cursor):
+    txn_date, created_at, transaction_id = _unpack_cursor(cursor, 3)
+    return txn_date, created_at, int(transaction_id)
+
+# Filter name -> SQL condition on the transactions alias t
+_TRANSACTION_FILTERS = {
+    'txn_type': "t.txn_type = ?",
+    'account_id': "t.account_id = ?",
+    'category_id': "t.category_id = ?",
+    'merchant_id': "t.merchant_id = ?",
+    'start_date': "t.txn_date >= ?",
+    'end_date': "t.txn_date < ?",
+    'min_amount': "t.amount >= ?",
+    'max_amount': "t.amount <= ?",
+}
+
+# Tag filters take a list of tag_ids. tags_any is one IN over the tag index.
+# tags_all walks the postings of whichever of its tags has the fewest
+# (picked with an index-only count) and checks the others with a primary
+# key probe per posting, so it costs little more than the rarest tag's
+# postings however many tags are given; there is no join per tag and no
+# intersection of the big postings lists.
+_TAG_FILTERS = ('tags_any', 'tags_all')
+
+def _tag_condition(name, tag_ids):
+    tag_ids = sorted({int(tag_id) for tag_id in tag_ids})
+    placeholders = ', '.join('?' * len(tag_ids))
+    if name == 'tags_any' or len(tag_ids) == 1:
+        return f"t.transaction_id IN (SELECT transaction_id FROM transaction_tags WHERE tag_id IN ({placeholders}))", tag_ids
+    values = ', '.join(['(?)'] * len(tag_ids))
+    condition = f"""t.transaction_id IN (
+            SELECT x.transaction_id FROM transaction_tags x
+            WHERE x.tag_id = (SELECT v.column1 FROM (VALUES {values}) v
+                              ORDER BY (SELECT COUNT(*) FROM transaction_tags WHERE tag_id = v.column1)
+                              LIMIT 1)
+              AND (SELECT COUNT(*) FROM transaction_tags y
+                   WHERE y.transaction_id = x.transaction_id AND y.tag_id IN ({placeholders})) = ?
+        )"""
+    return condition, tag_ids + tag_ids + [len(tag_ids)]
+
+def _transaction_filters(user_id, filters):
+    # Returns WHERE conditions and params for a filters dict; end_date is
+    # inclusive for callers and becomes a half-open bound here
+    conditions = ["t.user_id = ?"]
+    params = [user_id]
+    for name, value in (filters or {}).items():
+        if name in _TAG_FILTERS:
+            if value:
+                condition, tag_ids = _tag_condition(name, value)
+                conditions.append(condition)
+                params.extend(tag_ids)
+            continue
+        if name not in _TRANSACTION_FILTERS:
+            raise ValueError(f"unknown transaction filter {name!r}")
+        if value is None:
+            continue
+        if name == 'start_date':
+            value = _as_date(value).isoformat()
+        elif name == 'end_date':
+            value = (_as_date(value) + timedelta(days=1)).isoformat()
+        elif name in ('min_amount', 'max_amount'):
+            value = to_paise(value)
+        conditions.append(_TRANSACTION_FILTERS[name])
+        params.append(value)
+    return conditions, params
+
+def _transactions_query(user_id, filters=None, cursor=None, limit=None):
+    conditions, params = _transaction_filters(user_id, filters)
+    if cursor:
+        conditions.append("(t.txn_date, t.created_at, t.transaction_id) < (?, ?, ?)")
+        params.extend(decode_cursor(cursor))
+    query, params = _with_archive(f"""
+        SELECT {_TRANSACTION_COLUMNS}, a.name as account_name, c.name as category_name, m.name as merchant_name
+        FROM transactions t
+        LEFT JOIN accounts a ON t.account_id = a.account_id
+        LEFT JOIN categories c ON t.category_id = c.category_id
+        LEFT JOIN merchants m ON t.merchant_id = m.merchant_id
+        WHERE {" AND ".join(conditions)}
+    """, params, (filters or {}).get('start_date'))
+    # Over both files SQLite merges the two index-ordered arms
+    query += " ORDER BY t.txn_date DESC, t.created_at DESC, t.transaction_id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+def query_transactions(user_id, filters=None, cursor=None, limit=TRANSACTION_PAGE_SIZE):
+    # Returns (rows, next_cursor); next_cursor is None on the last page
+    query, params = _transactions_query(user_id, filters, cursor, limit + 1)
+    with get_db(readonly=True) as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+# Search
+#
+# transaction_search is an FTS5 index over each transaction's description,
+# notes and merchant name, keyed by transaction_id. Triggers keep it in step
+# with transactions and with merchant renames; deleting a merchant nulls
+# merchant_id, which fires the transaction update trigger.
+#
+# Scoring every match of a common word costs a few microseconds per row, so
+# matches are ranked SEARCH_RANK_WINDOW at a time, newest first. The FTS
+# index walks rowids newest first and stops once the window is full; the
+# window is ranked by bm25 and paged by (score, transaction_id). After its
+# last page the cursor moves on to the next window, the matches below the
+# window's lowest rowid, so older matches stay reachable. Set
+# SEARCH_RANK_WINDOW to None to rank every match at once.
+_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS transaction_search USING fts5(
+    description, notes, merchant, prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_search_insert AFTER INSERT ON transactions
+BEGIN
+    INSERT INTO transaction_search (rowid, description, notes, merchant)
+    VALUES (NEW.transaction_id, NEW.description, NEW.notes,
+            (SELECT name FROM merchants WHERE merchant_id = NEW.merchant_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_delete AFTER DELETE ON transactions
+BEGIN
+    DELETE FROM transaction_search WHERE rowid = OLD.transaction_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_update
+AFTER UPDATE OF description, notes, merchant_id ON transactions
+BEGIN
+    DELETE FROM transaction_search WHERE rowid = OLD.transaction_id;
+    INSERT INTO transaction_search (rowid, description, notes, merchant)
+    VALUES (NEW.transaction_id, NEW.description, NEW.notes,
+            (SELECT name FROM merchants WHERE merchant_id = NEW.merchant_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_search_merchant_rename AFTER UPDATE OF name ON merchants
+BEGIN
+    UPDATE transaction_search SET merchant = NEW.name
+    WHERE rowid IN (SELECT transaction_id FROM transactions WHERE merchant_id = NEW.merchant_id);
+END;
+"""
+
+SEARCH_RANK_WINDOW = 500
+
+# bm25 column weights: description, notes, merchant
+_SEARCH_WEIGHTS = (1.0, 0.5, 2.0)
+
+@migration(5)
+def _add_search(conn):
+    _run_script(conn, _SEARCH_SCHEMA)
+    conn.execute("""
+        INSERT INTO transaction_search (rowid, description, notes, merchant)
+        SELECT t.transaction_id, t.description, t.notes, m.name
+        FROM transactions t
+        LEFT JOIN merchants m ON t.merchant_id = m.merchant_id
+    """)
+
+def _search_expression(text):
+    # Free text to an FTS5 query: every word must match and the last one may
+    # be a prefix, for search as you type. Words are quoted so operators and
+    # punctuation in the input are inert.
+    words = [f'"{word}"' for word in re.findall(r'\w+', text or '')]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+def _search_query(user_id, text, filters=None, cursor=None, limit=None):
+    # cursor: (below, score, transaction_id); below bounds the window's
+    # rowids, score and transaction_id resume inside it (None at its start)
+    below, score, transaction_id = _unpack_cursor(cursor, 3) if cursor else (None, None, None)
+    conditions, params = _transaction_filters(user_id, filters)
+    params.insert(0, _search_expression(text))
+    if below is not None:
+        conditions.append("transaction_search.rowid < ?")
+        params.append(int(below))
+    window = ""
+    if SEARCH_RANK_WINDOW is not None:
+        window = "LIMIT ?"
+        params.append(SEARCH_RANK_WINDOW)
+    after = ""
+    if score is not None:
+        after = "WHERE (s.score, s.transaction_id) > (?, ?)"
+        params.extend([float(score), int(transaction_id)])
+    weights = ', '.join(str(w) for w in _SEARCH_WEIGHTS)
+    query = f"""
+        SELECT {_TRANSACTION_COLUMNS}, a.name as account_name, c.name as category_name, m.name as merchant_name,
+               s.score, s.window_floor, s.window_size
+        FROM (
+            SELECT transaction_id, score,
+                   MIN(transaction_id) OVER () AS window_floor, COUNT(*) OVER () AS window_size
+            FROM (
+                SELECT t.transaction_id, bm25(transaction_search, {weights}) AS score
+                FROM transaction_search
+                JOIN transactions t ON t.transaction_id = transaction_search.rowid
+                WHERE transaction_search MATCH ? AND {" AND ".join(conditions)}
+                ORDER BY transaction_search.rowid DESC
+                {window}
+            )
+        ) s
+        JOIN transactions t ON t.transaction_id = s.transaction_id
+        LEFT JOIN accounts a ON t.account_id = a.account_id
+        LEFT JOIN categories c ON t.category_id = c.category_id
+        LEFT JOIN merchants m ON t.merchant_id = m.merchant_id
+        {after}
+        ORDER BY s.score, s.transaction_id
+    """
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+def search_transactions(user_id, query, filters=None, cursor=None, limit=TRANSACTION_PAGE_SIZE):
+    # Best matches first within each window of recent matches; returns
+    # (rows, next_cursor) like query_transactions. A query with no words
+    # lists everything, newest first.
+    if not _search_expression(query):
+        return query_transactions(user_id, filters, cursor, limit)
+
+    below = _unpack_cursor(cursor, 3)[0] if cursor else None
+    sql, params = _search_query(user_id, query, filters, cursor, limit + 1)
+    with get_db(readonly=True) as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        return rows[:limit], _pack_cursor([below, last['score'], last['transaction_id']])
+    if rows and SEARCH_RANK_WINDOW is not None and rows[0]['window_size'] >= SEARCH_RANK_WINDOW:
+        # A full window may have older matches below it
+        return rows, _pack_cursor([rows[0]['window_floor'], None, None])
+    return rows, None
+
+# Import operations
+#
+# Statements are streamed: parsers yield one raw row at a time, rows are
+# grouped into bounded chunks, and each chunk is written with a single
+# executemany plus one balance UPDATE per account, inside one transaction.
+IMPORT_CHUNK_SIZE = 5000
+
+_CSV_ALIASES = {
+    'date': 'txn_date', 'txn_date': 'txn_date', 'transaction date': 'txn_date',
+    'posted date': 'txn_date', 'value date': 'txn_date',
+    'description': 'description', 'narration': 'description', 'details': 'description',
+    'payee': 'description', 'name': 'description',
+    'amount': 'amount',
+    'debit': 'debit', 'withdrawal': 'debit', 'withdrawal amount': 'debit',
+    'credit': 'credit', 'deposit': 'credit', 'deposit amount': 'credit',
+    'type': 'txn_type', 'txn_type': 'txn_type',
+    'category': 'category', 'merchant': 'merchant', 'notes': 'notes', 'memo': 'notes',
+}
+
+_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%m/%d/%Y', '%Y%m%d', '%d %b %Y')
+
+def _text_stream(fileobj):
+    if isinstance(fileobj, io.TextIOBase):
+        return fileobj
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', errors='replace', newline='')
+
+def read_csv_statement(fileobj):
+    reader = csv.reader(_text_stream(fileobj))
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [_CSV_ALIASES.get(h.strip().lower()) for h in header]
+    if 'txn_date' not in columns or not {'amount', 'debit', 'credit'} & set(columns):
+        raise ValueError("CSV needs a date column and an amount or debit/credit column")
+
+    for line, values in enumerate(reader, start=2):
+        if not any(values):
+            continue
+        row = {key: value.strip() for key, value in zip(columns, values) if key}
+        row['line'] = line
+        yield row
+
+def read_ofx_statement(fileobj):
+    # OFX 1.x is SGML without closing tags and often arrives on a single line,
+    # so tokenize on '<' rather than reading line by line
+    stream = _text_stream(fileobj)
+    fields = {'DTPOSTED': 'txn_date', 'TRNAMT': 'amount', 'NAME': 'description',
+              'MEMO': 'notes', 'FITID': 'fitid'}
+    row = None
+    count = 0
+    pending = ''
+    while True:
+        block = stream.read(65536)
+        tokens = (pending + block).split('<')
+        pending = tokens.pop() if block else ''
+        for token in tokens:
+            tag, _, value = token.partition('>')
+            tag = tag.strip().upper()
+            if tag == 'STMTTRN':
+                row = {}
+            elif tag == '/STMTTRN' and row is not None:
+                count += 1
+                row['line'] = count
+                row['txn_date'] = row.get('txn_date', '')[:8]
+                yield row
+                row = None
+            elif row is not None and tag in fields:
+                row[fields[tag]] = value.strip()
+        if not block:
+            break
+
+def read_statement(fileobj, filename):
+    if filename.lower().endswith(('.ofx', '.qfx')):
+        return read_ofx_statement(fileobj)
+    return read_csv_statement(fileobj)
+
+def _parse_date(value):
+    try:
+        parsed = date.fromisoformat(value)
+        return value if len(value) == 10 else parsed.isoformat()
+    except ValueError:
+        pass
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised date {value!r}")
+
+def _parse_amount(value):
+    # Statement text to paise; currency symbols ($, ₹, €, ...) are dropped
+    value = ''.join(ch for ch in (value or '') if ch != ',' and unicodedata.category(ch) != 'Sc').strip()
+    if value.startswith('(') and value.endswith(')'):
+        value = '-' + value[1:-1]
+    return to_paise(value) if value else 0
+
+def _normalize_import_row(row):
+    if row.get('amount'):
+        amount = _parse_amount(row['amount'])
+    else:
+        amount = _parse_amount(row.get('credit')) - _parse_amount(row.get('debit'))
+
+    txn_type = (row.get('txn_type') or '').lower()
+    if txn_type not in ('expense', 'income', 'transfer'):
+        txn_type = 'expense' if amount < 0 else 'income'
+    amount = abs(amount)
+    if amount == 0:
+        raise ValueError("zero amount")
+
+    return {
+        'txn_date': _parse_date(row.get('txn_date', '')),
+        'txn_type': txn_type,
+        'amount': amount,
+        'description': row.get('description') or None,
+        'notes': row.get('notes') or None,
+        'category': row.get('category') or None,
+        'merchant': row.get('merchant') or None,
+        'line': row.get('line'),
+    }
+
+def iter_chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _lookup_id(conn, cache, table, id_column, values):
+    # Resolve a name to its id, creating the row if needed; values are the
+    # columns that identify it, e.g. {'user_id': 1, 'name': 'Amazon'}
+    key = tuple(values.values())
+    if key not in cache:
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' * len(values))
+        conn.execute(f"INSERT OR IGNORE INTO {table} ({columns}) VALUES ({placeholders})", key)
+        where = ' AND '.join(f"{column} = ?" for column in values)
+        cache[key] = conn.execute(f"SELECT {id_column} FROM {table} WHERE {where}", key).fetchone()[0]
+    return cache[key]
+
+def import_transactions(user_id, account_id, rows, chunk_size=IMPORT_CHUNK_SIZE,
+                        dry_run=False, progress=None, max_errors=20, categorize=True,
+                        skip_duplicates=True, window_days=0):
+    # With categorize, the user's rules fill in rows that arrive without a
+    # category or merchant. With skip_duplicates, rows already stored are
+    # left out; with window_days, near matches are listed in
+    # possible_duplicate_rows as (line, transaction_id). Missing fingerprints
+    # (rows written by other clients) are filled in first, dry run or not, so
+    # a dry run counts the same duplicates the import would skip.
+    if skip_duplicates or window_days:
+        _ensure_fingerprints(user_id)
+    with get_db(readonly=True) as conn:
+        account = conn.execute(
+            "SELECT currency FROM accounts WHERE account_id = ? AND user_id = ?",
+            (account_id, user_id)
+        ).fetchone()
+        # Rows after this one are the import's own
+        before_id = conn.execute("SELECT COALESCE(MAX(transaction_id), 0) FROM transactions").fetchone()[0]
+    if not account:
+        raise ValueError(f"account {account_id} not found")
+
+    result = {
+        'imported': 0, 'skipped': 0, 'batches': 0, 'errors': [], 'categorized': 0,
+        'duplicates': 0, 'possible_duplicates': 0, 'possible_duplicate_rows': [],
+        'income': 0.0, 'expense': 0.0, 'balance_delta': 0.0, 'dry_run': dry_run,
+    }
+    # Running totals in paise; result reports them in rupees
+    totals = {'income': 0, 'expense': 0, 'balance_delta': 0}
+
+    def valid_rows():
+        for row in rows:
+            try:
+                yield _normalize_import_row(row)
+            except (ValueError, TypeError) as e:
+                result['skipped'] += 1
+                if len(result['errors']) < max_errors:
+                    result['errors'].append((row.get('line'), str(e)))
+
+    matcher = _rule_matcher(user_id) if categorize else None
+    categories, merchants = {}, {}
+    # Copies of each fingerprint stored before the import and not yet matched.
+    # Only fingerprints found stored are kept, so this grows with the overlap
+    # rather than the import; a miss is simply asked again in a later chunk.
+    stored = {}
+    for chunk in iter_chunks(valid_rows(), chunk_size):
+        for row in chunk:
+            row['fingerprint'] = _fingerprint(account_id, row['txn_type'], row['amount'], row['txn_date'],
+                                              row['description'])
+        if skip_duplicates or window_days:
+            with get_db(readonly=True) as conn:
+                if skip_duplicates:
+                    unseen = list({row['fingerprint'] for row in chunk} - stored.keys())
+                    if unseen:
+                        stored.update(_stored_copies(conn, user_id, unseen, before_id,
+                                                     min(row['txn_date'] for row in chunk)))
+                    fresh = []
+                    for row in chunk:
+                        if stored.get(row['fingerprint'], 0):
+                            stored[row['fingerprint']] -= 1
+                            result['duplicates'] += 1
+                        else:
+                            fresh.append(row)
+                    chunk = fresh
+                if window_days and chunk:
+                    near = _near_copies(conn, account_id, [
+                        (index, row['txn_type'], row['amount'], row['txn_date']) for index, row in enumerate(chunk)
+                    ], window_days, before_id)
+                    result['possible_duplicates'] += len(near)
+                    for index, transaction_id in sorted(near.items()):
+                        if len(result['possible_duplicate_rows']) < max_errors:
+                            result['possible_duplicate_rows'].append((chunk[index]['line'], transaction_id))
+
+        delta = 0
+        for row in chunk:
+            row['rule'] = None
+            if matcher and matcher.rules and not (row['category'] and row['merchant']):
+                row['rule'] = matcher.match(row['txn_type'], row['amount'], row['description'], row['merchant'])
+                result['categorized'] += row['rule'] is not None
+            if row['txn_type'] == 'expense':
+                delta -= row['amount']
+                totals['expense'] += row['amount']
+            elif row['txn_type'] == 'income':
+                delta += row['amount']
+                totals['income'] += row['amount']
+
+        if chunk and not dry_run:
+            with get_db() as conn:
+                params = []
+                for row in chunk:
+                    category_id = merchant_id = None
+                    if row['category']:
+                        category_id = _lookup_id(conn, categories, 'categories', 'category_id', {
+                            'user_id': user_id, 'name': row['category'], 'kind': row['txn_type']
+                        })
+                    if row['merchant']:
+                        merchant_id = _lookup_id(conn, merchants, 'merchants', 'merchant_id', {
+                            'user_id': user_id, 'name': row['merchant']
+                        })
+                    if row['rule']:
+                        category_id = category_id or row['rule']['category_id']
+                        merchant_id = merchant_id or row['rule']['merchant_id']
+                    params.append((
+                        user_id, account_id, category_id, merchant_id, row['txn_type'],
+                        row['amount'], account['currency'], row['txn_date'],
+                        row['description'], row['notes'], row['fingerprint']
+                    ))
+                conn.executemany("""
+                    INSERT INTO transactions
+                    (user_id, account_id, category_id, merchant_id, txn_type, amount, currency,
+                     txn_date, description, notes, fingerprint)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, params)
+                # One balance correction for the whole chunk
+                if delta:
+                    conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_id = ?",
+                                 (delta, account_id))
+                _invalidate(user_id)
+
+        result['imported'] += len(chunk)
+        result['batches'] += 1
+        totals['balance_delta'] += delta
+        for name, paise in totals.items():
+            result[name] = paise / 100
+        if progress:
+            progress(result)
+
+    return result
+
+# Duplicate detection
+#
+# Every transaction carries a fingerprint: a 64-bit hash of its account,
+# type, amount, date and normalized description (lower case, punctuation and
+# runs of spaces collapsed). The type is included so that a reversal
+# on the same day as its charge is not taken for a copy. Inserts from this
+# module compute it; rows written without one (by the Node server, or before
+# migration 11) are filled in before each check.
+#
+# An import looks up each chunk's fingerprints in one query on the
+# (user_id, fingerprint) index, counting only rows that existed before the
+# import began, and skips as many copies of each as are already stored, so
+# re-importing an overlapping statement adds only the new rows while a
+# statement's own identical rows (two coffees on one day) still go in.
+# With window_days, rows that are not exact copies are also checked for a
+# transaction on the same account with the same type and amount within that
+# many days, over the (account_id, txn_date) index; those are reported as
+# possible duplicates but imported.
+DUPLICATE_WINDOW_DAYS = 3
+
+_NOT_WORD = re.compile(r"[\W_]+")
+
+@migration(11)
+def _add_fingerprints(conn):
+    conn.execute("ALTER TABLE transactions ADD COLUMN fingerprint INTEGER")
+    if 'archive' in {row[1] for row in conn.execute("PRAGMA database_list")}:
+        _sync_archive_schema(conn)
+    _fill_fingerprints(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_fingerprint ON transactions(user_id, fingerprint)")
+
+def _normalize_description(description):
+    return _NOT_WORD.sub(' ', (description or '').lower()).strip()
+
+def _fingerprint(account_id, txn_type, amount, txn_date, description):
+    # amount in paise; a signed 64-bit integer, as SQLite stores them
+    key = f"{account_id}|{txn_type}|{amount}|{str(txn_date)[:10]}|{_normalize_description(description)}"
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
+
+def _fill_fingerprints(conn, user_id=None):
+    # Returns the number of rows that had none
+    filled = 0
+    for schema in [row[1] for row in conn.execute("PRAGMA database_list") if row[1] in ('main', 'archive')]:
+        condition, params = ("fingerprint IS NULL AND user_id = ?", [user_id]) if user_id else ("fingerprint IS NULL", [])
+        last = 0
+        while True:
+            rows = conn.execute(f"""
+                SELECT transaction_id, account_id, txn_type, amount, txn_date, description
+                FROM {schema}.transactions
+                WHERE {condition} AND transaction_id > ?
+                ORDER BY transaction_id
+                LIMIT ?
+            """, params + [last, IMPORT_CHUNK_SIZE * 10]).fetchall()
+            if not rows:
+                break
+            conn.executemany(f"UPDATE {schema}.transactions SET fingerprint = ? WHERE transaction_id = ?",
+                             [(_fingerprint(*row[1:]), row[0]) for row in rows])
+            filled += len(rows)
+            last = rows[-1][0]
+    return filled
+
+def _ensure_fingerprints(user_id):
+    # Only takes the writer when some are missing
+    query, params = _with_archive(
+        "SELECT 1 FROM transactions WHERE user_id = ? AND fingerprint IS NULL", [user_id], None
+    )
+    with get_db(readonly=True) as conn:
+        missing = conn.execute(f"{query} LIMIT 1", params).fetchone()
+    if missing:
+        with get_db() as conn:
+            _fill_fingerprints(conn, user_id)
+
+def _stored_copies(conn, user_id, fingerprints, before_id, start_date):
+    # {fingerprint: copies} among transactions up to before_id, for the
+    # fingerprints that have any
+    query, params = _with_archive("""
+        SELECT fingerprint, COUNT(*) FROM transactions
+        WHERE user_id = ? AND fingerprint IN (SELECT value FROM json_each(?)) AND transaction_id <= ?
+        GROUP BY fingerprint
+    """, [user_id, json.dumps(fingerprints), before_id], start_date)
+    copies = {}
+    for fingerprint, count in conn.execute(query, params):
+        copies[fingerprint] = copies.get(fingerprint, 0) + count
+    return copies
+
+def _near_copies(conn, account_id, rows, window_days, before_id):
+    # rows: (key, txn_type, amount, txn_date); returns {key: transaction_id}
+    # of the earliest transaction on the account with the same type and
+    # amount within window_days. One range read covers the whole chunk.
+    days = [date.fromisoformat(row[3][:10]).toordinal() for row in rows]
+    first = date.fromordinal(min(days) - window_days)
+    stop = date.fromordinal(max(days) + window_days + 1)
+    query, params = _with_archive("""
+        SELECT txn_type, amount, txn_date, transaction_id FROM transactions
+        WHERE account_id = ? AND txn_date >= ? AND txn_date < ? AND transaction_id <= ?
+    """, [account_id, first.isoformat(), stop.isoformat(), before_id], first)
+    stored = {}
+    for txn_type, amount, txn_date, transaction_id in conn.execute(query, params):
+        stored.setdefault((txn_type, amount), []).append((date.fromisoformat(txn_date[:10]).toordinal(),
+                                                          transaction_id))
+    near = {}
+    for (key, txn_type, amount, _), day in zip(rows, days):
+        matches = [transaction_id for other, transaction_id in stored.get((txn_type, amount), ())
+                   if abs(other - day) <= window_days]
+        if matches:
+            near[key] = min(matches)
+    return near
+
+def find_duplicate(user_id, account_id, txn_type, amount, txn_date, description=None):
+    # For manual entry: an existing copy's transaction_id, or None
+    fingerprint = _fingerprint(account_id, txn_type, to_paise(amount), txn_date, description)
+    query, params = _with_archive("""
+        SELECT transaction_id FROM transactions WHERE user_id = ? AND fingerprint = ?
+    """, [user_id, fingerprint], txn_date)
+    with get_db(readonly=True) as conn:
+        row = conn.execute(f"SELECT MIN(transaction_id) FROM ({query})", params).fetchone()
+        return row[0]
+
+def get_duplicates(user_id, window_days=0):
+    # Transactions that repeat an earlier one: 'exact' when the fingerprint
+    # matches, 'near' for the same account, type and amount within
+    # window_days. duplicate_of is the earliest such transaction. Covers the
+    # main file; archived transactions are read-only.
+    _ensure_fingerprints(user_id)
+    if window_days:
+        # One sort of the user's transactions by account, type, amount and
+        # day; the earliest id in each row's window of days is a near match
+        # unless it is the row itself
+        source = f"""
+            SELECT *, NULLIF(first_near, transaction_id) AS near_of
+            FROM (
+                SELECT t.*, f.first_id AS exact_of,
+                       MIN(t.transaction_id) OVER (
+                           PARTITION BY t.account_id, t.txn_type, t.amount
+                           ORDER BY julianday(substr(t.txn_date, 1, 10))
+                           RANGE BETWEEN {int(window_days)} PRECEDING AND {int(window_days)} FOLLOWING
+                       ) AS first_near
+                FROM transactions t
+                LEFT JOIN firsts f ON f.fingerprint = t.fingerprint AND f.first_id < t.transaction_id
+                WHERE t.user_id = ?
+            )
+        """
+        params = [user_id, user_id]
+    else:
+        # Only the repeated fingerprints, straight off the index
+        source = """
+            SELECT t.*, f.first_id AS exact_of, NULL AS near_of
+            FROM firsts f
+            JOIN transactions t ON t.user_id = ? AND t.fingerprint = f.fingerprint
+                               AND t.transaction_id > f.first_id
+        """
+        params = [user_id, user_id]
+
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute(f"""
+            WITH firsts AS (
+                SELECT fingerprint, MIN(transaction_id) AS first_id
+                FROM transactions
+                WHERE user_id = ?
+                GROUP BY fingerprint
+                HAVING COUNT(*) > 1
+            )
+            SELECT m.transaction_id, m.account_id, a.name AS account_name, m.txn_type,
+                   m.amount / 100.0 AS amount, m.txn_date, m.description,
+                   COALESCE(m.exact_of, m.near_of) AS duplicate_of,
+                   CASE WHEN m.exact_of IS NOT NULL THEN 'exact' ELSE 'near' END AS match
+            FROM ({source}) m
+            JOIN accounts a ON a.account_id = m.account_id
+            WHERE m.exact_of IS NOT NULL OR m.near_of IS NOT NULL
+            ORDER BY m.txn_date DESC, m.transaction_id DESC
+        """, params)
+        return cursor.fetchall()
+
+# Categorization rules
+#
+# A rule gives transactions a category and/or merchant when their description
+# (or merchant name) contains a substring or matches a regex, optionally only
+# within an amount range and for one transaction type; a rule without a
+# pattern matches on amount alone. Rules are tried by priority, lowest
+# first, then by rule_id, and the first that matches wins.
+#
+# A user's patterns for each field are compiled into two case-insensitive
+# regexes. Substrings become one trie: shared prefixes are merged, and an
+# empty marker group at the end of each substring records which ones a
+# match passed through, so each match reports every substring rule that
+# starts at that position. Regex rules are alternatives inside a lookahead,
+# in priority order, which reports at each position the best regex rule
+# matching there; the best of all reports is the best rule overall. Only when
+# a reported rule fails its amount or type condition are the rules it may
+# have hidden tried one at a time. Results are memoized per distinct text,
+# and the compiled matcher is kept until the user's rules change.
+#
+# apply_rules() streams the rows in scope, matches them in Python and writes
+# every change with one UPDATE ... FROM a temporary table; the rollup and
+# search triggers follow as for any update. Archived transactions are
+# read-only and keep their categories.
+_RULES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS categorization_rules (
+    rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    field TEXT NOT NULL DEFAULT 'description' CHECK(field IN ('description', 'merchant')),
+    match_type TEXT NOT NULL DEFAULT 'contains' CHECK(match_type IN ('contains', 'regex')),
+    pattern TEXT,
+    min_amount INTEGER,
+    max_amount INTEGER,
+    txn_type TEXT CHECK(txn_type IN ('expense', 'income', 'transfer')),
+    category_id INTEGER,
+    merchant_id INTEGER,
+    priority INTEGER NOT NULL DEFAULT 100,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CHECK(pattern IS NOT NULL OR min_amount IS NOT NULL OR max_amount IS NOT NULL),
+    CHECK(category_id IS NOT NULL OR merchant_id IS NOT NULL),
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (category_id) REFERENCES categories(category_id) ON DELETE CASCADE,
+    FOREIGN KEY (merchant_id) REFERENCES merchants(merchant_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_categorization_rules_user ON categorization_rules(user_id, priority, rule_id);
+"""
+
+RULE_FIELDS = ('description', 'merchant')
+RULE_MATCH_TYPES = ('contains', 'regex')
+RULE_SCOPES = ('uncategorized', 'all')
+
+# Distinct texts remembered per matcher before the memo starts over
+RULE_MEMO_SIZE = 100000
+
+# Combined patterns share one group numbering
+_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+_rule_matchers = {}
+
+@migration(10)
+def _add_categorization_rules(conn):
+    _run_script(conn, _RULES_SCHEMA)
+
+def _rule_regex(match_type, pattern):
+    if match_type not in RULE_MATCH_TYPES:
+        raise ValueError(f"match_type must be one of {', '.join(RULE_MATCH_TYPES)}")
+    if not pattern:
+        raise ValueError("a rule pattern cannot be empty")
+    if match_type == 'contains':
+        return re.escape(pattern)
+    try:
+        compiled = re.compile(f"(?:{pattern})", re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"invalid pattern {pattern!r}: {e}") from None
+    if compiled.groupindex or _BACKREFERENCE.search(pattern):
+        raise ValueError("rule patterns cannot use named groups or backreferences")
+    return pattern
+
+def _substring_trie(rules):
+    # One regex for many substrings, and (group index, ranks) for each marker
+    trie = {}
+    for rule in rules:
+        node = trie
+        for char in rule['pattern'].lower():
+            node = node.setdefault(char, {})
+        node.setdefault('', []).append(rule['rank'])
+
+    markers = []
+    def render(node):
+        marker = ''
+        if '' in node:
+            marker = f"(?P<s{len(markers)}>)"
+            markers.append(node[''])
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return marker
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy, so a match runs on to the longest substring at its position
+        return f"{marker}(?:{body})?" if marker else body
+
+    regex = re.compile(render(trie), re.IGNORECASE)
+    return regex, [(regex.groupindex[f"s{i}"], ranks) for i, ranks in enumerate(markers)]
+
+class RuleMatcher:
+    def __init__(self, rules):
+        # rules: dicts in priority order, amounts in paise
+        self.rules = rules
+        self.amount_rules = []
+        self.text_rules = {field: [] for field in RULE_FIELDS}
+        for rank, rule in enumerate(rules):
+            rule['rank'] = rank
+            if rule['pattern'] is None:
+                self.amount_rules.append(rule)
+                continue
+            rule['regex'] = re.compile(f"(?:{_rule_regex(rule['match_type'], rule['pattern'])})", re.IGNORECASE)
+            self.text_rules[rule['field']].append(rule)
+        self.tries = {}
+        self.regexes = {}
+        for field, rules in self.text_rules.items():
+            substrings = [rule for rule in rules if rule['match_type'] == 'contains']
+            if substrings:
+                self.tries[field] = _substring_trie(substrings)
+            patterns = [rule for rule in rules if rule['match_type'] == 'regex']
+            if patterns:
+                self.regexes[field] = re.compile("(?=" + "|".join(
+                    f"(?:{rule['pattern']})(?P<r{rule['rank']}>)" for rule in patterns
+                ) + ")", re.IGNORECASE)
+        self._memo = {field: {} for field in RULE_FIELDS}
+
+    def _winners(self, field, text):
+        # Ranks of the rules reported by one pass over the text, best first
+        memo = self._memo[field]
+        winners = memo.get(text)
+        if winners is not None:
+            return winners
+        if len(memo) >= RULE_MEMO_SIZE:
+            memo.clear()
+        found = set()
+        if field in self.tries:
+            regex, markers = self.tries[field]
+            match = regex.search(text)
+            while match:
+                spans = match.regs
+                for index, ranks in markers:
+                    if spans[index][0] != -1:
+                        found.update(ranks)
+                match = regex.search(text, match.start() + 1)
+        if field in self.regexes:
+            found.update(int(match.lastgroup[1:]) for match in self.regexes[field].finditer(text))
+        winners = memo[text] = sorted(found)
+        return winners
+
+    @staticmethod
+    def _applies(rule, txn_type, amount):
+        return ((rule['txn_type'] is None or rule['txn_type'] == txn_type)
+                and (rule['min_amount'] is None or amount >= rule['min_amount'])
+                and (rule['max_amount'] is None or amount <= rule['max_amount']))
+
+    def match(self, txn_type, amount, description=None, merchant=None):
+        # The first rule in priority order that matches, or None; amount in paise
+        best = next((rule for rule in self.amount_rules if self._applies(rule, txn_type, amount)), None)
+        for field, text in (('description', description), ('merchant', merchant)):
+            if not text or not self.text_rules[field]:
+                continue
+            hidden = False
+            for rank in self._winners(field, text):
+                if best is not None and rank >= best['rank']:
+                    break
+                rule = self.rules[rank]
+                if self._applies(rule, txn_type, amount):
+                    best = rule
+                    break
+                hidden = True
+            if hidden:
+                for rule in self.text_rules[field]:
+                    if best is not None and rule['rank'] >= best['rank']:
+                        break
+                    if self._applies(rule, txn_type, amount) and rule['regex'].search(text):
+                        best = rule
+                        break
+        return best
+
+@cached
+def get_rules(user_id):
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute("""
+            SELECT r.rule_id, r.field, r.match_type, r.pattern,
+                   r.min_amount / 100.0 AS min_amount, r.max_amount / 100.0 AS max_amount,
+                   r.txn_type, r.category_id, r.merchant_id, r.priority, r.is_active,
+                   c.name AS category_name, m.name AS merchant_name
+            FROM categorization_rules r
+            LEFT JOIN categories c ON r.category_id = c.category_id
+            LEFT JOIN merchants m ON r.merchant_id = m.merchant_id
+            WHERE r.user_id = ?
+            ORDER BY r.priority, r.rule_id
+        """, (user_id,))
+        return cursor.fetchall()
+
+def add_rule(user_id, pattern=None, category_id=None, merchant_id=None, match_type='contains',
+             field='description', min_amount=None, max_amount=None, txn_type=None, priority=100):
+    # Without a txn_type the rule only applies to its category's kind
+    if field not in RULE_FIELDS:
+        raise ValueError(f"field must be one of {', '.join(RULE_FIELDS)}")
+    if pattern is not None:
+        _rule_regex(match_type, pattern)
+    elif min_amount is None and max_amount is None:
+        raise ValueError("a rule needs a pattern or an amount range")
+    if category_id is None and merchant_id is None:
+        raise ValueError("a rule needs a category_id or a merchant_id")
+
+    with get_db() as conn:
+        if category_id is not None:
+            category = conn.execute(
+                "SELECT kind FROM categories WHERE category_id = ? AND user_id = ?", (category_id, user_id)
+            ).fetchone()
+            if not category:
+                raise ValueError(f"category {category_id} not found")
+            txn_type = txn_type or category['kind']
+        if merchant_id is not None and not conn.execute(
+            "SELECT 1 FROM merchants WHERE merchant_id = ? AND user_id = ?", (merchant_id, user_id)
+        ).fetchone():
+            raise ValueError(f"merchant {merchant_id} not found")
+        cursor = conn.execute("""
+            INSERT INTO categorization_rules
+            (user_id, field, match_type, pattern, min_amount, max_amount, txn_type,
+             category_id, merchant_id, priority)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, field, match_type, pattern,
+              None if min_amount is None else to_paise(min_amount),
+              None if max_amount is None else to_paise(max_amount),
+              txn_type, category_id, merchant_id, priority))
+        _invalidate(user_id)
+        return cursor.lastrowid
+
+def delete_rule(rule_id, user_id):
     with get_db() as conn:
-        # Get transaction details to reverse balance
         cursor = conn.execute(
-            "SELECT account_id, txn_type, amount FROM transactions WHERE transaction_id = ? AND user_id = ?",
-            (transaction_id, user_id)
+            "DELETE FROM categorization_rules WHERE rule_id = ? AND user_id = ?",
+            (rule_id, user_id)
         )
-        txn = cursor.fetchone()
-        
-        if txn:
-            # Reverse the balance change
-            if txn['txn_type'] == 'expense':
-                conn.execute("UPDATE accounts SET balance = balance + ? WHERE account_id = ?", 
-                           (txn['amount'], txn['account_id']))
-            elif txn['txn_type'] == 'income':
-                conn.execute("UPDATE accounts SET balance = balance - ? WHERE account_id = ?", 
-                           (txn['amount'], txn['account_id']))
-            
-            # Delete transaction
-            conn.execute("DELETE FROM transactions WHERE transaction_id = ? AND user_id = ?", 
-                        (transaction_id, user_id))
-            return True
-        return False
+        _invalidate(user_id)
+        return cursor.rowcount > 0
+
+def _rule_matcher(user_id):
+    # Compiled once per set of active rules
+    rules = [dict(row) for row in get_rules(user_id) if row['is_active']]
+    key = tuple(tuple(rule.values()) for rule in rules)
+    cached_key, matcher = _rule_matchers.get((DB_NAME, user_id), (None, None))
+    if cached_key != key:
+        for rule in rules:
+            for name in ('min_amount', 'max_amount'):
+                if rule[name] is not None:
+                    rule[name] = to_paise(rule[name])
+        matcher = RuleMatcher(rules)
+        _rule_matchers[(DB_NAME, user_id)] = (key, matcher)
+    return matcher
+
+def apply_rules(user_id, scope='uncategorized', dry_run=False):
+    # scope 'uncategorized' fills in missing categories and merchants only;
+    # 'all', or a query_transactions filters dict, overwrites them wherever a
+    # rule matches. Returns counts of rows scanned, matched and updated.
+    if isinstance(scope, dict):
+        conditions, params = _transaction_filters(user_id, scope)
+    elif scope in RULE_SCOPES:
+        conditions, params = ["t.user_id = ?"], [user_id]
+        if scope == 'uncategorized':
+            conditions.append("(t.category_id IS NULL OR t.merchant_id IS NULL)")
+    else:
+        raise ValueError(f"scope must be one of {', '.join(RULE_SCOPES)} or a filters dict")
+    fill_only = scope == 'uncategorized'
+
+    result = {'scanned': 0, 'matched': 0, 'updated': 0, 'dry_run': dry_run}
+    matcher = _rule_matcher(user_id)
+    if not matcher.rules:
+        return result
+
+    # (transaction_id, category_id, merchant_id); None leaves a column as it is
+    changes = []
+    with get_db(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.arraysize = FETCH_ARRAYSIZE
+        cursor.execute(f"""
+            SELECT t.transaction_id, t.txn_type, t.amount, t.description, m.name,
+                   t.category_id, t.merchant_id
+            FROM transactions t
+            LEFT JOIN merchants m ON t.merchant_id = m.merchant_id
+            WHERE {" AND ".join(conditions)}
+        """, params)
+        for transaction_id, txn_type, amount, description, merchant, category_id, merchant_id in cursor:
+            result['scanned'] += 1
+            rule = matcher.match(txn_type, amount, description, merchant)
+            if rule is None:
+                continue
+            result['matched'] += 1
+            new_category = rule['category_id']
+            if new_category == category_id or (fill_only and category_id is not None):
+                new_category = None
+            new_merchant = rule['merchant_id']
+            if new_merchant == merchant_id or (fill_only and merchant_id is not None):
+                new_merchant = None
+            if new_category is not None or new_merchant is not None:
+                changes.append((transaction_id, new_category, new_merchant))
+
+    if dry_run or not changes:
+        result['updated'] = len(changes)
+        return result
+
+    # Filling in keeps any value set since the rows were read
+    assign = ("COALESCE(transactions.{0}, c.{0})" if fill_only else "COALESCE(c.{0}, transactions.{0})")
+    with get_db() as conn:
+        conn.execute("""
+            CREATE TEMP TABLE rule_changes (
+                transaction_id INTEGER PRIMARY KEY, category_id INTEGER, merchant_id INTEGER
+            )
+        """)
+        try:
+            conn.executemany("INSERT INTO temp.rule_changes VALUES (?, ?, ?)", changes)
+            cursor = conn.execute(f"""
+                UPDATE transactions
+                SET category_id = {assign.format('category_id')},
+                    merchant_id = {assign.format('merchant_id')}
+                FROM temp.rule_changes c
+                WHERE transactions.transaction_id = c.transaction_id AND transactions.user_id = ?
+            """, (user_id,))
+            result['updated'] = cursor.rowcount
+        finally:
+            conn.execute("DROP TABLE temp.rule_changes")
+        _invalidate(user_id)
+    return result
+
+# Aggregate rollups
+#
+# Per-month totals kept in step with transactions by triggers, so every write
+# path (add/delete, bulk import, raw SQL) updates them. category_id 0 stands
+# for uncategorized rows; merchant totals only count expenses.
+_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS monthly_category_totals (
+    user_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    txn_type TEXT NOT NULL,
+    category_id INTEGER NOT NULL,
+    total REAL NOT NULL DEFAULT 0,
+    txn_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month, txn_type, category_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS monthly_merchant_spend (
+    user_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    merchant_id INTEGER NOT NULL,
+    total REAL NOT NULL DEFAULT 0,
+    txn_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month, merchant_id)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_insert AFTER INSERT ON transactions
+BEGIN
+    INSERT INTO monthly_category_totals (user_id, month, txn_type, category_id, total, txn_count)
+    VALUES (NEW.user_id, substr(NEW.txn_date, 1, 7), NEW.txn_type, COALESCE(NEW.category_id, 0), NEW.amount, 1)
+    ON CONFLICT (user_id, month, txn_type, category_id)
+    DO UPDATE SET total = total + excluded.total, txn_count = txn_count + 1;
+
+    INSERT INTO monthly_merchant_spend (user_id, month, merchant_id, total, txn_count)
+    SELECT NEW.user_id, substr(NEW.txn_date, 1, 7), NEW.merchant_id, NEW.amount, 1
+    WHERE NEW.merchant_id IS NOT NULL AND NEW.txn_type = 'expense'
+    ON CONFLICT (user_id, month, merchant_id)
+    DO UPDATE SET total = total + excluded.total, txn_count = txn_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_delete AFTER DELETE ON transactions
+BEGIN
+    UPDATE monthly_category_totals
+    SET total = total - OLD.amount, txn_count = txn_count - 1
+    WHERE user_id = OLD.user_id AND month = substr(OLD.txn_date, 1, 7)
+      AND txn_type = OLD.txn_type AND category_id = COALESCE(OLD.category_id, 0);
+    DELETE FROM monthly_category_totals
+    WHERE user_id = OLD.user_id AND month = substr(OLD.txn_date, 1, 7)
+      AND txn_type = OLD.txn_type AND category_id = COALESCE(OLD.category_id, 0)
+      AND txn_count <= 0;
+
+    UPDATE monthly_merchant_spend
+    SET total = total - OLD.amount, txn_count = txn_count - 1
+    WHERE OLD.txn_type = 'expense' AND user_id = OLD.user_id
+      AND month = substr(OLD.txn_date, 1, 7) AND merchant_id = OLD.merchant_id;
+    DELETE FROM monthly_merchant_spend
+    WHERE user_id = OLD.user_id AND month = substr(OLD.txn_date, 1, 7)
+      AND merchant_id = OLD.merchant_id AND txn_count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_update
+AFTER UPDATE OF user_id, txn_date, txn_type, category_id, merchant_id, amount ON transactions
+BEGIN
+    UPDATE monthly_category_totals
+    SET total = total - OLD.amount, txn_count = txn_count - 1
+    WHERE user_id = OLD.user_id AND month = substr(OLD.txn_date, 1, 7)
+      AND txn_type = OLD.txn_type AND category_id = COALESCE(OLD.category_id, 0);
+    DELETE FROM monthly_category_totals
+    WHERE user_id = OLD.user_id AND month = substr(OLD.txn_date, 1, 7)
+      AND txn_type = OLD.txn_type AND category_id = COALESCE(OLD.category_id, 0)
+      AND txn_count <= 0;
+    INSERT INTO monthly_category_totals (user_id, month, txn_type, category_id, total, txn_count)
+    VALUES (NEW.user_id, substr(NEW.txn_date, 1, 7), NEW.txn_type, COALESCE(NEW.category_id, 0), NEW.amount, 1)
+    ON CONFLICT (user_id, month, txn_type, category_id)
+    DO UPDATE SET total = total + excluded.total, txn_count = txn_count + 1;
+
+    UPDATE monthly_merchant_spend
+    SET total = total - OLD.amount, txn_count = txn_count - 1
+    WHERE OLD.txn_type = 'expense' AND user_id = OLD.user_id
+      AND month = substr(OLD.txn_date, 1, 7) AND merchant_id = OLD.merchant_id;
+    DELETE FROM monthly_merchant_spend
+    WHERE user_id = OLD.user_id AND month = substr(OLD.txn_date, 1, 7)
+      AND merchant_id = OLD.merchant_id AND txn_count <= 0;
+    INSERT INTO monthly_merchant_spend (user_id, month, merchant_id, total, txn_count)
+    SELECT NEW.user_id, substr(NEW.txn_date, 1, 7), NEW.merchant_id, NEW.amount, 1
+    WHERE NEW.merchant_id IS NOT NULL AND NEW.txn_type = 'expense'
+    ON CONFLICT (user_id, month, merchant_id)
+    DO UPDATE SET total = total + excluded.total, txn_count = txn_count + 1;
+END;
+"""
+
+# Raw aggregates the rollups must agree with; also used to rebuild them.
+# {amount} is the amount column, converted to base currency once fx_rates
+# exists, and {transactions} takes in the archive once there is one (see
+# _rollup_sources)
+_CATEGORY_ROLLUP_SOURCE = """
+    SELECT user_id, substr(txn_date, 1, 7) AS month, txn_type,
+           COALESCE(category_id, 0) AS category_id, SUM({amount}) AS total, COUNT(*) AS txn_count
+    FROM {transactions} AS transactions
+    WHERE (:user_id IS NULL OR user_id = :user_id)
+    GROUP BY user_id, month, txn_type, COALESCE(category_id, 0)
+"""
+
+_MERCHANT_ROLLUP_SOURCE = """
+    SELECT user_id, substr(txn_date, 1, 7) AS month, merchant_id,
+           SUM({amount}) AS total, COUNT(*) AS txn_count
+    FROM {transactions} AS transactions
+    WHERE txn_type = 'expense' AND merchant_id IS NOT NULL
+      AND (:user_id IS NULL OR user_id = :user_id)
+    GROUP BY user_id, month, merchant_id
+"""
+
+def _rollup_sources(conn):
+    # The migrations before 8 rebuild the rollups before fx_rates and
+    # users.base_currency exist
+    amount = _ROLLUP_AMOUNT if schema_version(conn) >= 8 else "amount"
+    transactions = _history_source(conn)
+    return (_CATEGORY_ROLLUP_SOURCE.format(amount=amount, transactions=transactions),
+            _MERCHANT_ROLLUP_SOURCE.format(amount=amount, transactions=transactions))
+
+def _rebuild_rollups(conn, user_id=None):
+    params = {'user_id': user_id}
+    category_source, merchant_source = _rollup_sources(conn)
+    conn.execute("DELETE FROM monthly_category_totals WHERE (:user_id IS NULL OR user_id = :user_id)", params)
+    conn.execute("DELETE FROM monthly_merchant_spend WHERE (:user_id IS NULL OR user_id = :user_id)", params)
+    conn.execute(f"""
+        INSERT INTO monthly_category_totals (user_id, month, txn_type, category_id, total, txn_count)
+        {category_source}
+    """, params)
+    conn.execute(f"""
+        INSERT INTO monthly_merchant_spend (user_id, month, merchant_id, total, txn_count)
+        {merchant_source}
+    """, params)
+
+@migration(2)
+def _add_rollups(conn):
+    _run_script(conn, _ROLLUP_SCHEMA)
+    _rebuild_rollups(conn)
+
+def rebuild_rollups(user_id=None):
+    with get_db() as conn:
+        _rebuild_rollups(conn, user_id)
+        _rebuild_balance_checkpoints(conn, user_id)
+        if user_id is None:
+            get_pool().after_commit(clear_cache)
+        else:
+            _invalidate(user_id)
+
+def check_rollups(user_id=None):
+    # Returns one row per rollup or balance checkpoint entry that disagrees
+    # with the raw transactions; an empty list means they are consistent
+    with get_db(readonly=True) as conn:
+        category_source, merchant_source = _rollup_sources(conn)
+        cursor = conn.execute(f"""
+            WITH expected AS ({category_source}),
+                 stored AS (
+                     SELECT * FROM monthly_category_totals
+                     WHERE (:user_id IS NULL OR user_id = :user_id)
+                 ),
+                 expected_merchant AS ({merchant_source}),
+                 stored_merchant AS (
+                     SELECT * FROM monthly_merchant_spend
+                     WHERE (:user_id IS NULL OR user_id = :user_id)
+                 ),
+                 category_keys AS (
+                     SELECT user_id, month, txn_type, category_id FROM expected
+                     UNION SELECT user_id, month, txn_type, category_id FROM stored
+                 ),
+                 merchant_keys AS (
+                     SELECT user_id, month, merchant_id FROM expected_merchant
+                     UNION SELECT user_id, month, merchant_id FROM stored_merchant
+                 ),
+                 expected_balance AS ({_BALANCE_CHECKPOINT_SOURCE.format(transactions=_history_source(conn))}),
+                 stored_balance AS (
+                     SELECT * FROM account_balance_checkpoints
+                     WHERE (:user_id IS NULL OR account_id IN (SELECT account_id FROM accounts WHERE user_id = :user_id))
+                 ),
+                 balance_keys AS (
+                     SELECT account_id, month FROM expected_balance
+                     UNION SELECT account_id, month FROM stored_balance
+                 )
+            SELECT 'category' AS rollup, k.user_id, k.month, k.txn_type, k.category_id AS key_id,
+                   e.total AS expected_total, s.total AS stored_total,
+                   e.txn_count AS expected_count, s.txn_count AS stored_count
+            FROM category_keys k
+            LEFT JOIN expected e USING (user_id, month, txn_type, category_id)
+            LEFT JOIN stored s USING (user_id, month, txn_type, category_id)
+            WHERE e.total IS NULL OR s.total IS NULL
+               OR e.total != s.total OR e.txn_count != s.txn_count
+            UNION ALL
+            SELECT 'merchant', k.user_id, k.month, 'expense', k.merchant_id,
+                   e.total, s.total, e.txn_count, s.txn_count
+            FROM merchant_keys k
+            LEFT JOIN expected_merchant e USING (user_id, month, merchant_id)
+            LEFT JOIN stored_merchant s USING (user_id, month, merchant_id)
+            WHERE e.total IS NULL OR s.total IS NULL
+               OR e.total != s.total OR e.txn_count != s.txn_count
+            UNION ALL
+            SELECT 'balance', a.user_id, k.month, NULL, k.account_id,
+                   e.net, s.net, e.txn_count, s.txn_count
+            FROM balance_keys k
+            LEFT JOIN expected_balance e USING (account_id, month)
+            LEFT JOIN stored_balance s USING (account_id, month)
+            LEFT JOIN accounts a ON a.account_id = k.account_id
+            WHERE e.net IS NULL OR s.net IS NULL
+               OR e.net != s.net OR e.txn_count != s.txn_count
+        """, {'user_id': user_id})
+        return cursor.fetchall()
+
+# Paise migration
+#
+# SQLite cannot change a column's type in place, so each table is recreated
+# from its own stored DDL with the money columns switched to INTEGER, and its
+# indexes and triggers are put back afterwards.
+_MONEY_COLUMNS = {
+    'accounts': ('balance',),
+    'transactions': ('amount',),
+    'budgets': ('amount',),
+    'budget_items': ('amount',),
+    'monthly_category_totals': ('total',),
+    'monthly_merchant_spend': ('total',),
+}
+
+def _rebuild_table(conn, table, money_columns):
+    create = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    dependents = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)
+    )]
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+    create = re.sub(rf'^CREATE TABLE(?: IF NOT EXISTS)? "?{table}"?', f'CREATE TABLE {table}_new', create)
+    for column in money_columns:
+        create = re.sub(rf'\b{column} REAL NOT NULL DEFAULT [0-9.]+', f'{column} INTEGER NOT NULL DEFAULT 0', create)
+        create = re.sub(rf'\b{column} REAL\b', f'{column} INTEGER', create)
+    conn.execute(create)
+
+    select = ', '.join(
+        f"CAST(ROUND({c} * 100) AS INTEGER)" if c in money_columns else c for c in columns
+    )
+    conn.execute(f"INSERT INTO {table}_new ({', '.join(columns)}) SELECT {select} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    # Legacy mode skips re-checking triggers on other tables, which may
+    # point at a table that is mid-rebuild
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    finally:
+        conn.execute("PRAGMA legacy_alter_table = OFF")
+    for sql in dependents:
+        conn.execute(sql)
+
+@migration(4)
+def _store_paise(conn):
+    for table, money_columns in _MONEY_COLUMNS.items():
+        _rebuild_table(conn, table, money_columns)
+    # Recompute the rollups from the converted amounts rather than trusting
+    # the rounded float totals
+    _rebuild_rollups(conn)
+
+# Exchange rates
+#
+# Amounts keep the currency they were entered in (a transaction takes its
+# account's) and are converted into the user's base currency where they are
+# added up. fx_rates holds daily rates per currency pair, as units of
+# to_currency per unit of from_currency, loaded from a CSV file by
+# load_fx_rates(). An amount converts at the pair's latest rate on or before
+# its date, or the pair's earliest rate if it predates them all, and is left
+# as is when the pair has no rates.
+#
+# In SQL the conversion is a date-matched probe of the fx_rates primary key
+# per foreign-currency row; rows already in the base currency cost one
+# comparison. The rollup triggers store base currency totals, so loading
+# rates or changing a base currency rebuilds the affected users' rollups. In
+# Python, convert_amounts() converts whole arrays and looks up each distinct
+# currency and date once, through a cache keyed by (pair, date).
+BASE_CURRENCY = 'INR'
+FX_CACHE_SIZE = 4096
+
+_CURRENCY_CODE = re.compile(r'[A-Z]{3}')
+
+_FX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fx_rates (
+    from_currency TEXT NOT NULL,
+    to_currency TEXT NOT NULL,
+    rate_date TEXT NOT NULL,
+    rate REAL NOT NULL CHECK (rate > 0),
+    PRIMARY KEY (from_currency, to_currency, rate_date)
+) WITHOUT ROWID;
+"""
+
+_FX_LOOKUP = """
+    SELECT COALESCE(
+        (SELECT rate FROM fx_rates WHERE from_currency = :from AND to_currency = :to
+           AND rate_date <= :day ORDER BY rate_date DESC LIMIT 1),
+        (SELECT rate FROM fx_rates WHERE from_currency = :from AND to_currency = :to
+         ORDER BY rate_date LIMIT 1)
+    )
+"""
+
+def _currency_code(value):
+    code = str(value or '').strip().upper()
+    if not _CURRENCY_CODE.fullmatch(code):
+        raise ValueError(f"not a currency code: {value!r}")
+    return code
+
+def _base_amount(row, base):
+    # SQL for a row's amount in base currency paise. row is the prefix of its
+    # columns ('t.', 'NEW.'), base an SQL expression for the currency code.
+    rate = f"SELECT rate FROM fx_rates WHERE from_currency = {row}currency AND to_currency = {base}"
+    return f"""(CASE WHEN {row}currency = {base} THEN {row}amount
+        ELSE CAST(ROUND({row}amount * COALESCE(
+            ({rate} AND rate_date <= substr({row}txn_date, 1, 10) ORDER BY rate_date DESC LIMIT 1),
+            ({rate} ORDER BY rate_date LIMIT 1),
+            1.0)) AS INTEGER) END)"""
+
+def _user_base(row):
+    return f"(SELECT base_currency FROM users WHERE user_id = {row}user_id)"
+
+def _base_sql(user_id):
+    # The user's base currency as an SQL literal, for queries on one user
+    return f"'{_currency_code(get_base_currency(user_id))}'"
+
+# What the rollups add up from migration 8 on
+_ROLLUP_AMOUNT = _base_amount('transactions.', _user_base('transactions.'))
+
+def _converted_rollup_triggers():
+    # The rollup triggers of migration 2, adding up base currency amounts and
+    # also firing when a transaction's currency changes
+    triggers = []
+    for trigger in re.findall(r"CREATE TRIGGER .*?\nEND;", _ROLLUP_SCHEMA, re.S):
+        for row in ('NEW.', 'OLD.'):
+            trigger = trigger.replace(f"{row}amount", _base_amount(row, _user_base(row)))
+        triggers.append(trigger.replace("merchant_id, amount ON", "merchant_id, amount, currency ON"))
+    return triggers
+
+@migration(8)
+def _add_fx_rates(conn):
+    _run_script(conn, _FX_SCHEMA)
+    conn.execute(f"ALTER TABLE users ADD COLUMN base_currency TEXT NOT NULL DEFAULT '{BASE_CURRENCY}'")
+    # Every amount was treated as rupees until now, so the 'USD' that the
+    # schema defaults put on accounts and budgets was never meant, and
+    # add_transaction() did not copy the account's currency. Nothing converts
+    # before rates are loaded, so the rollups stand as they are.
+    conn.execute("UPDATE accounts SET currency = ? WHERE currency = 'USD'", (BASE_CURRENCY,))
+    conn.execute("UPDATE budgets SET currency = ? WHERE currency = 'USD'", (BASE_CURRENCY,))
+    conn.execute("""
+        UPDATE transactions
+        SET currency = (SELECT a.currency FROM accounts a WHERE a.account_id = transactions.account_id)
+        WHERE currency != (SELECT a.currency FROM accounts a WHERE a.account_id = transactions.account_id)
+    """)
+    for name in ('trg_rollup_insert', 'trg_rollup_delete', 'trg_rollup_update'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for trigger in _converted_rollup_triggers():
+        conn.execute(trigger)
+
+@cached
+def get_base_currency(user_id):
+    with get_db(readonly=True) as conn:
+        row = conn.execute("SELECT base_currency FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else BASE_CURRENCY
+
+def set_base_currency(user_id, currency):
+    currency = _currency_code(currency)
+    with get_db() as conn:
+        conn.execute("UPDATE users SET base_currency = ? WHERE user_id = ?", (currency, user_id))
+        # Rollup totals are in the old base currency, in the snapshot too
+        _rebuild_rollups(conn, user_id)
+        _invalidate(user_id)
+        get_pool().after_commit(expire_snapshot)
+
+def get_fx_currencies():
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute("SELECT from_currency FROM fx_rates UNION SELECT to_currency FROM fx_rates")
+        return [row[0] for row in cursor]
+
+class RateCache:
+    # Rates keyed by (pair, date); None records that the pair has no rates.
+    # load_fx_rates() clears it once its rates commit.
+    def __init__(self, maxsize=FX_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._rates = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def rate(self, from_currency, to_currency, day):
+        if from_currency == to_currency:
+            return 1.0
+        key = (DB_NAME, (from_currency, to_currency), day)
+        with self._lock:
+            if key in self._rates:
+                self._rates.move_to_end(key)
+                return self._rates[key]
+            epoch = self._epoch
+
+        with get_db(readonly=True) as conn:
+            rate = conn.execute(_FX_LOOKUP, {'from': from_currency, 'to': to_currency, 'day': day}).fetchone()[0]
+
+        with self._lock:
+            # Rates were reloaded while this one was being read
+            if epoch == self._epoch:
+                self._rates[key] = rate
+                while len(self._rates) > self.maxsize:
+                    self._rates.popitem(last=False)
+        return rate
+
+    def clear(self):
+        with self._lock:
+            self._rates.clear()
+            self._epoch += 1
+
+fx_cache = RateCache()
+
+def get_fx_rate(from_currency, to_currency, on=None):
+    # Units of to_currency per unit of from_currency on the given day
+    # (default today), or None when the pair has no rates
+    day = (_as_date(on) if on else date.today()).isoformat()
+    return fx_cache.rate(_currency_code(from_currency), _currency_code(to_currency), day)
+
+def convert_amounts(amounts, currencies, to_currency, on=None):
+    # Converts an array of amounts into to_currency. currencies and on
+    # (default today) are one value for all amounts or one per amount; each
+    # distinct currency and day is looked up once, then applied as a vector.
+    import numpy as np
+
+    amounts = np.asarray(amounts, dtype='float64')
+    to_currency = _currency_code(to_currency)
+    currencies = np.broadcast_to(np.asarray(currencies, dtype=object), amounts.shape)
+    days = np.asarray(on if on is not None else date.today())
+    if days.dtype.kind != 'M':
+        days = np.array([_as_date(day) for day in days.ravel()], dtype='datetime64[D]').reshape(days.shape)
+    days = np.broadcast_to(days.astype('datetime64[D]'), amounts.shape)
+
+    currency_values, currency_index = np.unique(currencies.astype(str), return_inverse=True)
+    day_values, day_index = np.unique(days, return_inverse=True)
+    codes, inverse = np.unique(currency_index * len(day_values) + day_index, return_inverse=True)
+    rates = np.array([
+        fx_cache.rate(_currency_code(currency_values[code // len(day_values)]), to_currency,
+                      str(day_values[code % len(day_values)])) or 1.0
+        for code in codes.tolist()
+    ], dtype='float64')
+    return amounts * rates[inverse.reshape(amounts.shape)]
+
+def get_total_balance(user_id, on=None):
+    # All account balances in the user's base currency at the rates of on
+    # (default today)
+    accounts = get_accounts_frame(user_id, as_arrays=True)
+    base = get_base_currency(user_id)
+    return float(convert_amounts(accounts['balance'], accounts['currency'], base, on).sum())
+
+_FX_ALIASES = {
+    'date': 'rate_date', 'rate_date': 'rate_date', 'day': 'rate_date',
+    'from': 'from_currency', 'from_currency': 'from_currency', 'base': 'from_currency',
+    'to': 'to_currency', 'to_currency': 'to_currency', 'quote': 'to_currency',
+    'rate': 'rate',
+}
+
+def read_fx_rates(fileobj):
+    # Yields (from_currency, to_currency, rate_date, rate) per CSV row. A bad
+    # row stops the load: a wrong rate would skew every total using it.
+    reader = csv.reader(_text_stream(fileobj))
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [_FX_ALIASES.get(h.strip().lower()) for h in header]
+    if {'rate_date', 'from_currency', 'to_currency', 'rate'} - set(columns):
+        raise ValueError("FX rates CSV needs date, from, to and rate columns")
+
+    for line, values in enumerate(reader, start=2):
+        if not any(values):
+            continue
+        row = {key: value.strip() for key, value in zip(columns, values) if key}
+        try:
+            rate = float(row.get('rate', ''))
+            if not rate > 0 or rate == float('inf'):
+                raise ValueError(f"rate must be positive, got {row['rate']!r}")
+            yield (_currency_code(row.get('from_currency')), _currency_code(row.get('to_currency')),
+                   _parse_date(row.get('rate_date', '')), rate)
+        except ValueError as e:
+            raise ValueError(f"line {line}: {e}") from None
+
+def load_fx_rates(source, chunk_size=IMPORT_CHUNK_SIZE):
+    # source is a path or a CSV file object. Rates replace those stored for
+    # the same pair and day, and each also stores its inverse unless the file
+    # gives that one too. Returns the number of rows read.
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return load_fx_rates(f, chunk_size)
+
+    count = 0
+    given = set()
+    with get_db() as conn:
+        for chunk in iter_chunks(read_fx_rates(source), chunk_size):
+            given.update((f, t, day) for f, t, day, _ in chunk)
+            conn.executemany("""
+                INSERT OR REPLACE INTO fx_rates (from_currency, to_currency, rate_date, rate)
+                VALUES (?, ?, ?, ?)
+            """, chunk)
+            conn.executemany("""
+                INSERT OR REPLACE INTO fx_rates (from_currency, to_currency, rate_date, rate)
+                VALUES (?, ?, ?, ?)
+            """, [(t, f, day, 1 / rate) for f, t, day, rate in chunk if (t, f, day) not in given])
+            count += len(chunk)
+
+        # Foreign-currency rollup totals convert at the new rates
+        users = [row[0] for row in conn.execute(f"""
+            SELECT DISTINCT t.user_id FROM {_history_source(conn)} t JOIN users u ON u.user_id = t.user_id
+            WHERE t.currency != u.base_currency
+        """)]
+        for user_id in users:
+            _rebuild_rollups(conn, user_id)
+        get_pool().after_commit(clear_cache)
+    return count
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+def _month_end(day):
+    next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+def _split_range(start_date, end_date):
+    # Split [start_date, end_date] into the ragged days at either end, which
+    # have to come from raw transactions, and the whole months in between,
+    # which the rollups can answer. Raw ranges are half-open [first, stop) so
+    # they stay sargable on idx_transactions_user_date. Either bound may be
+    # None (unbounded).
+    start = _as_date(start_date) if start_date else None
+    end = _as_date(end_date) if end_date else None
+    if start and end and start > end:
+        return [], None
+
+    raw = []
+    first, last = start, end
+    if start and start.day != 1:
+        head_end = _month_end(start)
+        if end and end <= head_end:
+            return [(start, end + timedelta(days=1))], None
+        raw.append((start, head_end + timedelta(days=1)))
+        first = head_end + timedelta(days=1)
+    if end and end != _month_end(end):
+        tail_start = end.replace(day=1)
+        raw.append((max(tail_start, start) if start else tail_start, end + timedelta(days=1)))
+        last = tail_start - timedelta(days=1)
+
+    if first and last and last < first:
+        return raw, None
+    months = (first.strftime('%Y-%m') if first else None, last.strftime('%Y-%m') if last else None)
+    return raw, months
+
+def _rollup_union(user_id, start_date, end_date, rollup_select, raw_select):
+    # UNION ALL of rollup rows for the whole months in the range and raw
+    # transactions for the partial months, from the archive too for months
+    # before its horizon; both selects must end in a WHERE clause on
+    # user_id = ? (or another key column, bound to the first argument)
+    raw, months = _split_range(start_date, end_date)
+    parts = []
+    params = []
+    if months:
+        parts.append(rollup_select + " AND month >= COALESCE(?, '') AND month <= COALESCE(?, '9999-12')")
+        params.extend([user_id, months[0], months[1]])
+    for first, stop in raw:
+        selects = [raw_select, _archive_sql(raw_select)] if _reads_archive(first) else [raw_select]
+        for select in selects:
+            parts.append(select + " AND txn_date >= ? AND txn_date < ?")
+            params.extend([user_id, first.isoformat(), stop.isoformat()])
+    if not parts:
+        # Empty range: keep the column names but match nothing
+        return raw_select + " AND 0", [user_id]
+    return " UNION ALL ".join(parts), params
 
 # Analytics
+def _spending_by_category_query(user_id, start_date, end_date):
+    amount = _base_amount('transactions.', _base_sql(user_id))
+    source, params = _rollup_union(
+        user_id, start_date, end_date,
+        """SELECT category_id, total FROM monthly_category_totals
+           WHERE txn_type = 'expense' AND user_id = ?""",
+        f"""SELECT category_id, {amount} AS total FROM transactions
+           WHERE txn_type = 'expense' AND user_id = ?"""
+    )
+    return f"""
+        SELECT c.name, SUM(x.total) / 100.0 as total
+        FROM ({source}) x
+        JOIN categories c ON x.category_id = c.category_id
+        GROUP BY c.category_id, c.name
+        ORDER BY total DESC
+    """, params
+
+@cached
+@reads_snapshot
 def get_spending_by_category(user_id, start_date=None, end_date=None):
-    with get_db() as conn:
-        query = """
-            SELECT c.name, SUM(t.amount) as total
-            FROM transactions t
-            JOIN categories c ON t.category_id = c.category_id
-            WHERE t.user_id = ? AND t.txn_type = 'expense'
-        """
-        params = [user_id]
-        
-        if start_date:
-            query += " AND t.txn_date >= ?"
-            params.append(start_date)
-        if end_date:
-            query += " AND t.txn_date <= ?"
-            params.append(end_date)
-        
-        query += " GROUP BY c.category_id, c.name ORDER BY total DESC"
-        
+    query, params = _spending_by_category_query(user_id, start_date, end_date)
+    with analytics_db() as conn:
         cursor = conn.execute(query, params)
         return cursor.fetchall()
 
+@cached
+@reads_snapshot
 def get_monthly_summary(user_id, year, month):
-    with get_db() as conn:
+    with analytics_db() as conn:
         cursor = conn.execute("""
             SELECT 
                 txn_type,
-                SUM(amount) as total
-            FROM transactions
-            WHERE user_id = ? 
-            AND strftime('%Y', txn_date) = ? 
-            AND strftime('%m', txn_date) = ?
+                SUM(total) / 100.0 as total
+            FROM monthly_category_totals
+            WHERE user_id = ? AND month = ?
             GROUP BY txn_type
-        """, (user_id, str(year), f"{month:02d}"))
+        """, (user_id, f"{int(year):04d}-{int(month):02d}"))
+        return cursor.fetchall()
+
+# Period key for each granularity; weeks start on Monday
+_PERIOD_KEYS = {
+    'day': ("substr(txn_date, 1, 10)", None),
+    'week': ("date(txn_date, 'weekday 0', '-6 days')", None),
+    'month': ("substr(txn_date, 1, 7)", "month"),
+    'year': ("substr(txn_date, 1, 4)", "substr(month, 1, 4)"),
+}
+
+def _period_summary_query(user_id, start_date, end_date, granularity):
+    if granularity not in _PERIOD_KEYS:
+        raise ValueError(f"granularity must be one of {', '.join(_PERIOD_KEYS)}")
+    raw_key, rollup_key = _PERIOD_KEYS[granularity]
+    amount = _base_amount('transactions.', _base_sql(user_id))
+
+    if rollup_key:
+        source, params = _rollup_union(
+            user_id, start_date, end_date,
+            f"SELECT {rollup_key} AS period, txn_type, total FROM monthly_category_totals WHERE user_id = ?",
+            f"SELECT {raw_key} AS period, txn_type, {amount} AS total FROM transactions WHERE user_id = ?"
+        )
+    else:
+        # Day and week buckets cannot use the monthly rollups
+        source = f"SELECT {raw_key} AS period, txn_type, {amount} AS total FROM transactions WHERE user_id = ?"
+        params = [user_id]
+        if start_date:
+            source += " AND txn_date >= ?"
+            params.append(_as_date(start_date).isoformat())
+        if end_date:
+            source += " AND txn_date < ?"
+            params.append((_as_date(end_date) + timedelta(days=1)).isoformat())
+        source, params = _with_archive(source, params, start_date)
+
+    query = f"""
+        SELECT
+            period,
+            SUM(CASE WHEN txn_type = 'income' THEN total ELSE 0 END) / 100.0 as income,
+            SUM(CASE WHEN txn_type = 'expense' THEN total ELSE 0 END) / 100.0 as expense,
+            SUM(CASE WHEN txn_type = 'income' THEN total
+                     WHEN txn_type = 'expense' THEN -total ELSE 0 END) / 100.0 as net
+        FROM ({source})
+        GROUP BY period
+        ORDER BY period
+    """
+    return query, params
+
+@cached
+@reads_snapshot
+def get_period_summaries(user_id, start_date=None, end_date=None, granularity='month'):
+    query, params = _period_summary_query(user_id, start_date, end_date, granularity)
+    with analytics_db() as conn:
+        cursor = conn.execute(query, params)
+        return cursor.fetchall()
+
+@cached
+@reads_snapshot
+def get_totals_by_type(user_id, start_date=None, end_date=None):
+    amount = _base_amount('transactions.', _base_sql(user_id))
+    source, params = _rollup_union(
+        user_id, start_date, end_date,
+        "SELECT txn_type, total FROM monthly_category_totals WHERE user_id = ?",
+        f"SELECT txn_type, {amount} AS total FROM transactions WHERE user_id = ?"
+    )
+
+    with analytics_db() as conn:
+        cursor = conn.execute(f"""
+            SELECT txn_type, SUM(total) / 100.0 as total
+            FROM ({source})
+            GROUP BY txn_type
+        """, params)
+        return cursor.fetchall()
+
+def _daily_spending_query(user_id, start_date, end_date):
+    # Served from idx_transactions_user_type without touching other rows
+    source, params = _with_archive(f"""
+        SELECT txn_date AS day, SUM({_base_amount('transactions.', _base_sql(user_id))}) AS total
+        FROM transactions
+        WHERE user_id = ? AND txn_type = 'expense' AND txn_date >= ? AND txn_date < ?
+        GROUP BY txn_date
+    """, [user_id, _as_date(start_date).isoformat(), (_as_date(end_date) + timedelta(days=1)).isoformat()],
+        start_date)
+    return f"""
+        SELECT day, SUM(total) / 100.0 as total
+        FROM ({source})
+        GROUP BY day
+        ORDER BY day
+    """, params
+
+@cached
+@reads_snapshot
+def get_daily_spending(user_id, start_date, end_date):
+    query, params = _daily_spending_query(user_id, start_date, end_date)
+    with analytics_db() as conn:
+        cursor = conn.execute(query, params)
+        return cursor.fetchall()
+
+def _top_merchants_query(user_id, start_date, end_date, limit):
+    amount = _base_amount('transactions.', _base_sql(user_id))
+    source, params = _rollup_union(
+        user_id, start_date, end_date,
+        "SELECT merchant_id, total FROM monthly_merchant_spend WHERE user_id = ?",
+        f"""SELECT merchant_id, {amount} AS total FROM transactions
+           WHERE txn_type = 'expense' AND merchant_id IS NOT NULL AND user_id = ?"""
+    )
+    return f"""
+        SELECT m.name, SUM(x.total) / 100.0 as total
+        FROM ({source}) x
+        JOIN merchants m ON x.merchant_id = m.merchant_id
+        GROUP BY m.merchant_id, m.name
+        ORDER BY total DESC
+        LIMIT ?
+    """, params + [limit]
+
+@cached
+@reads_snapshot
+def get_top_merchants(user_id, start_date=None, end_date=None, limit=10):
+    query, params = _top_merchants_query(user_id, start_date, end_date, limit)
+    with analytics_db() as conn:
+        cursor = conn.execute(query, params)
+        return cursor.fetchall()
+
+def _spending_by_tag_query(user_id, start_date, end_date):
+    # A transaction with several tags counts towards each of them
+    conditions = ["g.user_id = ?", "t.txn_type = 'expense'"]
+    params = [user_id]
+    if start_date:
+        conditions.append("t.txn_date >= ?")
+        params.append(_as_date(start_date).isoformat())
+    if end_date:
+        conditions.append("t.txn_date < ?")
+        params.append((_as_date(end_date) + timedelta(days=1)).isoformat())
+    source, params = _with_archive(f"""
+        SELECT g.tag_id, g.name, SUM({_base_amount('t.', _base_sql(user_id))}) AS total,
+               COUNT(*) AS txn_count
+        FROM tags g
+        JOIN transaction_tags x ON x.tag_id = g.tag_id
+        JOIN transactions t ON t.transaction_id = x.transaction_id
+        WHERE {" AND ".join(conditions)}
+        GROUP BY g.tag_id
+    """, params, start_date)
+    return f"""
+        SELECT tag_id, name, SUM(total) / 100.0 AS total, SUM(txn_count) AS txn_count
+        FROM ({source})
+        GROUP BY tag_id, name
+        ORDER BY total DESC
+    """, params
+
+@cached
+@reads_snapshot
+def get_spending_by_tag(user_id, start_date=None, end_date=None):
+    query, params = _spending_by_tag_query(user_id, start_date, end_date)
+    with analytics_db() as conn:
+        cursor = conn.execute(query, params)
+        return cursor.fetchall()
+
+# Balance history
+#
+# account_balance_checkpoints holds each account's net change per month
+# (income in, expenses out; transfers do not move balances), maintained by
+# triggers like the rollups. accounts.opening_balance is the balance before
+# any transaction, so the balance at the end of month M is opening_balance
+# plus the checkpoints up to M, and any other day adds at most one month of
+# raw transactions on top.
+_NET_AMOUNT = "CASE txn_type WHEN 'income' THEN amount WHEN 'expense' THEN -amount ELSE 0 END"
+
+_BALANCE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS account_balance_checkpoints (
+    account_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    net INTEGER NOT NULL DEFAULT 0,
+    txn_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (account_id, month),
+    FOREIGN KEY (account_id) REFERENCES accounts(account_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_balance_insert AFTER INSERT ON transactions
+BEGIN
+    INSERT INTO account_balance_checkpoints (account_id, month, net, txn_count)
+    VALUES (NEW.account_id, substr(NEW.txn_date, 1, 7),
+            CASE NEW.txn_type WHEN 'income' THEN NEW.amount WHEN 'expense' THEN -NEW.amount ELSE 0 END, 1)
+    ON CONFLICT (account_id, month)
+    DO UPDATE SET net = net + excluded.net, txn_count = txn_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_balance_delete AFTER DELETE ON transactions
+BEGIN
+    UPDATE account_balance_checkpoints
+    SET net = net - CASE OLD.txn_type WHEN 'income' THEN OLD.amount WHEN 'expense' THEN -OLD.amount ELSE 0 END,
+        txn_count = txn_count - 1
+    WHERE account_id = OLD.account_id AND month = substr(OLD.txn_date, 1, 7);
+    DELETE FROM account_balance_checkpoints
+    WHERE account_id = OLD.account_id AND month = substr(OLD.txn_date, 1, 7) AND txn_count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_balance_update
+AFTER UPDATE OF account_id, txn_date, txn_type, amount ON transactions
+BEGIN
+    UPDATE account_balance_checkpoints
+    SET net = net - CASE OLD.txn_type WHEN 'income' THEN OLD.amount WHEN 'expense' THEN -OLD.amount ELSE 0 END,
+        txn_count = txn_count - 1
+    WHERE account_id = OLD.account_id AND month = substr(OLD.txn_date, 1, 7);
+    DELETE FROM account_balance_checkpoints
+    WHERE account_id = OLD.account_id AND month = substr(OLD.txn_date, 1, 7) AND txn_count <= 0;
+    INSERT INTO account_balance_checkpoints (account_id, month, net, txn_count)
+    VALUES (NEW.account_id, substr(NEW.txn_date, 1, 7),
+            CASE NEW.txn_type WHEN 'income' THEN NEW.amount WHEN 'expense' THEN -NEW.amount ELSE 0 END, 1)
+    ON CONFLICT (account_id, month)
+    DO UPDATE SET net = net + excluded.net, txn_count = txn_count + 1;
+END;
+"""
+
+# {transactions} as in _CATEGORY_ROLLUP_SOURCE
+_BALANCE_CHECKPOINT_SOURCE = f"""
+    SELECT t.account_id, substr(t.txn_date, 1, 7) AS month,
+           SUM({_NET_AMOUNT}) AS net, COUNT(*) AS txn_count
+    FROM {{transactions}} t
+    WHERE (:user_id IS NULL OR t.account_id IN (SELECT account_id FROM accounts WHERE user_id = :user_id))
+    GROUP BY t.account_id, month
+"""
+
+def _rebuild_balance_checkpoints(conn, user_id=None):
+    params = {'user_id': user_id}
+    conn.execute("""
+        DELETE FROM account_balance_checkpoints
+        WHERE (:user_id IS NULL OR account_id IN (SELECT account_id FROM accounts WHERE user_id = :user_id))
+    """, params)
+    conn.execute(f"""
+        INSERT INTO account_balance_checkpoints (account_id, month, net, txn_count)
+        {_BALANCE_CHECKPOINT_SOURCE.format(transactions=_history_source(conn))}
+    """, params)
+
+def _settle_opening_balances(conn, user_id=None):
+    # Take the current balances as correct and work the opening balances
+    # back from them
+    conn.execute("""
+        UPDATE accounts
+        SET opening_balance = balance - COALESCE(
+            (SELECT SUM(net) FROM account_balance_checkpoints c WHERE c.account_id = accounts.account_id), 0
+        )
+        WHERE (:user_id IS NULL OR user_id = :user_id)
+    """, {'user_id': user_id})
+
+@migration(6)
+def _add_balance_checkpoints(conn):
+    _run_script(conn, _BALANCE_SCHEMA + """
+        ALTER TABLE accounts ADD COLUMN opening_balance INTEGER NOT NULL DEFAULT 0;
+        DROP INDEX IF EXISTS idx_transactions_account;
+        CREATE INDEX idx_transactions_account ON transactions(account_id, txn_date);
+    """)
+    _rebuild_balance_checkpoints(conn)
+    _settle_opening_balances(conn)
+
+def _month_net(day, stop):
+    # SQL adding the net change of account a from the first of day's month
+    # up to stop, from the archive too when it holds that month
+    first = day.replace(day=1)
+    term = f"""
+        + COALESCE((SELECT SUM({_NET_AMOUNT}) FROM transactions
+                    WHERE account_id = a.account_id AND txn_date >= ? AND txn_date < ?), 0)"""
+    params = [first.isoformat(), stop.isoformat()]
+    if _reads_archive(first):
+        return term + _archive_sql(term), params + params
+    return term, params
+
+def _balance_history_query(user_id, account_id, start_date, end_date, granularity):
+    if granularity not in _PERIOD_KEYS:
+        raise ValueError(f"granularity must be one of {', '.join(_PERIOD_KEYS)}")
+    raw_key, rollup_key = _PERIOD_KEYS[granularity]
+    raw_select = f"SELECT {raw_key} AS period, {_NET_AMOUNT} AS net FROM transactions WHERE account_id = ?"
+
+    if rollup_key:
+        source, source_params = _rollup_union(
+            account_id, start_date, end_date,
+            f"SELECT {rollup_key} AS period, net FROM account_balance_checkpoints WHERE account_id = ?",
+            raw_select
+        )
+    else:
+        source, source_params = raw_select, [account_id]
+        if start_date:
+            source += " AND txn_date >= ?"
+            source_params.append(_as_date(start_date).isoformat())
+        if end_date:
+            source += " AND txn_date < ?"
+            source_params.append((_as_date(end_date) + timedelta(days=1)).isoformat())
+        source, source_params = _with_archive(source, source_params, start_date)
+
+    # Balance going into the range: opening balance, whole months from the
+    # checkpoints, then the days of start_date's month before it
+    if start_date:
+        start = _as_date(start_date)
+        month_net, month_params = _month_net(start, start)
+        before = f"""
+            + COALESCE((SELECT SUM(net) FROM account_balance_checkpoints
+                        WHERE account_id = a.account_id AND month < ?), 0)
+            {month_net}
+        """
+        before_params = [start.strftime('%Y-%m')] + month_params
+    else:
+        before, before_params = "", []
+
+    # MATERIALIZED keeps the correlated sums from being flattened into the
+    # join and re-run for every transaction in the range
+    query = f"""
+        WITH opening AS MATERIALIZED (
+            SELECT a.opening_balance {before} AS balance
+            FROM accounts a
+            WHERE a.account_id = ? AND a.user_id = ?
+        )
+        SELECT
+            period,
+            SUM(x.net) / 100.0 AS net,
+            (MAX(opening.balance) + SUM(SUM(x.net)) OVER (ORDER BY period)) / 100.0 AS balance
+        FROM ({source}) x
+        CROSS JOIN opening
+        GROUP BY period
+        ORDER BY period
+    """
+    return query, before_params + [account_id, user_id] + source_params
+
+@cached
+@reads_snapshot
+def get_balance_history(user_id, account_id, start_date=None, end_date=None, granularity='day'):
+    # Closing balance for each period with activity, plus that period's net
+    # change; empty if the account is not the user's
+    query, params = _balance_history_query(user_id, account_id, start_date, end_date, granularity)
+    with analytics_db() as conn:
+        cursor = conn.execute(query, params)
+        return cursor.fetchall()
+
+@cached
+def get_account_balances(user_id, on):
+    # Every account's balance at the end of the given day: opening balance,
+    # checkpoints of the months before, then that month's transactions
+    day = _as_date(on)
+    month_net, month_params = _month_net(day, day + timedelta(days=1))
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute(f"""
+            SELECT a.account_id, a.name, a.type, a.currency,
+                   (a.opening_balance
+                    + COALESCE((SELECT SUM(net) FROM account_balance_checkpoints
+                                WHERE account_id = a.account_id AND month < ?), 0)
+                    {month_net}
+                   ) / 100.0 AS balance
+            FROM accounts a
+            WHERE a.user_id = ?
+            ORDER BY a.name
+        """, [day.strftime('%Y-%m')] + month_params + [user_id])
         return cursor.fetchall()
+
+def reconcile_balances(user_id=None, fix=False):
+    # Compares every account's stored balance with opening_balance plus its
+    # checkpoints, which reads one row per account-month rather than the
+    # transactions. Returns the accounts that drifted; with fix=True their
+    # balances are reset to the expected value.
+    with get_db(readonly=not fix) as conn:
+        drifted = conn.execute("""
+            SELECT a.account_id, a.user_id, a.name,
+                   a.balance / 100.0 AS balance,
+                   (a.opening_balance + COALESCE(SUM(c.net), 0)) / 100.0 AS expected,
+                   (a.balance - a.opening_balance - COALESCE(SUM(c.net), 0)) / 100.0 AS drift
+            FROM accounts a
+            LEFT JOIN account_balance_checkpoints c ON c.account_id = a.account_id
+            WHERE (:user_id IS NULL OR a.user_id = :user_id)
+            GROUP BY a.account_id
+            HAVING a.balance != a.opening_balance + COALESCE(SUM(c.net), 0)
+            ORDER BY a.user_id, a.account_id
+        """, {'user_id': user_id}).fetchall()
+        if fix and drifted:
+            conn.executemany("""
+                UPDATE accounts
+                SET balance = opening_balance + COALESCE(
+                    (SELECT SUM(net) FROM account_balance_checkpoints c WHERE c.account_id = accounts.account_id), 0
+                )
+                WHERE account_id = ?
+            """, [(row['account_id'],) for row in drifted])
+            for owner in {row['user_id'] for row in drifted}:
+                _invalidate(owner)
+        return drifted
+
+# Archive
+#
+# Transactions dated before a horizon can be moved out of the main file into
+# an archive file next to it (budgeting.archive.db for budgeting.db), tags
+# and all, so the indexes every page reads stay small. The horizon is the
+# first day of a month, only moves forward, and each run is logged in
+# archive_runs. The rollups and balance checkpoints keep their archived
+# months, so whole-month totals and balances never read the archive. Raw
+# reads (partial months, day and week buckets, listings, exports, budgets)
+# add a UNION ALL arm on the archive only when their range starts before the
+# horizon. Once the file exists it is attached to every pooled connection as
+# "archive".
+#
+# Archived transactions are read-only: they cannot be deleted or tagged and
+# search does not find them. Rows entered later with an older date stay in
+# the main file until the next run. The two files do not commit atomically,
+# so the copy commits before the originals are deleted; a crash in between
+# leaves rows in both, and reads that reach the archive count them twice
+# until archive_transactions() runs again.
+ARCHIVE_AFTER_MONTHS = 24
+
+_ARCHIVE_TABLES = ('transactions', 'transaction_tags')
+_ARCHIVED = re.compile(r"(?<![.\w])(transactions|transaction_tags)\b")
+
+_ARCHIVE_INDEXES = """
+CREATE INDEX IF NOT EXISTS archive.idx_transactions_user_date ON transactions(user_id, txn_date, created_at);
+CREATE INDEX IF NOT EXISTS archive.idx_transactions_user_type ON transactions(user_id, txn_type, txn_date, created_at);
+CREATE INDEX IF NOT EXISTS archive.idx_transactions_account ON transactions(account_id, txn_date);
+CREATE INDEX IF NOT EXISTS archive.idx_transactions_fingerprint ON transactions(user_id, fingerprint);
+CREATE INDEX IF NOT EXISTS archive.idx_transaction_tags_tag ON transaction_tags(tag_id, transaction_id);
+"""
+
+# Columns the rebuilds read from both files
+_HISTORY_COLUMNS = "transaction_id, user_id, account_id, category_id, merchant_id, txn_type, amount, currency, txn_date"
+
+# Rollup tables whose archived months survive the move
+_KEPT_ROLLUPS = ('monthly_category_totals', 'monthly_merchant_spend', 'account_balance_checkpoints')
+
+_archive_horizons = {}
+
+@migration(9)
+def _add_archive_runs(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archive_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            horizon DATE NOT NULL,
+            archived INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def archive_path(path=None):
+    base, ext = os.path.splitext(path or DB_NAME)
+    return f"{base}.archive{ext or '.db'}"
+
+def archive_horizon():
+    # First day of the oldest month still in the main file, or None when
+    # nothing has been archived
+    path = DB_NAME
+    if path not in _archive_horizons:
+        horizon = None
+        if os.path.exists(archive_path(path)):
+            # The archive may have been created by another process
+            get_pool().attach('archive', archive_path(path))
+            with get_db(readonly=True) as conn:
+                row = conn.execute("SELECT MAX(horizon) FROM archive_runs").fetchone()
+            if row[0]:
+                horizon = date.fromisoformat(row[0])
+        _archive_horizons[path] = horizon
+    return _archive_horizons[path]
+
+def _reads_archive(start_date):
+    horizon = archive_horizon()
+    return horizon is not None and (not start_date or _as_date(start_date) < horizon)
+
+def _archive_sql(sql):
+    # The same statement on the archive's copies of the tables
+    return _ARCHIVED.sub(r"archive.\1", sql)
+
+def _with_archive(sql, params, start_date):
+    # sql, then UNION ALL the same select on the archive if the range
+    # starting at start_date reaches it
+    if not _reads_archive(start_date):
+        return sql, params
+    return f"{sql} UNION ALL {_archive_sql(sql)}", params + params
+
+def _history_source(conn):
+    # FROM clause for every transaction in both files, for the rebuilds and
+    # checks that have to see the whole history. Reads the horizon on conn
+    # itself rather than trusting the cached one.
+    if schema_version(conn) < 9 or conn.execute("SELECT MAX(horizon) FROM archive_runs").fetchone()[0] is None:
+        return "transactions"
+    if 'archive' not in {row[1] for row in conn.execute("PRAGMA database_list")}:
+        raise sqlite3.OperationalError(
+            f"{archive_path()} is not attached; call clear_cache() after archiving from another process"
+        )
+    return f"""(SELECT {_HISTORY_COLUMNS} FROM main.transactions
+               UNION ALL SELECT {_HISTORY_COLUMNS} FROM archive.transactions)"""
+
+def _sync_archive_schema(conn):
+    # The archive tables have the columns of the main ones, without their
+    # foreign keys and triggers; columns added to the main tables since the
+    # last run are added here too
+    for table in _ARCHIVE_TABLES:
+        columns = conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+        existing = {row['name'] for row in conn.execute(f"PRAGMA archive.table_info({table})")}
+        if not existing:
+            key = ', '.join(row['name'] for row in sorted(columns, key=lambda row: row['pk']) if row['pk'])
+            definitions = ', '.join(f"{row['name']} {row['type']}" for row in columns)
+            conn.execute(f"CREATE TABLE archive.{table} ({definitions}, PRIMARY KEY ({key}))")
+            continue
+        for row in columns:
+            if row['name'] not in existing:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {row['name']} {row['type']}")
+    _run_script(conn, _ARCHIVE_INDEXES)
+
+def _months_before(day, months):
+    index = day.year * 12 + day.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+def archive_transactions(before=None, months=ARCHIVE_AFTER_MONTHS):
+    # Moves every transaction dated before the horizon into the archive and
+    # returns how many moved. The horizon is before rounded down to the first
+    # of its month, or by default the first of the month `months` back.
+    horizon = (_as_date(before) if before else _months_before(date.today(), months)).replace(day=1)
+    current = archive_horizon()
+    if current and horizon < current:
+        raise ValueError(f"transactions before {current} are already archived")
+
+    path = archive_path()
+    if not os.path.exists(path):
+        # journal_mode cannot change inside a transaction, so switch the new
+        # file to WAL before it is attached
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.close()
+    pool = get_pool()
+    pool.attach('archive', path)
+
+    cutoff = horizon.isoformat()
+    with get_db() as conn:
+        _sync_archive_schema(conn)
+        columns = ', '.join(row['name'] for row in conn.execute("PRAGMA main.table_info(transactions)"))
+        moved = conn.execute(f"""
+            INSERT OR REPLACE INTO archive.transactions ({columns})
+            SELECT {columns} FROM main.transactions WHERE txn_date < ?
+        """, (cutoff,)).rowcount
+        conn.execute("""
+            INSERT OR REPLACE INTO archive.transaction_tags (transaction_id, tag_id)
+            SELECT x.transaction_id, x.tag_id
+            FROM main.transaction_tags x
+            JOIN main.transactions t ON t.transaction_id = x.transaction_id
+            WHERE t.txn_date < ?
+        """, (cutoff,))
+        conn.execute("COMMIT")
+
+        conn.execute("BEGIN IMMEDIATE")
+        # The delete triggers take the moved rows out of the rollups and
+        # balance checkpoints, which have to keep covering archived months
+        for table in _KEPT_ROLLUPS:
+            conn.execute(f"CREATE TEMP TABLE kept_{table} AS SELECT * FROM main.{table} WHERE month < ?",
+                         (horizon.strftime('%Y-%m'),))
+        # Rows another process added since the copy committed stay
+        conn.execute("""
+            DELETE FROM main.transactions
+            WHERE txn_date < ? AND transaction_id IN (SELECT transaction_id FROM archive.transactions)
+        """, (cutoff,))
+        for table in _KEPT_ROLLUPS:
+            conn.execute(f"INSERT OR REPLACE INTO main.{table} SELECT * FROM temp.kept_{table}")
+            conn.execute(f"DROP TABLE temp.kept_{table}")
+        conn.execute("INSERT INTO archive_runs (horizon, archived) VALUES (?, ?)", (cutoff, moved))
+        pool.after_commit(clear_cache)
+    return moved
+
+# Columnar fetch
+#
+# DataFrame and NumPy variants of the read API. Rows come off a plain tuple
+# cursor in large batches and are converted a column at a time, so no
+# sqlite3.Row or dict is built per row. numpy and pandas are imported on
+# first use; the rest of this module does not need them.
+FETCH_ARRAYSIZE = 10000
+
+_DATETIME_COLUMNS = {'txn_date', 'created_at', 'updated_at', 'day', 'start_date', 'end_date'}
+_FLOAT_COLUMNS = {'amount', 'balance', 'total', 'income', 'expense', 'net'}
+_INTEGER_COLUMNS = {'is_active', 'is_recurring', 'txn_count'}
+_CATEGORY_COLUMNS = {'txn_type', 'type', 'kind', 'currency', 'account_name', 'category_name', 'merchant_name'}
+
+def _column_array(name, values):
+    import numpy as np
+
+    if name in _DATETIME_COLUMNS:
+        return np.array(values, dtype='datetime64[s]')
+    if name in _FLOAT_COLUMNS:
+        return np.array(values, dtype='float64')
+    if name.endswith('_id') or name in _INTEGER_COLUMNS:
+        if None in values:
+            return np.array(values, dtype='float64')
+        return np.array(values, dtype='int64')
+    return np.array(values, dtype=object)
+
+def _fetch_columns(query, params=(), analytics=False):
+    import numpy as np
+
+    with (analytics_db() if analytics else get_db(readonly=True)) as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.arraysize = FETCH_ARRAYSIZE
+        cursor.execute(query, params)
+        names = [column[0] for column in cursor.description]
+        chunks = [[] for _ in names]
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for name, chunk, values in zip(names, chunks, zip(*rows)):
+                chunk.append(_column_array(name, values))
+
+    columns = {}
+    for name, chunk in zip(names, chunks):
+        if not chunk:
+            columns[name] = _column_array(name, ())
+        elif len(chunk) == 1:
+            columns[name] = chunk[0]
+        else:
+            # Chunks of an id column may disagree on int64 vs float64
+            columns[name] = np.concatenate(chunk)
+    return columns
+
+def fetch_arrays(query, params=(), analytics=False):
+    return _fetch_columns(query, params, analytics)
+
+def fetch_frame(query, params=(), analytics=False):
+    import pandas as pd
+
+    columns = _fetch_columns(query, params, analytics)
+    data = {}
+    for name, values in columns.items():
+        if name in _CATEGORY_COLUMNS:
+            data[name] = pd.Categorical(values)
+        elif values.dtype.kind == 'f' and (name.endswith('_id') or name in _INTEGER_COLUMNS):
+            data[name] = pd.array(values, dtype='Int64')
+        else:
+            data[name] = values
+    return pd.DataFrame(data, columns=list(columns))
+
+def _fetch(query_and_params, as_arrays, analytics=False):
+    query, params = query_and_params
+    return fetch_arrays(query, params, analytics) if as_arrays else fetch_frame(query, params, analytics)
+
+def get_transactions_frame(user_id, filters=None, limit=None, as_arrays=False):
+    return _fetch(_transactions_query(user_id, filters, limit=limit), as_arrays)
+
+@cached
+def get_accounts_frame(user_id, as_arrays=False):
+    return _fetch(_accounts_query(user_id), as_arrays)
+
+@cached
+@reads_snapshot
+def get_spending_by_category_frame(user_id, start_date=None, end_date=None, as_arrays=False):
+    return _fetch(_spending_by_category_query(user_id, start_date, end_date), as_arrays, analytics=True)
+
+@cached
+@reads_snapshot
+def get_period_summaries_frame(user_id, start_date=None, end_date=None, granularity='month',
+                               as_arrays=False):
+    return _fetch(_period_summary_query(user_id, start_date, end_date, granularity), as_arrays, analytics=True)
+
+@cached
+@reads_snapshot
+def get_daily_spending_frame(user_id, start_date, end_date, as_arrays=False):
+    return _fetch(_daily_spending_query(user_id, start_date, end_date), as_arrays, analytics=True)
+
+@cached
+@reads_snapshot
+def get_balance_history_frame(user_id, account_id, start_date=None, end_date=None, granularity='day',
+                              as_arrays=False):
+    return _fetch(_balance_history_query(user_id, account_id, start_date, end_date, granularity), as_arrays, analytics=True)
+
+@cached
+@reads_snapshot
+def get_spending_by_tag_frame(user_id, start_date=None, end_date=None, as_arrays=False):
+    return _fetch(_spending_by_tag_query(user_id, start_date, end_date), as_arrays, analytics=True)
+
+@cached
+@reads_snapshot
+def get_top_merchants_frame(user_id, start_date=None, end_date=None, limit=10, as_arrays=False):
+    return _fetch(_top_merchants_query(user_id, start_date, end_date, limit), as_arrays, analytics=True)
+
+# Export
+#
+# Full history downloads without holding the history in memory: rows come
+# off a plain tuple cursor EXPORT_CHUNK_SIZE at a time, oldest first, and
+# each chunk is written out (as CSV lines or one Parquet row group) before
+# the next is fetched. The export reads one snapshot, holding its reader
+# connection until it finishes. Columns are named so an exported CSV can be
+# imported again. pyarrow is needed for Parquet only and is imported on
+# first use.
+EXPORT_CHUNK_SIZE = 10000
+EXPORT_FORMATS = ('csv', 'parquet')
+
+_EXPORT_COLUMNS = {
+    'transaction_id': "t.transaction_id",
+    'txn_date': "substr(t.txn_date, 1, 10)",
+    'txn_type': "t.txn_type",
+    'amount': "t.amount / 100.0",
+    'currency': "t.currency",
+    'account': "a.name",
+    'category': "c.name",
+    'merchant': "m.name",
+    'description': "t.description",
+    'notes': "t.notes",
+}
+
+def _export_query(user_id, filters):
+    conditions, params = _transaction_filters(user_id, filters)
+    columns = ', '.join(f"{sql} AS {name}" for name, sql in _EXPORT_COLUMNS.items())
+    start_date = (filters or {}).get('start_date')
+    if _reads_archive(start_date):
+        # The ORDER BY of a UNION can only name result columns, so the sort
+        # keys come along at the end; iter_transaction_chunks drops them
+        columns += ", t.txn_date, t.created_at"
+    query, params = _with_archive(f"""
+        SELECT {columns}
+        FROM transactions t
+        LEFT JOIN accounts a ON t.account_id = a.account_id
+        LEFT JOIN categories c ON t.category_id = c.category_id
+        LEFT JOIN merchants m ON t.merchant_id = m.merchant_id
+        WHERE {" AND ".join(conditions)}
+    """, params, start_date)
+    return query + " ORDER BY t.txn_date, t.created_at, t.transaction_id", params
+
+def iter_transaction_chunks(user_id, filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    # Yields lists of up to chunk_size row tuples, in _EXPORT_COLUMNS order
+    query, params = _export_query(user_id, filters)
+    with get_db(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.arraysize = chunk_size
+        cursor.execute(query, params)
+        width = len(_EXPORT_COLUMNS)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            if len(rows[0]) > width:
+                rows = [row[:width] for row in rows]
+            yield rows
+
+def _write_csv(fileobj, chunks):
+    stream = io.TextIOWrapper(fileobj, encoding='utf-8', newline='')
+    writer = csv.writer(stream)
+    writer.writerow(_EXPORT_COLUMNS)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    stream.flush()
+    # Leave the caller's file open
+    stream.detach()
+    return count
+
+def _write_parquet(fileobj, chunks):
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'transaction_id': pa.int64(), 'txn_date': pa.date32(), 'amount': pa.float64()}
+    schema = pa.schema([(name, types.get(name, pa.string())) for name in _EXPORT_COLUMNS])
+    count = 0
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            arrays = []
+            for field, values in zip(schema, columns):
+                if field.name == 'txn_date':
+                    values = np.array(values, dtype='datetime64[D]')
+                arrays.append(pa.array(values, type=field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+def export_transactions(user_id, target, format='csv', filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    # Writes the user's transactions matching filters (as for
+    # query_transactions) to target, a path or a binary file object, and
+    # returns the number of rows written
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, 'wb') as f:
+            return export_transactions(user_id, f, format, filters, chunk_size)
+
+    chunks = iter_transaction_chunks(user_id, filters, chunk_size)
+    if format == 'parquet':
+        return _write_parquet(target, chunks)
+    return _write_csv(target, chunks)
+
+# Budget operations
+_BUDGET_COLUMNS = """
+    budget_id, user_id, name, period, start_date, end_date, amount / 100.0 AS amount,
+    currency, is_active, created_at, updated_at
+"""
+
+@cached
+def get_budgets(user_id):
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute(
+            f"SELECT {_BUDGET_COLUMNS} FROM budgets WHERE user_id = ? ORDER BY name",
+            (user_id,)
+        )
+        return cursor.fetchall()
+
+@cached
+def get_budget_items(user_id, budget_id):
+    with get_db(readonly=True) as conn:
+        cursor = conn.execute("""
+            SELECT i.budget_item_id, i.budget_id, i.category_id, i.tag_id, i.amount / 100.0 AS amount,
+                   c.name AS category_name, g.name AS tag_name
+            FROM budget_items i
+            JOIN budgets b ON i.budget_id = b.budget_id
+            LEFT JOIN categories c ON i.category_id = c.category_id
+            LEFT JOIN tags g ON i.tag_id = g.tag_id
+            WHERE b.user_id = ? AND i.budget_id = ?
+            ORDER BY i.budget_item_id
+        """, (user_id, budget_id))
+        return cursor.fetchall()
+
+def add_budget(user_id, name, amount, period='monthly', start_date=None, end_date=None,
+               items=None, currency=None):
+    # items: dicts with an amount and either a category_id or a tag_id.
+    # Amounts are in currency, by default the user's base currency.
+    start_date = _as_date(start_date) if start_date else date.today()
+    with get_db() as conn:
+        cursor = conn.execute("""
+            INSERT INTO budgets (user_id, name, period, start_date, end_date, amount, currency)
+            VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, (SELECT base_currency FROM users WHERE user_id = ?), ?))
+        """, (user_id, name, period, start_date.isoformat(),
+              _as_date(end_date).isoformat() if end_date else None, to_paise(amount),
+              _currency_code(currency) if currency else None, user_id, BASE_CURRENCY))
+        budget_id = cursor.lastrowid
+        for item in items or ():
+            if (item.get('category_id') is None) == (item.get('tag_id') is None):
+                raise ValueError("a budget item needs exactly one of category_id or tag_id")
+            conn.execute(
+                "INSERT INTO budget_items (budget_id, category_id, tag_id, amount) VALUES (?, ?, ?, ?)",
+                (budget_id, item.get('category_id'), item.get('tag_id'), to_paise(item['amount']))
+            )
+        _invalidate(user_id)
+        return budget_id
+
+def delete_budget(budget_id, user_id):
+    with get_db() as conn:
+        cursor = conn.execute(
+            "DELETE FROM budgets WHERE budget_id = ? AND user_id = ?",
+            (budget_id, user_id)
+        )
+        _invalidate(user_id)
+        return cursor.rowcount > 0
+
+# Budget engine
+#
+# Every active budget is expanded into its period windows with NumPy, and
+# actual spend comes from one grouped query: expenses per day per category,
+# plus per day per tag for the tags that budget items use. Those daily totals
+# become a prefix-sum matrix (one row per category or tag, one column per
+# day), so the spend of any window is two lookups: cum[key, end] -
+# cum[key, start]. Windows follow the calendar (weeks start on Monday) and are
+# clipped to the budget's start and end dates; the current window runs to
+# as_of. A budget without items counts all expenses; one with items counts
+# the sum of its items, so a transaction matching two items counts twice.
+# Spend is in the user's base currency, as budget amounts are.
+_BUDGET_STEPS = {
+    'daily': ('D', 1),
+    'weekly': ('W', 7),
+    'monthly': ('M', 1),
+    'quarterly': ('M', 3),
+    'yearly': ('Y', 1),
+}
+
+def _budget_windows(period, start, end):
+    # Half-open [start, end) windows as datetime64[D] arrays
+    import numpy as np
+
+    if period == 'custom':
+        return np.array([start]), np.array([end])
+    unit, step = _BUDGET_STEPS[period]
+    if unit == 'D':
+        starts = np.arange(start, end)
+        ends = starts + 1
+    elif unit == 'W':
+        # Day 0 of the epoch is a Thursday
+        monday = start - (start.astype('int64') + 3) % 7
+        starts = np.arange(monday, end, step)
+        ends = starts + step
+    else:
+        first = start.astype(f'datetime64[{unit}]')
+        if step > 1:
+            first -= first.astype('int64') % step
+        units = np.arange(first, (end - 1).astype(f'datetime64[{unit}]') + 1, step)
+        starts = units.astype('datetime64[D]')
+        ends = (units + step).astype('datetime64[D]')
+    return np.maximum(starts, start), np.minimum(ends, end)
+
+@cached
+@reads_snapshot
+def _budget_report(user_id, as_of, current_only, as_arrays):
+    import numpy as np
+
+    base = _base_sql(user_id)
+    horizon = archive_horizon()
+    with analytics_db() as conn:
+        budgets = conn.execute("""
+            SELECT budget_id, name, period, start_date, end_date, amount
+            FROM budgets
+            WHERE user_id = ? AND is_active = 1 AND start_date <= ?
+            ORDER BY name, budget_id
+        """, (user_id, as_of.isoformat())).fetchall()
+        items = conn.execute("""
+            SELECT i.budget_item_id, i.budget_id, i.category_id, i.tag_id, i.amount,
+                   COALESCE(c.name, '#' || g.name) AS item_name
+            FROM budget_items i
+            JOIN budgets b ON i.budget_id = b.budget_id
+            LEFT JOIN categories c ON i.category_id = c.category_id
+            LEFT JOIN tags g ON i.tag_id = g.tag_id
+            WHERE b.user_id = ? AND b.is_active = 1
+            ORDER BY i.budget_item_id
+        """, (user_id,)).fetchall()
+
+        # Each budget's span, half-open and cut off after as_of
+        end_limit = np.datetime64(as_of) + 1
+        spans = {}
+        for budget in budgets:
+            start = np.datetime64(budget['start_date'][:10], 'D')
+            end = end_limit
+            if budget['end_date']:
+                end = min(end, np.datetime64(budget['end_date'][:10], 'D') + 1)
+            if end > start:
+                spans[budget['budget_id']] = (start, end)
+        origin = min((start for start, _ in spans.values()), default=end_limit - 1)
+
+        spend = []
+        if spans:
+            tag_ids = sorted({item['tag_id'] for item in items if item['tag_id'] is not None})
+            tag_part = ""
+            if tag_ids:
+                tag_part = f"""
+                    UNION ALL
+                    SELECT 1, g.tag_id, substr(t.txn_date, 1, 10), SUM({_base_amount('t.', base)})
+                    FROM transactions t
+                    JOIN transaction_tags g ON g.transaction_id = t.transaction_id
+                    WHERE t.user_id = :user_id AND t.txn_type = 'expense'
+                      AND t.txn_date >= :start AND t.txn_date < :end
+                      AND g.tag_id IN ({', '.join(str(int(i)) for i in tag_ids)})
+                    GROUP BY t.txn_date, g.tag_id
+                """
+            spend_query = f"""
+                SELECT 0, COALESCE(category_id, 0), substr(txn_date, 1, 10),
+                       SUM({_base_amount('transactions.', base)})
+                FROM transactions
+                WHERE user_id = :user_id AND txn_type = 'expense'
+                  AND txn_date >= :start AND txn_date < :end
+                GROUP BY txn_date, COALESCE(category_id, 0)
+                {tag_part}
+            """
+            # A day and key can come back from both files; np.add.at below
+            # adds them up
+            if horizon and origin < np.datetime64(horizon):
+                spend_query += " UNION ALL " + _archive_sql(spend_query)
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.arraysize = FETCH_ARRAYSIZE
+            spend = cursor.execute(spend_query, {
+                'user_id': user_id, 'start': str(origin), 'end': str(end_limit)
+            }).fetchall()
+
+    # Prefix sums of daily spend; row 0 is all expenses, then one row per
+    # category and per tag
+    if spend:
+        kinds, key_ids, days, totals = (np.array(column) for column in zip(*spend))
+        days = days.astype('datetime64[D]')
+    else:
+        kinds = key_ids = totals = np.zeros(0, dtype='int64')
+        days = np.zeros(0, dtype='datetime64[D]')
+    ndays = int((end_limit - origin).astype('int64'))
+    keys = {('all', 0): 0}
+    for kind, key_id in set(zip(kinds.tolist(), key_ids.tolist())):
+        keys[('tag' if kind else 'category', key_id)] = len(keys)
+    daily = np.zeros((len(keys), ndays + 1), dtype='int64')
+    day_index = (days - origin).astype('int64') + 1
+    rows = np.array([keys['tag' if k else 'category', i] for k, i in zip(kinds.tolist(), key_ids.tolist())],
+                    dtype='int64')
+    np.add.at(daily, (rows, day_index), totals.astype('int64'))
+    # Tag rows would double count in the all-expenses row
+    np.add.at(daily, (np.zeros_like(rows), day_index), np.where(kinds == 0, totals, 0).astype('int64'))
+    cumulative = daily.cumsum(axis=1)
+
+    items_by_budget = {}
+    for item in items:
+        items_by_budget.setdefault(item['budget_id'], []).append(item)
+
+    # One output row per window for the budget total, then per item
+    columns = {name: [] for name in (
+        'budget_id', 'budget_name', 'period', 'budget_item_id', 'category_id', 'tag_id', 'item_name',
+        'window_start', 'window_end', 'budgeted', 'actual'
+    )}
+    for budget in budgets:
+        if budget['budget_id'] not in spans:
+            continue
+        starts, ends = _budget_windows(budget['period'], *spans[budget['budget_id']])
+        if current_only:
+            starts, ends = starts[-1:], ends[-1:]
+        first = (starts - origin).astype('int64')
+        last = (ends - origin).astype('int64')
+
+        budget_items = items_by_budget.get(budget['budget_id'], [])
+        item_actuals = []
+        for item in budget_items:
+            if item['tag_id'] is not None:
+                row = keys.get(('tag', item['tag_id']))
+            else:
+                row = keys.get(('category', item['category_id']))
+            if row is None:
+                actual = np.zeros(len(starts), dtype='int64')
+            else:
+                actual = cumulative[row, last] - cumulative[row, first]
+            item_actuals.append((item, actual))
+        if budget_items:
+            total_actual = np.sum([actual for _, actual in item_actuals], axis=0)
+        else:
+            total_actual = cumulative[0, last] - cumulative[0, first]
+
+        count = len(starts)
+        entries = [(None, budget['amount'], total_actual)]
+        entries += [(item, item['amount'], actual) for item, actual in item_actuals]
+        for item, budgeted, actual in entries:
+            columns['budget_id'].append(np.full(count, budget['budget_id'], dtype='int64'))
+            columns['budget_name'].append(np.full(count, budget['name'], dtype=object))
+            columns['period'].append(np.full(count, budget['period'], dtype=object))
+            for name in ('budget_item_id', 'category_id', 'tag_id'):
+                value = item[name] if item is not None and item[name] is not None else np.nan
+                columns[name].append(np.full(count, value, dtype='float64'))
+            columns['item_name'].append(np.full(count, item['item_name'] if item is not None else None, dtype=object))
+            columns['window_start'].append(starts)
+            columns['window_end'].append(ends - 1)
+            columns['budgeted'].append(np.full(count, budgeted, dtype='int64'))
+            columns['actual'].append(np.asarray(actual, dtype='int64'))
+
+    arrays = {}
+    for name, chunks in columns.items():
+        if chunks:
+            arrays[name] = np.concatenate(chunks)
+        else:
+            arrays[name] = np.zeros(0, dtype='datetime64[D]' if name.startswith('window') else 'float64')
+    budgeted, actual = arrays.pop('budgeted'), arrays.pop('actual')
+    arrays['budgeted'] = budgeted / 100
+    arrays['actual'] = actual / 100
+    arrays['remaining'] = (budgeted - actual) / 100
+    arrays['utilization'] = np.where(budgeted > 0, actual / np.maximum(budgeted, 1), np.nan)
+    arrays['overspent'] = actual > budgeted
+    arrays['is_current'] = arrays['window_end'] >= np.datetime64(as_of)
+
+    if as_arrays:
+        return arrays
+
+    import pandas as pd
+
+    data = dict(arrays)
+    for name in ('budget_item_id', 'category_id', 'tag_id'):
+        data[name] = pd.array(arrays[name], dtype='Int64')
+    for name in ('budget_name', 'period'):
+        data[name] = pd.Categorical(arrays[name])
+    return pd.DataFrame(data)
+
+def get_budget_report(user_id, as_of=None, current_only=False, as_arrays=False):
+    # Budget vs actual for every window of every active budget up to as_of
+    # (default today), with one row for each budget's total and one per item.
+    # Amounts are in rupees; utilization is actual / budgeted.
+    as_of = _as_date(as_of) if as_of else date.today()
+    return _budget_report(user_id, as_of, current_only, as_arrays)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Expense Tracker database maintenance")
+    parser.add_argument('--db', default=DB_NAME, help="database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help="apply pending schema migrations")
+    commands.add_parser('seed', help="create the sample test user and data")
+    commands.add_parser('rebuild-rollups', help="recompute the monthly rollup tables")
+    commands.add_parser('check-rollups', help="compare the rollups against raw transactions")
+    reconcile = commands.add_parser('reconcile-balances',
+                                    help="compare account balances against their checkpoints")
+    reconcile.add_argument('--fix', action='store_true', help="reset drifted balances")
+    fx = commands.add_parser('load-fx-rates', help="load daily exchange rates from a CSV file")
+    fx.add_argument('path', help="CSV with date, from, to and rate columns")
+    archive = commands.add_parser('archive', help="move old transactions into the archive file")
+    archive.add_argument('--months', type=int, default=ARCHIVE_AFTER_MONTHS,
+                         help="keep this many months before the current one (default: %(default)s)")
+    archive.add_argument('--before', help="archive transactions before this month instead (YYYY-MM)")
+    rules = commands.add_parser('apply-rules', help="categorize transactions with each user's rules")
+    rules.add_argument('--scope', choices=RULE_SCOPES, default='uncategorized',
+                       help="fill in missing values only, or overwrite wherever a rule matches (default: %(default)s)")
+    rules.add_argument('--dry-run', action='store_true', help="count the changes without writing them")
+    duplicates = commands.add_parser('find-duplicates', help="list transactions that repeat an earlier one")
+    duplicates.add_argument('--window', type=int, default=0,
+                            help="also match the same amount within this many days (default: %(default)s)")
+    args = parser.parse_args()
+
+    DB_NAME = args.db
+    if args.command == 'migrate':
+        print(f"{DB_NAME}: schema version {init_db()}")
+    elif args.command == 'seed':
+        seed_sample_data()
+        print(f"{DB_NAME}: sample data ready")
+    elif args.command == 'rebuild-rollups':
+        init_db()
+        rebuild_rollups()
+        print(f"{DB_NAME}: rollups rebuilt")
+    elif args.command == 'check-rollups':
+        init_db()
+        mismatches = check_rollups()
+        for row in mismatches:
+            print(dict(row))
+        print(f"{DB_NAME}: {len(mismatches)} mismatched rollup rows")
+        raise SystemExit(1 if mismatches else 0)
+    elif args.command == 'reconcile-balances':
+        init_db()
+        drifted = reconcile_balances(fix=args.fix)
+        for row in drifted:
+            print(dict(row))
+        print(f"{DB_NAME}: {len(drifted)} accounts drifted{' (fixed)' if args.fix and drifted else ''}")
+        raise SystemExit(1 if drifted and not args.fix else 0)
+    elif args.command == 'load-fx-rates':
+        init_db()
+        print(f"{DB_NAME}: {load_fx_rates(args.path)} rates loaded")
+    elif args.command == 'archive':
+        init_db()
+        before = f"{args.before}-01" if args.before else None
+        moved = archive_transactions(before, args.months)
+        print(f"{DB_NAME}: {moved} transactions before {archive_horizon()} moved to {archive_path()}")
+    elif args.command == 'apply-rules':
+        init_db()
+        for user in get_users():
+            result = apply_rules(user['user_id'], args.scope, args.dry_run)
+            if result['matched']:
+                print(f"{user['email']}: {result['matched']} of {result['scanned']} matched, "
+                      f"{result['updated']} {'to update' if args.dry_run else 'updated'}")
+    elif args.command == 'find-duplicates':
+        init_db()
+        total = 0
+        for user in get_users():
+            for row in get_duplicates(user['user_id'], args.window):
+                print(f"{user['email']}: {row['match']} #{row['transaction_id']} of #{row['duplicate_of']} "
+                      f"{row['txn_date']} {row['amount']:.2f} {row['description'] or ''}")
+                total += 1
+        print(f"{DB_NAME}: {total} duplicate transactions")
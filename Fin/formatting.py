@@ -0,0 +1,83 @@
+import numpy as np
+
+CURRENCY_SYMBOL = "₹"
+# Other currencies show their ISO code instead of a symbol
+CURRENCY_SYMBOLS = {'INR': CURRENCY_SYMBOL, 'USD': "$", 'EUR': "€", 'GBP': "£", 'JPY': "¥"}
+
+# Lookup tables for building amounts a digit group at a time: the leading
+# group has no padding, every later group is zero-padded behind a comma
+_LEADING = np.array([str(i) for i in range(1000)], dtype=object)
+_GROUPS = np.array([f",{i:03d}" for i in range(1000)], dtype=object)
+_CENTS = np.array([f".{i:02d}" for i in range(100)], dtype=object)
+
+# Amounts this large (or infinite) do not fit int64 paise; they are formatted
+# one by one instead of through the digit groups
+_MAX_AMOUNT = 1e16
+_MAX_GROUPS = 6
+
+def _symbol(currency):
+    return CURRENCY_SYMBOLS.get(currency, f"{currency} ")
+
+def _format_paise(paise, negative, currency, large=None):
+    # large: (mask, texts) for rows formatted outside the digit groups
+    whole, cents = np.divmod(np.abs(paise), 100)
+    groups = []
+    for _ in range(_MAX_GROUPS):
+        whole, group = np.divmod(whole, 1000)
+        groups.append(group)
+        if not whole.any():
+            break
+
+    # Walk from the most significant group down; a group is the leading
+    # one for the rows whose higher groups are all zero
+    text = np.full(paise.shape, "", dtype=object)
+    started = np.zeros(paise.shape, dtype=bool)
+    for i in range(len(groups) - 1, -1, -1):
+        group = groups[i]
+        leading = ~started & ((group > 0) | (i == 0))
+        text[leading] = _LEADING[group[leading]]
+        text[started] = text[started] + _GROUPS[group[started]]
+        started |= leading
+    text = text + _CENTS[cents]
+    if large is not None:
+        text[large[0]] = large[1]
+
+    if currency.ndim == 0:
+        symbol = _symbol(str(currency))
+        sign = np.where(negative, "-" + symbol, symbol).astype(object)
+    else:
+        # One lookup per distinct currency
+        codes, index = np.unique(currency.astype(str), return_inverse=True)
+        symbols = np.array([_symbol(code) for code in codes], dtype=object)[index.reshape(currency.shape)]
+        sign = np.where(negative, "-", "").astype(object) + symbols
+    return sign + text
+
+def format_currency(amount, negative=False, currency='INR'):
+    # Formats one amount or a whole column at once. negative marks rows to
+    # show with a minus sign (e.g. expenses) on top of the amount's own sign,
+    # and currency is one code for all rows or one per row.
+    # Scalars give a str; arrays and Series give the same shape of strings.
+    # NaN shows as zero; infinite and huge amounts keep their sign.
+    values = np.asarray(amount, dtype='float64')
+    large = np.abs(np.nan_to_num(values, nan=0.0, posinf=np.inf, neginf=-np.inf)) >= _MAX_AMOUNT
+    paise = np.rint(np.where(large, 0.0, np.nan_to_num(values)) * 100).astype('int64')
+    signed = np.where(large, values, paise)
+    flags = (signed < 0) ^ np.asarray(negative, dtype=bool)
+    flags = flags & (signed != 0)
+    currency = np.asarray(currency, dtype=object)
+    if currency.ndim:
+        currency = np.atleast_1d(np.broadcast_to(currency, values.shape))
+    large = np.atleast_1d(large)
+    texts = [("∞" if np.isinf(value) else f"{abs(value):,.2f}") for value in np.atleast_1d(values)[large]]
+    result = _format_paise(np.atleast_1d(paise), np.atleast_1d(flags), currency,
+                           (large, texts) if texts else None)
+
+    if values.ndim == 0:
+        return result[0]
+    try:
+        import pandas as pd
+    except ImportError:
+        return result.reshape(values.shape)
+    if isinstance(amount, pd.Series):
+        return pd.Series(result, index=amount.index, name=amount.name)
+    return result.reshape(values.shape)
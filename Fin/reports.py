@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import database as db
+from formatting import format_currency
+
+# Month-end statements, without the Streamlit app
+#
+# Each statement has the month's income and expenses, spending by category,
+# top merchants and every account's closing balance. Users are sharded across
+# a pool of worker processes; each worker reads through its own single
+# connection and writes one file per user.
+#
+#     python reports.py --month 2025-12 --output reports
+#     python reports.py --db /tmp/synth.db --workers 4 --format json
+REPORT_FORMATS = ('text', 'json')
+TOP_MERCHANTS = 10
+
+def month_range(month):
+    # 'YYYY-MM' to its first and last day
+    first = date.fromisoformat(f"{month}-01")
+    return first, (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+
+def previous_month(today=None):
+    today = today or date.today()
+    return (today.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+
+def build_statement(user, month):
+    user_id = user['user_id']
+    first, last = month_range(month)
+    base = user['base_currency']
+    totals = {row['txn_type']: row['total'] for row in db.get_monthly_summary(user_id, first.year, first.month)}
+    accounts = [dict(row) for row in db.get_account_balances(user_id, last)]
+    total_balance = db.convert_amounts(
+        [a['balance'] for a in accounts], [a['currency'] for a in accounts], base, last
+    ).sum() if accounts else 0.0
+
+    return {
+        'user_id': user_id,
+        'email': user['email'],
+        'name': user['full_name'],
+        'month': month,
+        'currency': base,
+        'income': totals.get('income', 0.0),
+        'expense': totals.get('expense', 0.0),
+        'net': totals.get('income', 0.0) - totals.get('expense', 0.0),
+        'categories': [dict(row) for row in db.get_spending_by_category(user_id, first, last)],
+        'merchants': [dict(row) for row in db.get_top_merchants(user_id, first, last, TOP_MERCHANTS)],
+        'accounts': [{k: a[k] for k in ('name', 'type', 'currency', 'balance')} for a in accounts],
+        'total_balance': float(total_balance),
+    }
+
+def render_text(statement):
+    base = statement['currency']
+    lines = [
+        f"Statement for {statement['name']} <{statement['email']}>",
+        f"Month: {statement['month']}    Currency: {base}",
+        "",
+        "Summary",
+    ]
+    for label, key in (("Income", 'income'), ("Expenses", 'expense'), ("Net", 'net')):
+        lines.append(f"  {label:<32}{format_currency(statement[key], currency=base):>18}")
+
+    lines += ["", "Spending by category"]
+    lines += [f"  {row['name']:<32}{format_currency(row['total'], currency=base):>18}"
+              for row in statement['categories']] or ["  (none)"]
+
+    lines += ["", "Top merchants"]
+    lines += [f"  {row['name']:<32}{format_currency(row['total'], currency=base):>18}"
+              for row in statement['merchants']] or ["  (none)"]
+
+    lines += ["", f"Account balances on {month_range(statement['month'])[1]}"]
+    lines += [f"  {row['name']:<32}{format_currency(row['balance'], currency=row['currency']):>18}"
+              for row in statement['accounts']] or ["  (none)"]
+    lines.append(f"  {'Total':<32}{format_currency(statement['total_balance'], currency=base):>18}")
+    return "\n".join(lines) + "\n"
+
+def _start_worker(path):
+    # Runs once in each worker process: one reader connection, and no read
+    # cache since every query is asked once
+    db.DB_NAME = path
+    db.CACHE_ENABLED = False
+    db.configure_pool(size=1)
+
+def _write_shard(users, month, output_dir, report_format):
+    started = time.perf_counter()
+    for user in users:
+        statement = build_statement(user, month)
+        path = os.path.join(output_dir, f"user-{user['user_id']}.{'txt' if report_format == 'text' else 'json'}")
+        with open(path, 'w', encoding='utf-8') as f:
+            if report_format == 'json':
+                json.dump(statement, f, indent=2)
+            else:
+                f.write(render_text(statement))
+    return os.getpid(), len(users), time.perf_counter() - started
+
+def generate_reports(path, month, output_dir, workers=None, report_format='text'):
+    # Returns timings: wall-clock seconds and (pid, users, busy seconds) per
+    # shard
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(REPORT_FORMATS)}")
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+
+    db.DB_NAME = path
+    db.init_db()
+    users = [dict(row) for row in db.get_users()]
+    # Connections must not be inherited by forked workers
+    db.close_pools()
+
+    month_dir = os.path.join(output_dir, month)
+    os.makedirs(month_dir, exist_ok=True)
+    shards = [users[i::workers] for i in range(workers) if users[i::workers]]
+    with ProcessPoolExecutor(max_workers=len(shards) or 1, initializer=_start_worker,
+                             initargs=(os.path.abspath(path),)) as pool:
+        futures = [pool.submit(_write_shard, shard, month, month_dir, report_format) for shard in shards]
+        results = [future.result() for future in futures]
+
+    return {
+        'users': len(users),
+        'workers': len(shards),
+        'output': month_dir,
+        'seconds': time.perf_counter() - started,
+        'shards': results,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write month-end statements for every user")
+    parser.add_argument('--db', default=db.DB_NAME, help="database file (default: %(default)s)")
+    parser.add_argument('--month', default=previous_month(), help="YYYY-MM (default: last month, %(default)s)")
+    parser.add_argument('--output', default='reports', help="directory for the reports (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="worker processes (default: one per core, %(default)s)")
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='text')
+    args = parser.parse_args()
+
+    try:
+        month_range(args.month)
+    except ValueError:
+        parser.error(f"--month must be YYYY-MM, got {args.month!r}")
+
+    timing = generate_reports(args.db, args.month, args.output, args.workers, args.format)
+    for pid, count, busy in timing['shards']:
+        print(f"worker {pid}: {count:,} users in {busy:.2f}s")
+    busy = sum(shard[2] for shard in timing['shards'])
+    print(f"{timing['users']:,} statements for {args.month} in {timing['output']}: "
+          f"{timing['seconds']:.2f}s with {timing['workers']} workers, "
+          f"{timing['users'] / timing['seconds']:,.0f} users/s "
+          f"(busy {busy:.2f}s, {busy / timing['seconds']:.1f}x parallel)")
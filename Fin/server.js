@@ -45,6 +45,26 @@ function dbRun(query, params = []) {
   });
 }
 
+// Money is stored as integer paise; the API takes and returns rupees
+function toPaise(amount) {
+  return Math.round(Number(amount) * 100);
+}
+
+function toRupees(paise) {
+  return paise / 100;
+}
+
+const ACCOUNT_COLUMNS = `
+  account_id, user_id, name, type, balance / 100.0 AS balance, currency, is_active, created_at,
+  opening_balance / 100.0 AS opening_balance
+`;
+
+const TRANSACTION_COLUMNS = `
+  t.transaction_id, t.user_id, t.account_id, t.category_id, t.merchant_id, t.txn_type,
+  t.amount / 100.0 AS amount, t.currency, t.txn_date, t.description, t.notes,
+  t.is_recurring, t.created_at, t.updated_at
+`;
+
 // API Routes
 
 // Get dashboard summary
@@ -55,12 +75,14 @@ app.get('/api/dashboard', async (req, res) => {
     const month = today.getMonth() + 1;
 
     // Get total balance
-    const accounts = await dbAll('SELECT * FROM accounts WHERE user_id = ?', [DEFAULT_USER_ID]);
-    const totalBalance = accounts.reduce((sum, acc) => sum + acc.balance, 0);
+    const accounts = await dbAll(`SELECT ${ACCOUNT_COLUMNS} FROM accounts WHERE user_id = ?`, [DEFAULT_USER_ID]);
+    const { total_balance: totalBalance } = await dbGet(
+      'SELECT COALESCE(SUM(balance), 0) / 100.0 as total_balance FROM accounts WHERE user_id = ?', [DEFAULT_USER_ID]
+    );
 
     // Get monthly summary
     const monthlySummary = await dbAll(`
-      SELECT txn_type, SUM(amount) as total
+      SELECT txn_type, SUM(amount) / 100.0 as total
       FROM transactions
       WHERE user_id = ? AND strftime('%Y', txn_date) = ? AND strftime('%m', txn_date) = ?
       GROUP BY txn_type
@@ -76,7 +98,7 @@ app.get('/api/dashboard', async (req, res) => {
 
     // Get spending by category
     const spendingByCategory = await dbAll(`
-      SELECT c.name, SUM(t.amount) as total
+      SELECT c.name, SUM(t.amount) / 100.0 as total
       FROM transactions t
       JOIN categories c ON t.category_id = c.category_id
       WHERE t.user_id = ? AND t.txn_type = 'expense'
@@ -104,7 +126,7 @@ app.get('/api/transactions', async (req, res) => {
     const { type, limit = 50 } = req.query;
     
     let query = `
-      SELECT t.*, 
+      SELECT ${TRANSACTION_COLUMNS}, 
              a.name as account_name,
              c.name as category_name,
              m.name as merchant_name
@@ -135,12 +157,13 @@ app.get('/api/transactions', async (req, res) => {
 // Add transaction
 app.post('/api/transactions', async (req, res) => {
   try {
-    const { account_id, txn_type, amount, txn_date, category_id, merchant_id, description, notes } = req.body;
+    const { account_id, txn_type, txn_date, category_id, merchant_id, description, notes } = req.body;
+    const amount = toPaise(req.body.amount);
     
     const result = await dbRun(`
-      INSERT INTO transactions (user_id, account_id, txn_type, amount, txn_date, category_id, merchant_id, description, notes)
-      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    `, [DEFAULT_USER_ID, account_id, txn_type, amount, txn_date, category_id || null, merchant_id || null, description || null, notes || null]);
+      INSERT INTO transactions (user_id, account_id, txn_type, amount, currency, txn_date, category_id, merchant_id, description, notes)
+      VALUES (?, ?, ?, ?, (SELECT currency FROM accounts WHERE account_id = ?), ?, ?, ?, ?, ?)
+    `, [DEFAULT_USER_ID, account_id, txn_type, amount, account_id, txn_date, category_id || null, merchant_id || null, description || null, notes || null]);
     
     // Update account balance
     const multiplier = txn_type === 'expense' ? -1 : 1;
@@ -180,7 +203,7 @@ app.delete('/api/transactions/:id', async (req, res) => {
 // Get accounts
 app.get('/api/accounts', async (req, res) => {
   try {
-    const accounts = await dbAll('SELECT * FROM accounts WHERE user_id = ?', [DEFAULT_USER_ID]);
+    const accounts = await dbAll(`SELECT ${ACCOUNT_COLUMNS} FROM accounts WHERE user_id = ?`, [DEFAULT_USER_ID]);
     res.json(accounts);
   } catch (error) {
     res.status(500).json({ error: error.message });
@@ -193,9 +216,9 @@ app.post('/api/accounts', async (req, res) => {
     const { name, type, balance, currency } = req.body;
     
     const result = await dbRun(`
-      INSERT INTO accounts (user_id, name, type, balance, currency)
-      VALUES (?, ?, ?, ?, ?)
-    `, [DEFAULT_USER_ID, name, type, balance || 0, currency || 'INR']);
+      INSERT INTO accounts (user_id, name, type, balance, opening_balance, currency)
+      VALUES (?, ?, ?, ?, ?, ?)
+    `, [DEFAULT_USER_ID, name, type, toPaise(balance || 0), toPaise(balance || 0), currency || 'INR']);
     
     res.json({ account_id: result.lastID, success: true });
   } catch (error) {
@@ -310,9 +333,9 @@ app.get('/api/analytics', async (req, res) => {
   try {
     const { start_date, end_date } = req.query;
     
-    // Get transactions in date range
+    // Get transactions in date range; amounts stay in paise until the totals are built
     const transactions = await dbAll(`
-      SELECT t.*, 
+      SELECT t.txn_type, t.amount, t.txn_date, 
              c.name as category_name,
              m.name as merchant_name
       FROM transactions t
@@ -352,12 +375,12 @@ app.get('/api/analytics', async (req, res) => {
     });
     
     res.json({
-      totalIncome,
-      totalExpense,
-      net: totalIncome - totalExpense,
-      categorySpending: Object.entries(categorySpending).map(([name, amount]) => ({ name, amount })).sort((a, b) => b.amount - a.amount),
-      merchantSpending: Object.entries(merchantSpending).map(([name, amount]) => ({ name, amount })).sort((a, b) => b.amount - a.amount).slice(0, 10),
-      dailySpending: Object.entries(dailySpending).map(([date, amount]) => ({ date, amount })).sort((a, b) => a.date.localeCompare(b.date))
+      totalIncome: toRupees(totalIncome),
+      totalExpense: toRupees(totalExpense),
+      net: toRupees(totalIncome - totalExpense),
+      categorySpending: Object.entries(categorySpending).map(([name, amount]) => ({ name, amount: toRupees(amount) })).sort((a, b) => b.amount - a.amount),
+      merchantSpending: Object.entries(merchantSpending).map(([name, amount]) => ({ name, amount: toRupees(amount) })).sort((a, b) => b.amount - a.amount).slice(0, 10),
+      dailySpending: Object.entries(dailySpending).map(([date, amount]) => ({ date, amount: toRupees(amount) })).sort((a, b) => a.date.localeCompare(b.date))
     });
   } catch (error) {
     res.status(500).json({ error: error.message });